@@ -6,6 +6,7 @@ from django.conf import settings
 from django.template.loader import render_to_string
 
 from crits.services.core import Service, ServiceConfigError
+from header_sniff import read_header
 
 # for logging, right ;-)
 logger = logging.getLogger(__name__)
@@ -38,11 +39,9 @@ class SEPLQService(Service):
     def valid_for(obj):
         if obj.filedata.grid_id == None:
             raise ServiceConfigError("Missing filedata.")
-        data = obj.filedata.read()
+        data = read_header(obj, 4)
         if len(data) < 4:
             raise ServiceConfigError("Need at least 4 bytes.")
-        # Reset the read pointer.
-        obj.filedata.seek(0)
         if not data[0:4] == b'\x90\x12\x00\x00':
             raise ServiceConfigError("Not a SEP Local Quarantine file")
         
@@ -6,7 +6,7 @@ logger = logging.getLogger(__name__)
 
 class ANBService(Service):
     name = "anb"
-    version = '0.0.1'
+    version = '0.0.3'
     template = None
     supported_types = ['Campaign']
     description = "Generate CSV data for Analyst's Notebook."
@@ -1,6 +1,8 @@
+import csv
+
 from django.conf import settings
 from crits.core.mongo_tools import mongo_connector
-from crits.core.class_mapper import class_from_id
+from crits.core.class_mapper import class_from_type
 from crits.core.handlers import collect_objects
 from crits.backdoors.backdoor import Backdoor
 from crits.emails.email import Email
@@ -10,15 +12,90 @@ from crits.ips.ip import IP
 from crits.domains.domain import Domain
 from crits.events.event import Event
 
+# Most IDs fetched by a single query.
+LOADER_CHUNK_SIZE = 1000
+
+class ObjectLoader(object):
+    """
+    Loads top-level objects for the length of one export.
+
+    Each document is fetched from the database at most once. IDs can be
+    fetched in batches of the same type ahead of time, and every object
+    loaded (or found to be missing) is remembered until the loader is
+    thrown away at the end of the request.
+    """
+
+    def __init__(self):
+        # (type, ID string) -> object, or None if it doesn't exist.
+        self.objects = {}
+
+    def add(self, type_, obj):
+        """
+        Remember an object that has already been loaded.
+        """
+
+        self.objects[(type_, str(obj.id))] = obj
+
+    def prefetch(self, type_, ids):
+        """
+        Load any of these objects not already loaded, with one query per
+        LOADER_CHUNK_SIZE IDs.
+        """
+
+        missing = set()
+        for id_ in ids:
+            if id_ and (type_, str(id_)) not in self.objects:
+                missing.add(str(id_))
+        if not missing:
+            return
+        klass = class_from_type(type_)
+        if klass:
+            missing = list(missing)
+            for i in xrange(0, len(missing), LOADER_CHUNK_SIZE):
+                chunk = missing[i:i + LOADER_CHUNK_SIZE]
+                for obj in klass.objects(id__in=chunk):
+                    self.add(type_, obj)
+        for id_ in missing:
+            self.objects.setdefault((type_, id_), None)
+
+    def get(self, type_, id_):
+        """
+        Get an object, loading it if it hasn't been already.
+
+        :returns: The object, or None if it doesn't exist.
+        """
+
+        key = (type_, str(id_))
+        if key not in self.objects:
+            self.prefetch(type_, [id_])
+        return self.objects.get(key)
+
+def related_ids(relationships, type_):
+    return [r.object_id for r in relationships if r.rel_type == type_]
+
 def source_match(item_source, sources):
     for source in item_source:
         if source.name in sources:
             return True
     return False
 
-def get_md5_objects(oid, sources, md5_list=[], x=0):
+def find_backdoor(obj, sources, loader):
+    # Walk the relationships on this sample, see if it is related to
+    # a backdoor. Take the first backdoor that comes up, it may or
+    # may not be the versioned one.
+    loader.prefetch('Backdoor', related_ids(obj.relationships, 'Backdoor'))
+    for rel in obj.relationships:
+        if rel.rel_type == 'Backdoor':
+            backdoor = loader.get('Backdoor', rel.object_id)
+            if backdoor and source_match(backdoor.source, sources):
+                return backdoor.name
+    return "None"
+
+def get_md5_objects(oid, sources, loader, md5_list=None, x=0):
     obj_list = []
-    s = class_from_id('Sample', oid)
+    if md5_list is None:
+        md5_list = []
+    s = loader.get('Sample', oid)
     if not s:
         return obj_list
 
@@ -30,54 +107,91 @@ def get_md5_objects(oid, sources, md5_list=[], x=0):
     for o in s.obj:
         if o.name in ['Domain Name', 'ipv4-addr', 'URL'] and source_match(o.source, sources):
             obj_list.append(o.value)
+    if x >= 1:
+        return obj_list
+    loader.prefetch('Sample', related_ids(s.relationships, 'Sample'))
     for r in s.relationships:
         if r.rel_type == 'Sample':
-            s2 = class_from_id('Sample', r.object_id)
+            s2 = loader.get('Sample', r.object_id)
             if not s2:
                 continue
 
             if not source_match(s2.source, sources):
                 continue
 
-            if s2.md5 not in md5_list and x < 1:
-                obj_list += get_md5_objects(r.object_id, sources, md5_list, x + 1)
+            if s2.md5 not in md5_list:
+                obj_list += get_md5_objects(r.object_id, sources, loader,
+                                            md5_list, x + 1)
     return obj_list
 
-def get_sample_rels(rel, eid, sources):
+def get_sample_rels(rel, eid, sources, loader):
     s_list = []
+    loader.prefetch('Sample', related_ids(rel, 'Sample'))
     for r in rel:
         if r.rel_type == 'Sample':
-            s = class_from_id(r.rel_type, r.object_id)
+            s = loader.get(r.rel_type, r.object_id)
             if not s:
                 continue
 
             if not source_match(s.source, sources):
                 continue
 
-            obj_list = get_md5_objects(r.object_id, sources)
-            # Walk the relationships on this sample, see if it is related to
-            # a backdoor. Take the first backdoor that comes up, it may or
-            # may not be the versioned one.
-            backdoor_name = "None"
-            for sample_r in s.relationships:
-                if sample_r.rel_type == 'Backdoor':
-                    backdoor = Backdoor.objects(id=sample_r.object_id).first()
-                    if backdoor and source_match(backdoor.source, sources):
-                        backdoor_name = backdoor.name
-                        break
+            obj_list = get_md5_objects(r.object_id, sources, loader)
             s_list.append({
                 'md5': s.md5,
                 'email_id': eid,
                 'mimetype': s.mimetype,
                 'filename': s.filename,
-                'backdoor': backdoor_name,
+                'backdoor': find_backdoor(s, sources, loader),
                 'objects':  obj_list,
                 })
     return s_list
 
-# Given an event ID grab all related objects and generate CSV output for
+# The CSVs generated for each type of object, in the order they are shown.
+ANB_SECTIONS = {
+    'Campaign': ['emails', 'samples', 'objects'],
+    'Event': ['events', 'emails', 'samples', 'objects', 'indicators', 'ips',
+              'domains'],
+}
+
+class Echo(object):
+    """
+    A file-like object which hands back whatever is written to it, so
+    csv.writer can format one row at a time.
+    """
+
+    def write(self, value):
+        return value
+
+def csv_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return "%s" % value
+
+def csv_lines(rows):
+    """
+    Format rows as CSV lines.
+
+    :param rows: The rows to format.
+    :type rows: iterable of tuples
+    :returns: generator of str
+    """
+
+    writer = csv.writer(Echo(), lineterminator='\r\n')
+    for row in rows:
+        yield writer.writerow([csv_value(v) for v in row])
+
+# Given an event ID grab all related objects and generate CSV rows for
 # them. Do not recurse any deeper than that in collect_objects.
-def generate_anb_event_data(type_, cid, data, sources):
+def generate_anb_event_rows(type_, cid, sources, sections, loader):
+    """
+    Generate the CSV rows for everything related to an object.
+
+    :param sections: The CSVs to generate rows for.
+    :type sections: set
+    :returns: generator of (section, row)
+    """
+
     types = ['Email', 'Sample', 'Indicator', 'IP', 'Domain', 'Event']
     related_objects = collect_objects(type_,
                                       cid,
@@ -88,130 +202,147 @@ def generate_anb_event_data(type_, cid, data, sources):
                                       sources,
                                       need_filedata=False)
 
+    backdoor_ids = []
     for (obj_id, (obj_type, obj)) in related_objects.iteritems():
-        if obj_type == 'Email':
-            data['emails'] += "%s,%s,%s,%s,%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.isodate,
-                obj.sender,
-                obj.subject,
-                obj.x_originating_ip,
-                obj.x_mailer)
+        loader.add(obj_type, obj)
+        if obj_type == 'Sample':
+            backdoor_ids.extend(related_ids(obj.relationships, 'Backdoor'))
+    if 'samples' in sections:
+        loader.prefetch('Backdoor', backdoor_ids)
+
+    for (obj_id, (obj_type, obj)) in related_objects.iteritems():
+        if obj_type == 'Email' and 'emails' in sections:
+            yield ('emails', (cid,
+                              obj_id,
+                              obj.isodate,
+                              obj.sender,
+                              obj.subject,
+                              obj.x_originating_ip,
+                              obj.x_mailer))
         elif obj_type == 'Sample':
-            # Walk the relationships on this sample, see if it is related to
-            # a backdoor. Take the first backdoor that comes up, it may or
-            # may not be the versioned one.
-            backdoor_name = "None"
-            for rel in obj.relationships:
-                if rel.rel_type == 'Backdoor':
-                    backdoor = Backdoor.objects(id=rel.object_id).first()
-                    if backdoor and source_match(backdoor.source, sources):
-                        backdoor_name = backdoor.name
-                        break
-            data['samples'] += "%s,%s,%s,%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.md5,
-                obj.mimetype,
-                obj.filename,
-                backdoor_name)
-            for inner_obj in obj.obj:
-                data['objects'] += "%s,%s,%s\r\n" % (
-                    obj_id,
-                    inner_obj.object_type,
-                    inner_obj.value)
-        elif obj_type == 'Indicator':
-            data['indicators'] += "%s,%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.ind_type,
-                obj.value)
-        elif obj_type == 'IP':
-            data['ips'] += "%s,%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.ip_type,
-                obj.ip)
-        elif obj_type == 'Domain':
-            data['domains'] += "%s,%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.record_type,
-                obj.domain)
-        elif obj_type == 'Event':
-            data['events'] += "%s,%s,%s\r\n" % (
-                cid,
-                obj_id,
-                obj.title)
-    return data
-
-def execute_anb_event(cid, sources):
-    data = {
-             'emails': '',
-             'samples': '',
-             'objects': '',
-             'events': '',
-             'domains': '',
-             'indicators': '',
-             'ips': ''
-           }
+            if 'samples' in sections:
+                yield ('samples', (cid,
+                                   obj_id,
+                                   obj.md5,
+                                   obj.mimetype,
+                                   obj.filename,
+                                   find_backdoor(obj, sources, loader)))
+            if 'objects' in sections:
+                for inner_obj in obj.obj:
+                    yield ('objects', (obj_id,
+                                       inner_obj.object_type,
+                                       inner_obj.value))
+        elif obj_type == 'Indicator' and 'indicators' in sections:
+            yield ('indicators', (cid,
+                                  obj_id,
+                                  obj.ind_type,
+                                  obj.value))
+        elif obj_type == 'IP' and 'ips' in sections:
+            yield ('ips', (cid,
+                           obj_id,
+                           obj.ip_type,
+                           obj.ip))
+        elif obj_type == 'Domain' and 'domains' in sections:
+            yield ('domains', (cid,
+                               obj_id,
+                               obj.record_type,
+                               obj.domain))
+        elif obj_type == 'Event' and 'events' in sections:
+            yield ('events', (cid,
+                              obj_id,
+                              obj.title))
 
+def anb_event_rows(cid, sources, sections, loader):
     crits_event = Event.objects(id=cid, source__name__in=sources).first()
     if not crits_event:
-        return data
+        return iter([])
 
-    generate_anb_event_data('Event', crits_event.id, data, sources)
-
-    return data
+    return generate_anb_event_rows('Event', crits_event.id, sources, sections,
+                                   loader)
 
 # Get every email in the campaign first, then walk each email looking for
 # samples related to the email. Then get objects for those samples.
-def execute_anb_campaign(cid, sources):
-    data = {'emails': '', 'samples': '', 'objects': ''}
-
+def anb_campaign_rows(cid, sources, sections, loader):
     email_list = Email.objects(campaign__name=cid, source__name__in=sources)
-    if not email_list:
-        return data
 
-    md5_list = []
-
-    for email in email_list:
-        md5_list = get_sample_rels(email.relationships, str(email.id), sources)
+    for email in email_list.no_cache():
+        if 'samples' in sections or 'objects' in sections:
+            md5_list = get_sample_rels(email.relationships, str(email.id),
+                                       sources, loader)
+        else:
+            md5_list = []
         email.sanitize_sources(sources=sources)
 
-        data['emails'] += "%s,%s,%s,%s,%s,%s,%s,%s\r\n" % (
-            email.id,
-            email.isodate,
-            email.sender,
-            email.subject,
-            email.x_originating_ip,
-            email.x_mailer,
-            email.source[0].name,
-            email.campaign[0].name)
+        if 'emails' in sections:
+            yield ('emails', (email.id,
+                              email.isodate,
+                              email.sender,
+                              email.subject,
+                              email.x_originating_ip,
+                              email.x_mailer,
+                              email.source[0].name,
+                              email.campaign[0].name))
 
         for m in md5_list:
-            data['samples'] += "%s,%s,%s,%s,%s\r\n" % (
-                m['email_id'],
-                m['md5'],
-                m['mimetype'],
-                m['backdoor'],
-                m['filename'])
-            for o in m.get('objects', []):
-                data['objects'] += "%s,%s\r\n" % (m['md5'], o)
+            if 'samples' in sections:
+                yield ('samples', (m['email_id'],
+                                   m['md5'],
+                                   m['mimetype'],
+                                   m['backdoor'],
+                                   m['filename']))
+            if 'objects' in sections:
+                for o in m.get('objects', []):
+                    yield ('objects', (m['md5'], o))
 
-    return data
+def anb_rows(ctype, cid, sources, sections=None):
+    """
+    Generate the CSV rows for a Campaign or Event.
 
-def execute_anb(ctype, cid, sources):
-    data = {
-             'emails': '',
-             'samples': '',
-             'objects': ''
-           }
+    :param ctype: "Campaign" or "Event".
+    :type ctype: str
+    :param cid: The Campaign name or Event ObjectId.
+    :type cid: str
+    :param sources: The sources the user has access to.
+    :type sources: list
+    :param sections: The CSVs to generate rows for, all of them if None.
+    :type sections: list
+    :returns: generator of (section, row)
+    """
 
+    if sections is None:
+        sections = ANB_SECTIONS.get(ctype, [])
+    sections = set(sections)
+    # Objects are shared between emails and samples, so load each of them
+    # once for the whole export.
+    loader = ObjectLoader()
     if ctype == 'Campaign':
-        return execute_anb_campaign(cid, sources)
+        return anb_campaign_rows(cid, sources, sections, loader)
     elif ctype == 'Event':
-        return execute_anb_event(cid, sources)
+        return anb_event_rows(cid, sources, sections, loader)
     else:
-        return data
+        return iter([])
+
+def anb_csv(ctype, cid, sources, section):
+    """
+    Generate one CSV for a Campaign or Event a line at a time.
+
+    :param section: The CSV to generate, one of ANB_SECTIONS[ctype].
+    :type section: str
+    :returns: generator of str
+    """
+
+    rows = anb_rows(ctype, cid, sources, [section])
+    return csv_lines(row for (s, row) in rows)
+
+def execute_anb(ctype, cid, sources):
+    """
+    Generate every CSV for a Campaign or Event.
+
+    :returns: dict of section -> CSV text
+    """
+
+    data = dict((section, []) for section in ANB_SECTIONS.get(ctype, []))
+    writer = csv.writer(Echo(), lineterminator='\r\n')
+    for (section, row) in anb_rows(ctype, cid, sources):
+        data[section].append(writer.writerow([csv_value(v) for v in row]))
+    return dict((section, ''.join(lines)) for (section, lines) in data.iteritems())
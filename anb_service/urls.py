@@ -1,5 +1,6 @@
 from django.conf.urls import patterns
 
 urlpatterns = patterns('anb_service.views',
+    (r'^csv/(?P<ctype>\w+)/(?P<cid>.+?)/(?P<section>\w+)/$', 'get_anb_csv'),
     (r'^(?P<ctype>.+?)/(?P<cid>.+?)/$', 'get_anb_data'),
 )
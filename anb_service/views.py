@@ -1,6 +1,7 @@
 import json
 
 from django.contrib.auth.decorators import user_passes_test
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import HttpResponse
 
 from crits.core.user_tools import user_can_view_data, user_sources
@@ -23,3 +24,21 @@ def get_anb_data(request, ctype, cid):
             break
 
     return HttpResponse(json.dumps(result), mimetype="application/json")
+
+@user_passes_test(user_can_view_data)
+def get_anb_csv(request, ctype, cid, section):
+    """
+    Download one of the CSVs for a Campaign or Event. The CSV is streamed
+    as it is generated rather than built up in memory first.
+    """
+
+    if section not in handlers.ANB_SECTIONS.get(ctype, []):
+        raise Http404
+
+    sources = user_sources("%s" % request.user)
+    response = StreamingHttpResponse(handlers.anb_csv(ctype, cid, sources,
+                                                      section),
+                                     content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename="%s_%s.csv"' % (
+        ctype.lower(), section)
+    return response
@@ -10,9 +10,12 @@ from . import forms
 
 class CarverService(Service):
     name = "carver"
-    version = '0.0.1'
+    version = '0.1.0'
     supported_types = ['Sample']
-    description = "Carve a chunk out of a sample."
+    description = "Carve one or more chunks out of a sample."
+
+    # Most carves allowed in one run.
+    max_carves = 1000
 
     @staticmethod
     def get_config(existing_config):
@@ -29,7 +32,10 @@ class CarverService(Service):
     def bind_runtime_form(analyst, config):
         if config:
             # The values are submitted as a list for some reason.
-            data = {'start': config['start'][0], 'end': config['end'][0]}
+            data = {}
+            for name in forms.CarverRunForm().fields:
+                if name in config:
+                    data[name] = config[name][0]
         else:
             data = {}
             fields = forms.CarverRunForm().fields
@@ -45,26 +51,91 @@ class CarverService(Service):
                                  'crits_type': crits_type,
                                  'identifier': identifier})
 
+    @staticmethod
+    def find_magic(data, magic):
+        """
+        Return a (start, end) range from each occurrence of magic to the
+        next one, the last running to the end of the data.
+
+        At most one more than max_carves ranges are returned, enough for
+        the caller to tell there were too many.
+        """
+
+        offsets = []
+        offset = data.find(magic)
+        while offset != -1 and len(offsets) <= CarverService.max_carves:
+            offsets.append(offset)
+            offset = data.find(magic, offset + 1)
+        ends = offsets[1:] + [len(data)]
+        return zip(offsets, ends)
+
     def run(self, obj, config):
-        start_offset = config['start']
-        end_offset = config['end']
+        # The sample is read once no matter how many ranges are carved.
+        data = obj.filedata.read()
+        if config.get('magic'):
+            ranges = self.find_magic(data, config['magic'].decode('hex'))
+            if not ranges:
+                self._error("Magic not found.")
+                return
+        elif config.get('ranges'):
+            ranges = config['ranges']
+        else:
+            ranges = [(config['start'], config['end'])]
+
+        if len(ranges) > self.max_carves:
+            self._error("Too many ranges (limit is %d)." % self.max_carves)
+            return
+
         # Start must be 0 or higher. If end is greater than zero it must
         # also be greater than start_offset.
-        if start_offset < 0 or (end_offset > 0 and start_offset > end_offset):
-            self._error("Invalid offsets.")
-            return
+        for (start_offset, end_offset) in ranges:
+            if start_offset < 0 or (end_offset > 0 and start_offset > end_offset):
+                self._error("Invalid offsets (%d:%d)." % (start_offset, end_offset))
+                return
 
-        data = obj.filedata.read()[start_offset:end_offset]
-        if not data:
-            self._error("No data.")
-        else:
-            filename = hashlib.md5(data).hexdigest()
-            handle_file(filename, data, obj.source,
-                        related_id=str(obj.id),
-                        campaign=obj.campaign,
-                        method=self.name,
-                        relationship=RelationshipTypes.CONTAINS,
-                        user=self.current_task.username)
+        seen = set()
+        added = []
+        for (start_offset, end_offset) in ranges:
+            carved = data[start_offset:end_offset]
+            if not carved:
+                self._error("No data (%d:%d)." % (start_offset, end_offset))
+                continue
+            filename = hashlib.md5(carved).hexdigest()
+            # A carve of the whole sample would be related to itself.
+            if filename == obj.md5:
+                self._info("Range %d:%d is the whole sample, skipped." %
+                           (start_offset, end_offset))
+                continue
+            # Identical carves are only added once.
+            if filename in seen:
+                continue
+            seen.add(filename)
+            result = handle_file(filename, carved, obj.source,
+                                 campaign=obj.campaign,
+                                 method=self.name,
+                                 user=self.current_task.username,
+                                 md5_digest=filename,
+                                 is_return_only_md5=False)
+            if not result.get('success'):
+                self._error("Unable to add %s: %s" % (filename,
+                                                      result.get('message', '')))
+                continue
+            added.append(result['object'])
             # Filename is just the md5 of the data...
-            self._add_result("file_added", filename, {'md5': filename})
+            self._add_result("file_added", filename,
+                             {'md5': filename,
+                              'start': start_offset,
+                              'end': end_offset})
+
+        # The sample is saved once with all of its new relationships. Each
+        # carve, already saved by handle_file, is saved again for its side.
+        username = self.current_task.username
+        for sample in added:
+            obj.add_relationship(sample,
+                                 rel_type=RelationshipTypes.CONTAINS,
+                                 analyst=username)
+        if added:
+            obj.save(username=username)
+            for sample in added:
+                sample.save(username=username)
         return
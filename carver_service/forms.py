@@ -9,6 +9,44 @@ class CarverRunForm(forms.Form):
     end = forms.IntegerField(required=True,
                              label="End offset",
                              initial=0)
+    ranges = forms.CharField(required=False,
+                             label="Ranges",
+                             initial='',
+                             widget=forms.Textarea(attrs={'cols': 40,
+                                                          'rows': 6}),
+                             help_text="Newline separated list of start:end "
+                                       "offsets. Used instead of start and "
+                                       "end offset if given.")
+    magic = forms.CharField(required=False,
+                            label="Magic",
+                            initial='',
+                            widget=forms.TextInput(),
+                            help_text="Hex bytes (eg: 4d5a). Carve from each "
+                                      "occurrence to the next one, or the "
+                                      "end of the sample.")
 
     def __init__(self, *args, **kwargs):
         super(CarverRunForm, self).__init__(*args, **kwargs)
+
+    def clean_ranges(self):
+        ranges = []
+        for line in self.cleaned_data['ranges'].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                (start, end) = [int(x) for x in line.split(':')]
+            except ValueError:
+                raise forms.ValidationError("Invalid range: %s" % line)
+            ranges.append((start, end))
+        return ranges
+
+    def clean_magic(self):
+        # Kept as hex so the config can be stored as is, the bytes may not
+        # be valid BSON strings.
+        magic = self.cleaned_data['magic'].strip().replace(' ', '')
+        try:
+            magic.decode('hex')
+        except TypeError:
+            raise forms.ValidationError("Magic must be hex.")
+        return magic
@@ -12,6 +12,8 @@ from crits.services.core import Service, ServiceConfigError
 from crits.samples.handlers import handle_file
 from crits.vocabulary.relationships import RelationshipTypes
 
+from header_sniff import read_header
+
 from . import forms
 
 logger = logging.getLogger(__name__)
@@ -58,9 +60,7 @@ class CHMInfoService(Service):
     def valid_for(obj):
         chm_magic = '\x49\x54\x53\x46\x03\x00\x00\x00\x60\x00\x00\x00'
         if obj.filedata != None:
-            data = obj.filedata.read()
-            # Need to reset the read pointer.
-            obj.filedata.seek(0)
+            data = read_header(obj, len(chm_magic))
             if data.startswith(chm_magic):
                 return
         raise ServiceConfigError("Not a valid ITSF (CHM) file.")
@@ -1,15 +1,20 @@
 import re
+import time
 import logging
 
+from django.template.loader import render_to_string
+
 from crits.services.core import Service, ServiceConfigError
 from crits.events.event import Event
 from crits.raw_data.raw_data import RawData
 from crits.samples.sample import Sample
 from crits.domains.domain import TLD
 from crits.indicators.indicator import Indicator
-from crits.core.data_tools import make_ascii_strings
 from crits.vocabulary.indicators import IndicatorTypes
 
+from indicator_sweep import get_indicator_sweep, HAVE_AHOCORASICK
+from . import forms
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,140 +28,352 @@ class DataMinerService(Service):
     """
 
     name = "DataMiner"
-    version = '1.0.0'
+    version = '1.1.0'
     template = "data_miner_service_template.html"
     supported_types = ['Event', 'RawData', 'Sample']
     description = "Mine a chunk of data for useful information."
 
+    # Result sections for extracted values checked against Indicators.
+    indicator_sections = [
+        ('Potential IP Address', IndicatorTypes.IPV4_ADDRESS),
+        ('Potential Domains', IndicatorTypes.DOMAIN),
+        ('Potential Emails', IndicatorTypes.EMAIL_ADDRESS),
+    ]
+
+    # Sample fields to check each type of extracted hash against.
+    hash_fields = [
+        (IndicatorTypes.MD5, 'md5'),
+        (IndicatorTypes.SHA1, 'sha1'),
+        (IndicatorTypes.SHA256, 'sha256'),
+        (IndicatorTypes.SSDEEP, 'ssdeep'),
+    ]
+
     @staticmethod
     def valid_for(obj):
         if isinstance(obj, Sample):
             if obj.filedata.grid_id == None:
                 raise ServiceConfigError("Missing filedata.")
 
+    @staticmethod
+    def bind_runtime_form(analyst, config):
+        if 'sweep_indicators' not in config:
+            config['sweep_indicators'] = False
+        return forms.DataMinerRunForm(config)
+
+    @classmethod
+    def generate_runtime_form(self, analyst, config, crits_type, identifier):
+        return render_to_string('services_run_form.html',
+                                {'name': self.name,
+                                 'form': forms.DataMinerRunForm(),
+                                 'crits_type': crits_type,
+                                 'identifier': identifier})
+
     def run(self, obj, config):
         if isinstance(obj, Event):
-            data = obj.description
+            chunks = [obj.description]
         elif isinstance(obj, RawData):
-            data = obj.data
+            chunks = [obj.data]
         elif isinstance(obj, Sample):
-            samp_data = obj.filedata.read()
-            data = make_ascii_strings(data=samp_data)
-            if not data:
-                self._debug("Could not find sample data to parse.")
-                return
+            # The sample is read a GridFS chunk at a time and only its ASCII
+            # and UTF-16LE strings are scanned, so memory use doesn't grow
+            # with the size of the sample.
+            strings = iter_strings(iter_file_chunks(obj.filedata))
+            chunks = join_strings(strings)
         else:
             self._debug("This type is not supported by this service.")
             return
 
-        ips = extract_ips(data)
-        for ip in ips:
-            tdict = {'Type': IndicatorTypes.IPV4_ADDRESS}
-            id_ = Indicator.objects(value=ip).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential IP Address', ip, tdict)
-        domains = extract_domains(data)
-        for domain in domains:
-            tdict = {'Type': IndicatorTypes.DOMAIN}
-            id_ =  Indicator.objects(value=domain).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential Domains', domain, tdict)
-        emails = extract_emails(data)
-        for email in emails:
-            tdict = {'Type': IndicatorTypes.EMAIL_ADDRESS}
-            id_ = Indicator.objects(value=email).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential Emails', email, tdict)
-        hashes = extract_hashes(data)
-        for hash_ in hashes:
-            type_ = hash_[0]
-            val = hash_[1]
-            tdict = {'Type': type_}
-            if type_ == IndicatorTypes.MD5:
-                id_ = Sample.objects(md5=val).only('id').first()
-            elif type_ == IndicatorTypes.SHA1:
-                id_ = Sample.objects(sha1=val).only('id').first()
-            elif type_ == IndicatorTypes.SHA256:
-                id_ = Sample.objects(sha256=val).only('id').first()
-            elif type_ == IndicatorTypes.SSDEEP:
-                id_ = Sample.objects(ssdeep=val).only('id').first()
-            else:
-                id_ = None
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential Samples', val, tdict)
-
-# hack of a parser to extract potential ip addresses from data
-def extract_ips(data):
-    pattern = r"((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)([ (\[]?(\.|dot)[ )\]]?(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3})"
-    ips = [each[0] for each in re.findall(pattern, data)]
-    for item in ips:
-        location = ips.index(item)
-        ip = re.sub("[ ()\[\]]", "", item)
-        ip = re.sub("dot", ".", ip)
-        ips.remove(item)
-        ips.insert(location, ip)
-    return ips
-
-# hack of a parser to extract potential domains from data
-def extract_domains(data):
-    pattern = r'[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
-    domains = [each for each in re.findall(pattern, data) if len(each) > 0]
-    final_domains = []
-    for item in domains:
-        if len(item) > 1 and item.find('.') != -1:
-            try:
-                tld = item.split(".")[-1]
-                check = TLD.objects(tld=tld).first()
-                if check:
-                    final_domains.append(item)
-            except:
-                pass
-    return final_domains
-
-# hack of a parser to extract potential emails from data
-def extract_emails(data):
-    pattern = r'[a-zA-Z0-9-\.\+]+@.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
-    emails = [each for each in re.findall(pattern, data) if len(each) > 0]
-    final_emails = []
-    for item in emails:
-        if len(item) > 1 and item.find('.') != -1:
-            try:
-                tld = item.split(".")[-1]
-                check = TLD.objects(tld=tld).first()
-                if check:
-                    final_emails.append(item)
-            except:
-                pass
-    return final_emails
-
-# hack of a parser to extract potential domains from data
-def extract_hashes(data):
-
-    re_md5 = re.compile("\\b[a-f0-9]{32}\\b", re.I | re.S | re.M)
-    re_sha1 = re.compile("\\b[a-f0-9]{40}\\b", re.I | re.S | re.M)
-    re_sha256 = re.compile("\\b[a-f0-9]{64}\\b", re.I | re.S | re.M)
-    re_ssdeep = re.compile("\\b\\d{2}:[A-Za-z0-9/+]{3,}:[A-Za-z0-9/+]{3,}\\b", re.I | re.S | re.M)
-
-    final_hashes = []
-    md5 = IndicatorTypes.MD5
-    sha1 = IndicatorTypes.SHA1
-    sha256 = IndicatorTypes.SHA256
-    ssdeep = IndicatorTypes.SSDEEP
-    final_hashes.extend(
-        [(md5,each) for each in re.findall(re_md5, data) if len(each) > 0]
-    )
-    final_hashes.extend(
-        [(sha1,each) for each in re.findall(re_sha1, data) if len(each) > 0]
-    )
-    final_hashes.extend(
-        [(sha256,each) for each in re.findall(re_sha256, data) if len(each) > 0]
-    )
-    final_hashes.extend(
-        [(ssdeep,each) for each in re.findall(re_ssdeep, data) if len(each) > 0]
-    )
-    return final_hashes
+        # The data is read once and every IOC type is searched for in each
+        # chunk. Candidates come back deduplicated and are looked up in bulk so a string heavy
+        # sample doesn't cost a query per match.
+        found = {}
+        for (type_, value) in scan_iocs(chunks):
+            found.setdefault(type_, []).append(value)
+
+        for (section, type_) in self.indicator_sections:
+            values = found.get(type_, [])
+            existing = lookup_existing(Indicator, 'value', values)
+            for value in values:
+                tdict = {'Type': type_}
+                if value in existing:
+                    tdict['exists'] = existing[value]
+                self._add_result(section, value, tdict)
+
+        for (type_, field) in self.hash_fields:
+            values = found.get(type_, [])
+            existing = lookup_existing(Sample, field, values)
+            for value in values:
+                tdict = {'Type': type_}
+                if value in existing:
+                    tdict['exists'] = existing[value]
+                self._add_result('Potential Samples', value, tdict)
+
+        if config.get('sweep_indicators'):
+            self._sweep_indicators(obj)
+
+    def _sweep_indicators(self, obj):
+        """
+        Report every existing Indicator whose value appears in the object,
+        in one pass over its data.
+        """
+
+        if not HAVE_AHOCORASICK:
+            self._error("Known indicators needs the pyahocorasick package.")
+            return
+
+        # The automaton matches bytes, and the text fields come back from
+        # Mongo as unicode.
+        if isinstance(obj, Event):
+            chunks = [obj.description.encode('utf-8')]
+        elif isinstance(obj, RawData):
+            chunks = [obj.data.encode('utf-8')]
+        else:
+            chunks = iter_file_chunks(obj.filedata)
+
+        sweep = get_indicator_sweep()
+        for (offset, id_, value, ind_type) in sweep.scan(chunks):
+            tdict = {'Type': ind_type, 'exists': id_, 'offset': offset}
+            self._add_result('Known Indicators', value, tdict)
+
+# Number of values sent in a single $in query.
+LOOKUP_CHUNK_SIZE = 1000
+
+def lookup_existing(klass, field, values):
+    """
+    Find which values already exist in the database.
+
+    The values are resolved with one $in query per chunk of
+    LOOKUP_CHUNK_SIZE, projected to the id and the field being matched.
+
+    :param klass: The document class to query.
+    :type klass: class
+    :param field: The field to match values against.
+    :type field: str
+    :param values: The values to look for.
+    :type values: list
+    :returns: dict mapping each value found to the string id of the first
+              matching document.
+    """
+
+    found = {}
+    for i in xrange(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[i:i + LOOKUP_CHUNK_SIZE]
+        query = {'%s__in' % field: chunk}
+        for doc in klass.objects(**query).only('id', field):
+            found.setdefault(getattr(doc, field), str(doc.id))
+    return found
+
+_defang_brackets = re.compile(r"[ ()\[\]]")
+
+def refang_ip(ip):
+    """
+    Turn a defanged IP such as "10 (dot) 1 [.] 2.3" back into "10.1.2.3".
+    """
+
+    return _defang_brackets.sub("", ip).replace("dot", ".")
+
+# Seconds before the TLD set is reloaded from the database.
+TLD_CACHE_TTL = 300
+
+_tld_cache = {'tlds': None, 'loaded': 0}
+
+def get_tlds():
+    """
+    Return the set of known TLDs.
+
+    The TLD collection is loaded once per process and reloaded after
+    TLD_CACHE_TTL seconds, so validating matches needs no database access.
+
+    :returns: frozenset
+    """
+
+    now = time.time()
+    if (_tld_cache['tlds'] is None or
+        now - _tld_cache['loaded'] > TLD_CACHE_TTL):
+        try:
+            tlds = frozenset(t.tld for t in TLD.objects.only('tld'))
+        except Exception, e:
+            logger.error("Unable to load TLDs: %s" % e)
+            # Keep using the old set if there is one.
+            tlds = _tld_cache['tlds'] or frozenset()
+        _tld_cache['tlds'] = tlds
+        _tld_cache['loaded'] = now
+    return _tld_cache['tlds']
+
+# Bytes of the previous chunk kept when scanning a stream, so an IOC split
+# across a chunk boundary is still found whole. It bounds how long a single
+# match can be.
+SCAN_OVERLAP = 4096
+
+# Each IOC type has its own pattern and is searched for in its own pass, so
+# overlapping IOCs of different types (a hash inside a host name, the domain
+# part of an email address) are all found.
+IOC_PATTERNS = [
+    (IndicatorTypes.IPV4_ADDRESS, re.compile(r"(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)(?:[ (\[]?(?:\.|dot)[ )\]]?(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3}")),
+    (IndicatorTypes.DOMAIN, re.compile(r'[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}')),
+    (IndicatorTypes.EMAIL_ADDRESS, re.compile(r'[a-zA-Z0-9-\.\+]+@.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}')),
+    (IndicatorTypes.MD5, re.compile(r"\b[a-fA-F0-9]{32}\b")),
+    (IndicatorTypes.SHA1, re.compile(r"\b[a-fA-F0-9]{40}\b")),
+    (IndicatorTypes.SHA256, re.compile(r"\b[a-fA-F0-9]{64}\b")),
+    (IndicatorTypes.SSDEEP, re.compile(r"\b\d{2}:[A-Za-z0-9/+]{3,}:[A-Za-z0-9/+]{3,}\b")),
+]
+
+def _has_known_tld(value, tlds):
+    return (len(value) > 1 and value.find('.') != -1 and
+            value.split(".")[-1] in tlds)
+
+def scan_iocs(chunks, overlap=SCAN_OVERLAP):
+    """
+    Find IPs, domains, emails and hashes in a stream of text.
+
+    Each chunk is searched once per IOC type. The last `overlap` bytes
+    of the buffer are held back until the next chunk arrives, so memory use
+    depends on the chunk size rather than the size of the input. Defanged
+    IPs are normalized and each (type, value) pair is only yielded the first
+    time it is seen.
+
+    :param chunks: An iterable of strings.
+    :type chunks: iterable
+    :param overlap: The longest match guaranteed to survive a chunk boundary.
+    :type overlap: int
+    :returns: generator of (IndicatorTypes value, str) tuples
+    """
+
+    tlds = get_tlds()
+    seen = set()
+    buf = ''
+    # Per IOC type, where in buf the next search starts.
+    pos = [0] * len(IOC_PATTERNS)
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        buf += chunk
+        chunk = next(chunks, None)
+        # Matches starting past limit may be cut off by the end of the
+        # buffer, leave them for the next round.
+        if chunk is None:
+            limit = len(buf)
+        else:
+            limit = len(buf) - overlap
+        for (i, (type_, pattern)) in enumerate(IOC_PATTERNS):
+            for match in pattern.finditer(buf, pos[i]):
+                if match.start() >= limit:
+                    break
+                pos[i] = match.end()
+                value = match.group()
+                if type_ == IndicatorTypes.IPV4_ADDRESS:
+                    value = refang_ip(value)
+                elif type_ in (IndicatorTypes.DOMAIN,
+                               IndicatorTypes.EMAIL_ADDRESS):
+                    if not _has_known_tld(value, tlds):
+                        continue
+                if (type_, value) not in seen:
+                    seen.add((type_, value))
+                    yield (type_, value)
+            pos[i] = max(pos[i], limit)
+        # Keep one byte before the earliest position so word boundaries
+        # still work.
+        keep = max(min(pos) - 1, 0)
+        buf = buf[keep:]
+        pos = [p - keep for p in pos]
+
+# Read size used when the file doesn't say what its GridFS chunk size is.
+DEFAULT_READ_SIZE = 255 * 1024
+
+# Shortest run of characters reported as a string.
+STRINGS_MIN_LENGTH = 4
+
+# Longest string kept whole. Longer runs are reported in pieces so a huge
+# run of text can't make the buffer grow without bound. Consecutive pieces
+# share SCAN_OVERLAP characters so an IOC cut by the split is still whole in
+# one of them.
+STRINGS_MAX_LENGTH = 64 * 1024
+
+def iter_file_chunks(filedata):
+    """
+    Read a GridFS file one chunk at a time.
+
+    :param filedata: The GridFS file to read.
+    :returns: generator of str
+    """
+
+    size = getattr(filedata, 'chunk_size', None) or DEFAULT_READ_SIZE
+    filedata.seek(0)
+    while True:
+        chunk = filedata.read(size)
+        if not chunk:
+            break
+        yield chunk
+    filedata.seek(0)
+
+def iter_strings(chunks, min_length=STRINGS_MIN_LENGTH):
+    """
+    Find printable ASCII and UTF-16LE strings in a stream of bytes.
+
+    Runs that reach the end of a chunk are held back until the next chunk
+    arrives, so strings spanning a boundary come back whole. Strings are
+    not yielded in strict offset order.
+
+    :param chunks: An iterable of strings.
+    :type chunks: iterable
+    :param min_length: The shortest run of characters to report.
+    :type min_length: int
+    :returns: generator of (encoding, str) tuples where encoding is 'ascii'
+              or 'utf-16le' and str is always the ASCII text.
+    """
+
+    patterns = [
+        ('ascii', 1, re.compile(r'[\x20-\x7e]{%d,}' % min_length)),
+        ('utf-16le', 2, re.compile(r'(?:[\x20-\x7e]\x00){%d,}' % min_length)),
+    ]
+    # Per encoding, where in buf the next scan starts.
+    pos = [0] * len(patterns)
+    buf = ''
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        buf += chunk
+        chunk = next(chunks, None)
+        final = chunk is None
+        for (i, (encoding, width, pattern)) in enumerate(patterns):
+            # A run too short to report could still grow into one.
+            resume = max(pos[i], len(buf) - width * min_length - 1)
+            for match in pattern.finditer(buf, pos[i]):
+                split = not final and match.end() >= len(buf) - 1
+                if split and match.end() - match.start() < width * STRINGS_MAX_LENGTH:
+                    # The run may carry on in the next chunk.
+                    resume = match.start()
+                    break
+                if width == 1:
+                    value = match.group()
+                else:
+                    value = match.group()[::2]
+                yield (encoding, value)
+                if split:
+                    # Pick the run up again a little before the cut.
+                    resume = match.end() - width * SCAN_OVERLAP
+                    break
+                resume = max(match.end(), len(buf) - width * min_length - 1)
+            pos[i] = resume
+        keep = max(min(pos), 0)
+        buf = buf[keep:]
+        pos = [p - keep for p in pos]
+
+def join_strings(strings, size=DEFAULT_READ_SIZE):
+    """
+    Join strings from iter_strings() into newline separated blocks of about
+    `size` bytes, ready to hand to scan_iocs().
+    """
+
+    block = []
+    length = 0
+    for (encoding, value) in strings:
+        block.append(value)
+        length += len(value) + 1
+        if length >= size:
+            yield '\n'.join(block) + '\n'
+            block = []
+            length = 0
+    if block:
+        yield '\n'.join(block)
 
@@ -0,0 +1,12 @@
+from django import forms
+
+class DataMinerRunForm(forms.Form):
+    error_css_class = 'error'
+    required_css_class = 'required'
+    sweep_indicators = forms.BooleanField(required=False,
+                                          label="Known indicators",
+                                          help_text="Also report existing Indicators found in the data.",
+                                          initial=False)
+
+    def __init__(self, *args, **kwargs):
+        super(DataMinerRunForm, self).__init__(*args, **kwargs)
@@ -0,0 +1,216 @@
+"""
+Find which existing Indicators literally appear in a chunk of data.
+
+All Indicator values are loaded into an Aho-Corasick automaton (from the
+pyahocorasick package), so the data is walked once, in C, no matter how many
+Indicators there are. The automaton is kept per process and brought up to
+date from the Indicators added, modified or deleted since it was last
+refreshed, rather than rebuilt from scratch on every run.
+"""
+
+import datetime
+import logging
+import threading
+
+from bson.objectid import ObjectId
+from mongoengine import Q
+
+from crits.indicators.indicator import Indicator
+
+try:
+    import ahocorasick
+    HAVE_AHOCORASICK = True
+except ImportError:
+    HAVE_AHOCORASICK = False
+
+logger = logging.getLogger(__name__)
+
+# Indicator values shorter than this match far too often to be useful.
+SWEEP_MIN_LENGTH = 5
+
+# Indicator values longer than this are not swept for. It bounds how much of
+# each chunk is carried over to find matches spanning two chunks.
+SWEEP_MAX_LENGTH = 4096
+
+# ObjectIds from different hosts are only roughly in creation order, so new
+# Indicators are looked for from a little before the newest one loaded.
+SWEEP_ID_SKEW = datetime.timedelta(minutes=5)
+
+
+class IndicatorSweep(object):
+    """
+    An automaton of all Indicator values and the Indicators behind them.
+
+    Each value is added once, lowercased and UTF-8 encoded. Windows samples
+    often keep strings as UTF-16LE, so the data is also run through the
+    automaton a second time with every other byte dropped.
+
+    pyahocorasick raises if the automaton is changed while it is being
+    iterated over, so refreshing it and running data through it both hold
+    the sweep's lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Lowercased value -> {indicator id: (value, ind_type)}
+        self.automaton = ahocorasick.Automaton()
+        # Indicator id -> lowercased value, to notice changed values.
+        self.values = {}
+        self.modified = None
+        self.newest_id = None
+        self.longest = 0
+
+    def add_indicator(self, ind):
+        id_ = str(ind.id)
+        value = ind.value or ''
+        key = value.lower()
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        old_key = self.values.get(id_)
+        if old_key is not None and old_key != key:
+            self.remove_key(id_, old_key)
+        self.values[id_] = key
+        if not SWEEP_MIN_LENGTH <= len(key) <= SWEEP_MAX_LENGTH:
+            return
+        indicators = self.automaton.get(key, None)
+        if indicators is None:
+            indicators = {}
+            self.automaton.add_word(key, indicators)
+            self.longest = max(self.longest, len(key))
+        indicators[id_] = (value, ind.ind_type)
+
+    def remove_key(self, id_, key):
+        indicators = self.automaton.get(key, None)
+        if indicators is None:
+            return
+        indicators.pop(id_, None)
+        if not indicators:
+            self.automaton.remove_word(key)
+
+    def key_length(self, indicators):
+        # Every Indicator under one automaton entry has the same key.
+        return len(self.values[next(iter(indicators))])
+
+    def load(self, query):
+        # Indicators seen before may be loaded again, adding them twice is
+        # harmless.
+        fields = ('id', 'value', 'ind_type', 'modified')
+        for ind in Indicator.objects(query).only(*fields).no_cache():
+            self.add_indicator(ind)
+            if self.modified is None or ind.modified > self.modified:
+                self.modified = ind.modified
+            if self.newest_id is None or ind.id > self.newest_id:
+                self.newest_id = ind.id
+
+    def refresh(self):
+        """
+        Bring the automaton up to date with the Indicators collection.
+
+        Indicators added or modified since the last refresh are loaded by id
+        and by modified time. The ids in the collection are then compared
+        with the ones loaded, which finds Indicators that were deleted, and
+        any added ones whose ids were too far in the past to be caught.
+        """
+
+        with self.lock:
+            query = Q()
+            if self.newest_id is not None:
+                since = self.newest_id.generation_time - SWEEP_ID_SKEW
+                query = Q(id__gte=ObjectId.from_datetime(since))
+                if self.modified is not None:
+                    query |= Q(modified__gte=self.modified)
+            self.load(query)
+
+            ids = set(str(ind.id) for ind in
+                      Indicator.objects.only('id').no_cache())
+            for id_ in set(self.values) - ids:
+                self.remove_key(id_, self.values.pop(id_))
+            missing = ids.difference(self.values)
+            if missing:
+                self.load(Q(id__in=list(missing)))
+
+            if self.automaton.kind == ahocorasick.TRIE:
+                self.automaton.make_automaton()
+
+    def scan(self, chunks):
+        """
+        Find Indicators whose values appear in a stream of data.
+
+        The end of each chunk is carried over to the next one, so a value
+        that spans a chunk boundary is still found.
+
+        :param chunks: An iterable of strings.
+        :returns: generator of (offset, indicator id, value, ind_type) for
+                  the first place each Indicator is found.
+        """
+
+        with self.lock:
+            # Enough for the longest value as UTF-16LE.
+            overlap = 2 * self.longest
+        seen = set()
+        tail = ''
+        base = 0
+        for chunk in chunks:
+            data = tail + chunk.lower()
+            with self.lock:
+                matches = self.find(data, len(tail))
+            for (start, found) in matches:
+                for (id_, value, ind_type) in found:
+                    if id_ not in seen:
+                        seen.add(id_)
+                        yield (base + start, id_, value, ind_type)
+            keep = data[-overlap:] if overlap else ''
+            base += len(data) - len(keep)
+            tail = keep
+
+    def find(self, data, skip):
+        """
+        Find everything in data that ends past its first skip bytes, which
+        were already searched as the end of the last chunk.
+
+        :returns: list of (offset, [(indicator id, value, ind_type)]), in
+                  order of offset.
+        """
+
+        if self.automaton.kind != ahocorasick.AHOCORASICK:
+            return []
+        matches = []
+        for (end, indicators) in self.automaton.iter(data):
+            if end >= skip:
+                matches.append((end + 1 - self.key_length(indicators),
+                                indicators))
+        # UTF-16LE text is every other byte, starting at an even or odd
+        # offset, with zeros in between.
+        for align in (0, 1):
+            for (end, indicators) in self.automaton.iter(data[align::2]):
+                length = self.key_length(indicators)
+                start = align + 2 * (end + 1 - length)
+                stop = align + 2 * (end + 1)
+                if (stop > skip and
+                    data[start + 1:stop:2] == '\x00' * length):
+                    matches.append((start, indicators))
+        matches.sort(key=lambda m: m[0])
+        # The Indicators are copied out, a refresh may change them once the
+        # lock is released.
+        return [(start, [(id_, value, ind_type) for (id_, (value, ind_type))
+                         in indicators.iteritems()])
+                for (start, indicators) in matches]
+
+
+_sweep_cache = {'sweep': None}
+_sweep_lock = threading.Lock()
+
+def get_indicator_sweep():
+    """
+    Return the process-wide IndicatorSweep, brought up to date.
+
+    :returns: IndicatorSweep
+    """
+
+    with _sweep_lock:
+        sweep = _sweep_cache['sweep']
+        if sweep is None:
+            logger.info("Building indicator sweep automaton.")
+            sweep = _sweep_cache['sweep'] = IndicatorSweep()
+        sweep.refresh()
+    return sweep
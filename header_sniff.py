@@ -0,0 +1,52 @@
+"""
+Helpers for services that only need the start of a sample to decide whether
+they apply to it (magic byte checks in valid_for and the like).
+
+Reading obj.filedata in full pulls the whole sample out of GridFS, and every
+service's valid_for is called for each new sample. Instead the first GridFS
+chunk is read once and kept on the object, so every later check against the
+same object is answered from memory.
+"""
+
+# pymongo's default GridFS chunk size, used when the file does not say.
+DEFAULT_HEADER_SIZE = 255 * 1024
+
+_CACHE_ATTR = '_sniffed_header'
+
+
+def read_header(obj, size=None):
+    """
+    Return the first `size` bytes of the object's filedata.
+
+    The first GridFS chunk (which GridFS fetches in full anyway) is read on
+    first use and cached on the object, so repeated checks against the same
+    object during a request cost a single read. Requests for more than a
+    chunk are read directly. The filedata read pointer is always reset.
+
+    :param obj: The top-level object with a `filedata` GridFS field.
+    :param size: The number of bytes wanted, or None for the whole chunk.
+    :returns: str (empty if the object has no filedata)
+    """
+
+    filedata = getattr(obj, 'filedata', None)
+    if filedata is None or getattr(filedata, 'grid_id', None) is None:
+        return ''
+
+    chunk_size = getattr(filedata, 'chunk_size', None) or DEFAULT_HEADER_SIZE
+    header = getattr(obj, _CACHE_ATTR, None)
+    if header is None:
+        filedata.seek(0)
+        header = filedata.read(chunk_size)
+        # Need to reset the read pointer.
+        filedata.seek(0)
+        setattr(obj, _CACHE_ATTR, header)
+
+    # A short first chunk is the whole file.
+    if size is None or size <= len(header) or len(header) < chunk_size:
+        return header[:size]
+
+    # Asked for more than the first chunk of a larger file.
+    filedata.seek(0)
+    data = filedata.read(size)
+    filedata.seek(0)
+    return data
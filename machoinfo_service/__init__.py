@@ -5,6 +5,7 @@ from crits.services.core import Service, ServiceConfigError
 from crits.certificates.handlers import handle_cert_file
 from crits.vocabulary.relationships import RelationshipTypes
 
+from header_sniff import read_header
 from machoinfo import MachOEntity, MachOParser, MachOParserError
 
 class MachOInfoService(Service):
@@ -18,13 +19,10 @@ class MachOInfoService(Service):
         if obj.filedata.grid_id == None:
             raise ServiceConfigError("Missing filedata.")
 
-        data = obj.filedata.read()
+        data = read_header(obj, 4)
         if len(data) < 4:
             raise ServiceConfigError("Need at least 4 bytes.")
 
-        # Reset the read pointer.
-        obj.filedata.seek(0)
-
         if not struct.unpack('@I', data[:4])[0] in [ MachOEntity.FAT_MAGIC,
                                                      MachOEntity.FAT_CIGAM,
                                                      MachOEntity.MH_MAGIC,
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Time MachOParser against a synthetic universal binary.
+
+The binary is built in memory so no sample is needed. Each architecture
+slice gets segments with sections, a symbol table, dylib and dylinker
+commands, version/uuid commands and an embedded code signature with a
+requirement set and certificate blob, which covers every parser that walks
+the file by offset.
+
+    python benchmark.py [--archs N] [--symbols N] [--sections N]
+                        [--requirements N] [--repeat N]
+"""
+
+import os
+import sys
+import time
+import struct
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from machoinfo import MachOEntity, MachOParser
+
+CPU_TYPES = [
+    (MachOEntity.CPU_TYPE_X86_64, MachOEntity.CPU_SUBTYPE_I386_ALL),
+    (MachOEntity.CPU_TYPE_X86, MachOEntity.CPU_SUBTYPE_I386_ALL),
+    (MachOEntity.CPU_TYPE_POWERPC, MachOEntity.CPU_SUBTYPE_POWERPC_ALL),
+    (MachOEntity.CPU_TYPE_ARM, MachOEntity.CPU_SUBTYPE_ARM_V7),
+]
+
+
+def _pad(data, align=8):
+    return data + '\x00' * ((align - len(data) % align) % align)
+
+
+def _lc(cmd, body):
+    body = _pad(body)
+    return struct.pack('<II', cmd, len(body) + 8) + body
+
+
+def _code_signature(identifier, requirements):
+    """
+    Build an embedded signature super blob (big endian, like the real thing).
+    """
+    ident = identifier + '\x00'
+    hashes = '\xaa' * 20
+    cd_hdr_sz = 44
+    code_dir = struct.pack('>IIIIIIIIIBBBBI', MachOEntity.CODE_DIRECTORY,
+                           cd_hdr_sz + len(ident) + len(hashes),
+                           0x20100, 0, cd_hdr_sz + len(ident), cd_hdr_sz,
+                           0, 1, 4096, 20, MachOEntity.CS_SHA1, 0, 12, 0)
+    code_dir += ident + hashes
+
+    reqs = []
+    for i in xrange(requirements):
+        expr = 'identifier "%s.%d"' % (identifier, i)
+        reqs.append(struct.pack('>II', MachOEntity.CODE_REQUIREMENT,
+                                8 + len(expr)) + expr)
+    req_hdr_sz = 12 + 8 * len(reqs)
+    offset = req_hdr_sz
+    index = ''
+    for i, req in enumerate(reqs):
+        index += struct.pack('>II', i, offset)
+        offset += len(req)
+    req_set = struct.pack('>III', MachOEntity.REQUIREMENT_SET, offset,
+                          len(reqs)) + index + ''.join(reqs)
+
+    pkcs7 = '\x30\x82' + os.urandom(2046)
+    cert = struct.pack('>II', MachOEntity.CERT_BLOB, 8 + len(pkcs7)) + pkcs7
+
+    blobs = [(0, code_dir), (2, req_set), (0x10000, cert)]
+    hdr_sz = 12 + 8 * len(blobs)
+    index = ''
+    body = ''
+    for (slot, blob) in blobs:
+        index += struct.pack('>II', slot, hdr_sz + len(body))
+        body += blob
+    return struct.pack('>III', MachOEntity.EMBEDDED_SIG, hdr_sz + len(body),
+                       len(blobs)) + index + body
+
+
+def build_macho(cpu_type, cpu_subtype, symbols, sections, requirements):
+    """
+    Build a little endian 64 bit Mach-O executable.
+    """
+    sect_data = [os.urandom(512 + i) for i in xrange(sections)]
+    strtab = '\x00'
+    names = []
+    for i in xrange(symbols):
+        names.append(len(strtab))
+        strtab += '_symbol_%08d\x00' % i
+    sig = _code_signature('com.example.bench', requirements)
+
+    # Command sizes are fixed so the layout can be computed up front.
+    seg_sz = 72 + 80 * sections
+    dylib_names = ['/usr/lib/libSystem.B.dylib', '/usr/lib/libobjc.A.dylib']
+    cmds_sz = (seg_sz + 24 + 16 + 24 + 16 + 16 +
+               sum(len(_lc(0, struct.pack('<IIII', 0, 0, 0, 0) + n + '\x00'))
+                   for n in dylib_names) +
+               len(_lc(0, struct.pack('<I', 0) + '/usr/lib/dyld\x00')))
+    offset = 32 + cmds_sz
+    sect_offsets = []
+    for data in sect_data:
+        sect_offsets.append(offset)
+        offset += len(data)
+    sym_off = offset
+    offset += 16 * symbols
+    str_off = offset
+    offset += len(strtab)
+    sig_off = offset
+
+    seg = struct.pack('<16sQQQQIIII', '__TEXT', 0x100000000, offset, 0,
+                      offset, 7, 5, sections, 0)
+    for i, data in enumerate(sect_data):
+        seg += struct.pack('<16s16sQQIIIIIIII', '__sect%d' % i, '__TEXT',
+                           0x100000000 + sect_offsets[i], len(data),
+                           sect_offsets[i], 4, 0, 0,
+                           MachOEntity.S_ATTR_PURE_INSTRUCTIONS, 0, 0, 0)
+    cmds = [_lc(MachOEntity.LC_SEGMENT_64, seg)]
+    cmds.append(_lc(MachOEntity.LC_SYMTAB,
+                    struct.pack('<IIII', sym_off, symbols, str_off, len(strtab))))
+    cmds.append(_lc(MachOEntity.LC_UUID, os.urandom(16)))
+    cmds.append(_lc(MachOEntity.LC_VERSION_MIN_MACOSX,
+                    struct.pack('<II', 0x000a0800, 0x000a0900)))
+    cmds.append(_lc(MachOEntity.LC_SOURCE_VERSION, struct.pack('<Q', 1 << 40)))
+    cmds.append(_lc(MachOEntity.LC_CODE_SIGNATURE,
+                    struct.pack('<II', sig_off, len(sig))))
+    for name in dylib_names:
+        cmds.append(_lc(MachOEntity.LC_LOAD_DYLIB,
+                        struct.pack('<IIII', 24, 2, 0x10000, 0x10000) +
+                        name + '\x00'))
+    cmds.append(_lc(MachOEntity.LC_LOAD_DYLINKER,
+                    struct.pack('<I', 12) + '/usr/lib/dyld\x00'))
+    ncmds = len(cmds)
+    cmds = ''.join(cmds)
+    assert len(cmds) == cmds_sz
+
+    header = struct.pack('<IIIIIIII', MachOEntity.MH_MAGIC_64, cpu_type,
+                         cpu_subtype, MachOEntity.MH_EXECUTE,
+                         ncmds, cmds_sz,
+                         MachOEntity.MH_PIE | MachOEntity.MH_TWOLEVEL, 0)
+    symtab = ''.join(struct.pack('<IBBHQ', names[i], 0x0f, 1, 0, 0x1000 + i)
+                     for i in xrange(symbols))
+    return header + cmds + ''.join(sect_data) + symtab + strtab + sig
+
+
+def build_fat(archs, symbols, sections, requirements, align=4096):
+    """
+    Wrap `archs` Mach-O slices in a universal binary header.
+    """
+    slices = []
+    for i in xrange(archs):
+        (cpu_type, cpu_subtype) = CPU_TYPES[i % len(CPU_TYPES)]
+        slices.append((cpu_type, cpu_subtype,
+                       build_macho(cpu_type, cpu_subtype, symbols, sections,
+                                   requirements)))
+    header = struct.pack('>II', MachOEntity.FAT_MAGIC, archs)
+    offset = len(header) + 20 * archs
+    body = ''
+    for (cpu_type, cpu_subtype, data) in slices:
+        pad = (align - offset % align) % align
+        offset += pad
+        header += struct.pack('>IIIII', cpu_type, cpu_subtype, offset,
+                              len(data), 12)
+        body += '\x00' * pad + data
+        offset += len(data)
+    return header + body
+
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option("--archs", type="int", default=4)
+    parser.add_option("--symbols", type="int", default=50000)
+    parser.add_option("--sections", type="int", default=200)
+    parser.add_option("--requirements", type="int", default=500)
+    parser.add_option("--repeat", type="int", default=3)
+    (opts, args) = parser.parse_args(argv)
+
+    data = build_fat(opts.archs, opts.symbols, opts.sections,
+                     opts.requirements)
+    print "[+] %d byte universal binary, %d archs" % (len(data), opts.archs)
+    best = None
+    for i in xrange(opts.repeat):
+        start = time.time()
+        mop = MachOParser(data)
+        mop.parse()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "[+] parsed %d entities, best of %d: %.3fs" % (len(mop.entities),
+                                                        opts.repeat, best)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -600,6 +600,24 @@ class MachOEntity(object):
                 flaglist.append(v)
         return flaglist
 
+    # Return the NULL terminated string starting at offset in data, which
+    # may be a memoryview. Only the bytes up to the NULL are copied. If there
+    # is no NULL (or maxlen bytes are reached first) found is False.
+    def read_cstring(self, data, offset, maxlen=None):
+        end = len(data)
+        if maxlen is not None:
+            end = min(end, offset + maxlen)
+        chunks = []
+        while offset < end:
+            chunk = data[offset:min(offset + 256, end)].tobytes()
+            null = chunk.find('\x00')
+            if null != -1:
+                chunks.append(chunk[:null])
+                return (''.join(chunks), True)
+            chunks.append(chunk)
+            offset += len(chunk)
+        return (''.join(chunks), False)
+
     # Given a command value (integer) return the command name or hex string
     # if it's not known. This isn't a property like the others because it
     # takes an argument.
@@ -621,25 +639,19 @@ class MachOEntity(object):
         # Segment name is a NULL terminated string, at most 16 bytes long.
         # Make sure there is a NULL somewhere in the first 16 bytes else
         # take the entire thing.
-        null = cmd_data[:16].find('\x00')
-        if null == -1:
-            null = 16
-        ret['segname'] = cmd_data[:null]
-        (ret['vmsize'], ret['filesize'], ret['nsects'], ret['flags']) = struct.unpack(self.endian + 'IxxxxIxxxxxxxxII', cmd_data[20:48])
+        ret['segname'] = self.read_cstring(cmd_data, 0, 16)[0]
+        (ret['vmsize'], ret['filesize'], ret['nsects'], ret['flags']) = struct.unpack_from(self.endian + 'IxxxxIxxxxxxxxII', cmd_data, 20)
 
         # Sections come after the command.
-        sect_ptr = cmd_data[48:]
+        sect_off = 48
         ret['sectlist'] = []
         for i in xrange(ret['nsects']):
             sect = {}
             # XXX: Ensure nsects * sizeof(struct section) is not off the end.
-            null = sect_ptr[:16].find('\x00')
-            if null == -1:
-                null = 16
-            sect['sectname'] = sect_ptr[:null]
+            sect['sectname'] = self.read_cstring(cmd_data, sect_off, 16)[0]
             # Bytes 16 through 32 are the segment name in this section.
             # Skip it as we aren't using it.
-            (addr, sect['size'], sect['offset'], flags) = struct.unpack(self.endian + 'IIIxxxxxxxxxxxxI', sect_ptr[32:60])
+            (addr, sect['size'], sect['offset'], flags) = struct.unpack_from(self.endian + 'IIIxxxxxxxxxxxxI', cmd_data, sect_off + 32)
             sect['addr'] = "0x%08x" % addr
             # 24 bits are for attributes, 8 bits are for type.
             sect['type'] = self.section_types.get(flags & 0xFF, "0x%08x" % flags)
@@ -648,12 +660,12 @@ class MachOEntity(object):
                 if flags & attr == attr:
                     sect['flaglist'].append(desc)
             ret['sectlist'].append(sect)
-            sect_ptr = sect_ptr[68:]
+            sect_off += 68
         return ret
 
     def parse_lc_symtab(self, cmd_data):
         ret = {}
-        (ret['sym_off'], ret['nsyms'], ret['str_off'], ret['str_sz']) = struct.unpack(self.endian + 'IIII', cmd_data[:16])
+        (ret['sym_off'], ret['nsyms'], ret['str_off'], ret['str_sz']) = struct.unpack_from(self.endian + 'IIII', cmd_data)
         return ret
 
     def parse_lc_thread(self, cmd_data):
@@ -671,17 +683,16 @@ class MachOEntity(object):
         # We subtract 8 from this because we are not getting the first 8
         # bytes of the command (they are stripped before calling the command
         # parsers).
-        (offset, ts, cv, cpv) = struct.unpack(self.endian + 'IIII', cmd_data[:16])
+        (offset, ts, cv, cpv) = struct.unpack_from(self.endian + 'IIII', cmd_data)
         offset -= 8
         ret['timestamp'] = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
         ret['cv'] = "%i.%i.%i" % ((cv >> 16), (cv >> 8) & 0xFF, cv & 0xFF)
         ret['cpv'] = "%i.%i.%i" % ((cpv >> 16), (cpv >> 8) & 0xFF, cpv & 0xFF)
         # XXX: Ensure offset is not past the end...
         # Jump forward to the string and grab it.
-        null = cmd_data[offset:].find('\x00')
-        if null == -1:
+        (ret['dylib'], found) = self.read_cstring(cmd_data, offset)
+        if not found:
             ret['dylib'] = 'Unknown'
-        ret['dylib'] = cmd_data[offset:offset + null]
         return ret
 
     def parse_lc_load_dylib(self, cmd_data):
@@ -695,10 +706,9 @@ class MachOEntity(object):
         # The first 4 bytes are an offset to the start of the string. It's
         # the only thing in this structure, so just skip the first 4 bytes
         # and grab the rest until the null.
-        null = cmd_data[4:].find('\x00')
-        if null == -1:
-            ret['dylib'] = 'Unknown'
-        ret['dylinker'] = cmd_data[4:4 + null]
+        (ret['dylinker'], found) = self.read_cstring(cmd_data, 4)
+        if not found:
+            ret['dylinker'] = 'Unknown'
         return ret
 
     def parse_lc_id_dylinker(self, cmd_data):
@@ -739,25 +749,19 @@ class MachOEntity(object):
         # Segment name is a NULL terminated string, at most 16 bytes long.
         # Make sure there is a NULL somewhere in the first 16 bytes else
         # take the entire thing.
-        null = cmd_data[:16].find('\x00')
-        if null == -1:
-            null = 16
-        ret['segname'] = cmd_data[:null]
-        (ret['vmsize'], ret['filesize'], ret['nsects'], ret['flags']) = struct.unpack(self.endian + 'QxxxxxxxxQxxxxxxxxII', cmd_data[24:64])
+        ret['segname'] = self.read_cstring(cmd_data, 0, 16)[0]
+        (ret['vmsize'], ret['filesize'], ret['nsects'], ret['flags']) = struct.unpack_from(self.endian + 'QxxxxxxxxQxxxxxxxxII', cmd_data, 24)
 
         # Sections come after the command.
-        sect_ptr = cmd_data[64:]
+        sect_off = 64
         ret['sectlist'] = []
         for i in xrange(ret['nsects']):
             sect = {}
             # XXX: Ensure nsects * sizeof(struct section_64) is not off the end.
-            null = sect_ptr[:16].find('\x00')
-            if null == -1:
-                null = 16
-            sect['sectname'] = sect_ptr[:null]
+            sect['sectname'] = self.read_cstring(cmd_data, sect_off, 16)[0]
             # Bytes 16 through 32 are the segment name in this section.
             # Skip it as we aren't using it.
-            (addr, sect['size'], sect['offset'], flags) = struct.unpack(self.endian + 'QQIxxxxxxxxxxxxI', sect_ptr[32:68])
+            (addr, sect['size'], sect['offset'], flags) = struct.unpack_from(self.endian + 'QQIxxxxxxxxxxxxI', cmd_data, sect_off + 32)
             sect['addr'] = "0x%08x" % addr
             # 24 bits are for attributes, 8 bits are for type.
             sect['type'] = self.section_types.get(flags & 0xFF, "0x%08x" % flags)
@@ -767,18 +771,18 @@ class MachOEntity(object):
                     sect['flaglist'].append(desc)
             ret['sectlist'].append(sect)
             # XXX: Should be 76 but there are an extra 4 padding bytes (align?)
-            sect_ptr = sect_ptr[80:]
+            sect_off += 80
         return ret
 
     def parse_lc_source_version(self, cmd_data):
         ret = {}
-        (ver) = struct.unpack(self.endian + 'Q', cmd_data)[0]
+        (ver) = struct.unpack_from(self.endian + 'Q', cmd_data)[0]
         ret['ver'] = "%i.%i.%i.%i.%i" % ((ver >> 40), (ver >> 30) & 0x3FF, (ver >> 20) & 0x3FF, (ver >> 10) & 0x3FF, ver & 0x3FF)
         return ret
 
     def parse_lc_version_min_macosx(self, cmd_data):
         ret = {}
-        (ver, sdk) = struct.unpack(self.endian + 'II', cmd_data[:8])
+        (ver, sdk) = struct.unpack_from(self.endian + 'II', cmd_data)
         ret['ver'] = "%i.%i.%i" % ((ver >> 16), (ver >> 8) & 0xFF, ver & 0xFF)
         ret['sdk'] = "%i.%i.%i" % ((sdk >> 16), (sdk >> 8) & 0xFF, sdk & 0xFF)
         return ret
@@ -788,13 +792,13 @@ class MachOEntity(object):
         return ret
 
     def parse_lc_uuid(self, cmd_data):
-        return {'uuid': binascii.hexlify(cmd_data[:16])}
+        return {'uuid': binascii.hexlify(cmd_data[:16].tobytes())}
 
     def parse_lc_code_signature(self, cmd_data):
         ret = {}
         # Based upon the output of 'otool -l' looks like the first 4 bytes
         # are an offset and the next 4 are a size.
-        ret['offset'], ret['size'] = struct.unpack(self.endian + 'II', cmd_data)
+        ret['offset'], ret['size'] = struct.unpack_from(self.endian + 'II', cmd_data)
         return ret
 
     def unknown_sig(self, sig_data):
@@ -805,9 +809,9 @@ class MachOEntity(object):
         ret = {}
         # Skip the magic, grab the length and next 2 bytes. They should be
         # one of the PKCS7 values.
-        (length, blob_hdr) = struct.unpack('>IH', sig_data[4:10])
+        (length, blob_hdr) = struct.unpack_from('>IH', sig_data, 4)
         if blob_hdr in self.PKCS7:
-            ret['pkcs7'] = sig_data[8:length]
+            ret['pkcs7'] = sig_data[8:length].tobytes()
         return ret
 
     def parse_embedded_sig(self, sig_data):
@@ -817,19 +821,19 @@ class MachOEntity(object):
         #
         # Count is the number of sub-structures contained in this header.
         # The sub-structures are 4 bytes for a type and 4 bytes for an offset.
-        (length, count) = struct.unpack('>II', sig_data[4:12])
-        ptr = sig_data[12:]
+        (length, count) = struct.unpack_from('>II', sig_data, 4)
+        ptr = 12
         ret = [] # A list of dictionaries returned by sub-parsers.
         for i in xrange(count):
-            (type_, offset) = struct.unpack('>II', ptr[:8])
+            (type_, offset) = struct.unpack_from('>II', sig_data, ptr)
             if (offset) > len(sig_data):
                 raise MachOParserError("Embedded signature overflow.")
-            sig = struct.unpack('>I', sig_data[offset:offset + 4])[0]
+            sig = struct.unpack_from('>I', sig_data, offset)[0]
             sub_parser = self.signature_parsers.get(sig, self.unknown_sig)
             sub_ret = sub_parser(sig_data[offset:])
             sub_ret['type'] = sig
             ret.append(sub_ret)
-            ptr = ptr[8:]
+            ptr += 8
         return ret
 
     # Best definition of this structure I've been able to find:
@@ -837,18 +841,18 @@ class MachOEntity(object):
     def parse_code_directory(self, sig_data):
         ret = {}
         # Only grabbing certain parts of this structure..
-        (ver, ho, io, hs, ht) = struct.unpack('>' + 'x' * 8 + 'I' + 'x' * 4 + 'II' + 'x' * 12 + 'BB' + 'x' * 6, sig_data[:44])
+        (ver, ho, io, hs, ht) = struct.unpack_from('>' + 'x' * 8 + 'I' + 'x' * 4 + 'II' + 'x' * 12 + 'BB' + 'x' * 6, sig_data)
         if (ho + hs) > len(sig_data):
             raise MachOParserError("Code directory too large.")
         ret['ver'] = "0x%08x" % ver
         ret['hashtype'] = self.hashes.get(ht, '0x%02x' % ht)
-        ret['hash'] = binascii.hexlify(sig_data[ho:ho + hs])
+        ret['hash'] = binascii.hexlify(sig_data[ho:ho + hs].tobytes())
         # Identifier is null terminated.
-        null = sig_data[io:].find('\x00')
-        if null == -1:
+        (identifier, found) = self.read_cstring(sig_data, io)
+        if not found:
             ret['identifier'] = 'Unknown'
         else:
-            ret['identifier'] = sig_data[io:io + null]
+            ret['identifier'] = identifier
         return ret
 
     def parse_code_requirement(self, sig_data):
@@ -861,22 +865,22 @@ class MachOEntity(object):
         ret = {}
         # Skipping the 4 byte magic, the next 4 bytes are the size and
         # the next 4 bytes are the number of requirements in this set.
-        count = struct.unpack('>I', sig_data[8:12])[0]
+        count = struct.unpack_from('>I', sig_data, 8)[0]
         # Requirement sets are stored like super blobs.
-        ptr = sig_data[12:]
+        ptr = 12
         ret['requirements'] = []
         for i in xrange(count):
             # Skipping over the first 4 bytes, I don't know what they are.
             # I think they are a type?
-            offset = struct.unpack('>I', ptr[4:8])[0]
+            offset = struct.unpack_from('>I', sig_data, ptr + 4)[0]
             if offset > len(sig_data):
                 raise MachOParserError("Requirement set too large.")
-            magic = struct.unpack('>I', sig_data[offset:offset + 4])[0]
+            magic = struct.unpack_from('>I', sig_data, offset)[0]
             new_parser = self.signature_parsers.get(magic, self.unknown_sig)
             req = new_parser(sig_data[offset:])
             req['type'] = magic
             ret['requirements'].append(req)
-            ptr = ptr[8:]
+            ptr += 8
         return ret
 
     def parse_lc_segment_sub(self, cmd_dict, data):
@@ -902,7 +906,7 @@ class MachOEntity(object):
         del cmd_dict['size']
         if (offset + size) > len(data):
             raise MachOParserError("Signature data too large.")
-        sig = struct.unpack('>I', data[offset:offset + 4])[0]
+        sig = struct.unpack_from('>I', data, offset)[0]
         cmd_dict['sig'] = sig
         sig_parser = self.signature_parsers.get(sig, self.unknown_sig)
         # Move pass the first 4 bytes we just parsed because internal
@@ -923,38 +927,37 @@ class MachOEntity(object):
         del cmd_dict['sym_off']
         del cmd_dict['nsyms']
 
-        # We need the string table for some symbols.
-        str_tab = data[str_off:str_off + str_sz]
+        # We need the string table for some symbols. It is copied once so
+        # strings can be found with str.find() from their offset.
+        str_tab = data[str_off:str_off + str_sz].tobytes()
+
+        # n_desc is unsigned for 64-bit files and signed for 32-bit. Weird.
+        if self.magic in [self.MH_MAGIC_64, self.MH_CIGAM_64]:
+            fmt = 'IBBHQ'
+        else:
+            # The docs say n_strx is a signed value, mach-o/nlist.h says
+            # otherwise. I'm trusting the header file. :)
+            fmt = 'IBBhI'
+        nlist = struct.Struct(self.endian + fmt)
 
         # XXX: Ensure sym_off + sizeof(struct nlist) is valid
-        ptr = data[sym_off:]
+        ptr = sym_off
         for i in xrange(nsyms):
             sym = {}
 
-            # n_desc is unsigned for 64-bit files and signed for 32-bit. Weird.
-            if self.magic in [self.MH_MAGIC_64, self.MH_CIGAM_64]:
-                fmt = 'IBBHQ'
-                nlist_size = struct.calcsize(fmt)
-            else:
-                # The docs say n_strx is a signed value, mach-o/nlist.h says
-                # otherwise. I'm trusting the header file. :)
-                fmt = 'IBBhI'
-                nlist_size = struct.calcsize(fmt)
-
-            (n_strx, n_type, n_sect, n_desc, n_value) = struct.unpack(self.endian + fmt, ptr[:nlist_size])
+            (n_strx, n_type, n_sect, n_desc, n_value) = nlist.unpack_from(data, ptr)
+            ptr += nlist.size
 
             if n_strx > 0:
                 # XXX: Ensure that str_off + n_strx is valid
                 # n_strx is an offset into the string table starting at
                 # str_off. The strings are null terminated.
-                null = str_tab[n_strx:].find('\x00')
-                if null == 0 or null == -1:
-                    ptr = ptr[nlist_size:]
+                null = str_tab.find('\x00', n_strx)
+                if null == n_strx or null == -1:
                     continue
                 else:
-                    sym['string'] = str_tab[n_strx:n_strx + null]
+                    sym['string'] = str_tab[n_strx:null]
             else:
-                ptr = ptr[nlist_size:]
                 continue
 
             # If any of the stab bits are set, the entire byte is to be
@@ -985,13 +988,12 @@ class MachOEntity(object):
                     sym['external'] = False
 
             symbols.append(sym)
-            ptr = ptr[nlist_size:]
 
         # Symbols go into the cmd_dict.
         cmd_dict['symbols'] = symbols
 
     def get_magic(self, ptr):
-        self.magic = struct.unpack('@I', ptr[:4])[0]
+        self.magic = struct.unpack_from('@I', ptr)[0]
         if self.magic not in self.magics:
             raise MachOParserError("Unknown magic.")
 
@@ -1001,7 +1003,7 @@ class MachOEntity(object):
 
         # If a universal binary, grab the nfat value.
         if self.is_universal():
-            self.nfat = struct.unpack('>I', ptr[4:8])[0]
+            self.nfat = struct.unpack_from('>I', ptr, 4)[0]
 
     def is_universal(self):
         return self.magic in [self.FAT_MAGIC, self.FAT_CIGAM]
@@ -1024,8 +1026,9 @@ class MachOEntity(object):
             raise MachOParserError("Load commands too large.")
         # Loop through all the commands.
         for i in xrange(self.ncmds):
-            (cmd, size) = struct.unpack(self.endian + 'II', data[cmd_offset:cmd_offset + self.LC_SZ])
-            # The parsers don't want the 8 bytes we just parsed.
+            (cmd, size) = struct.unpack_from(self.endian + 'II', data, cmd_offset)
+            # The parsers don't want the 8 bytes we just parsed. Slicing the
+            # memoryview does not copy.
             cmd_data = data[cmd_offset + self.LC_SZ:cmd_offset + size]
             cmd_parser = self.cmd_parsers.get(cmd, self.unknown_cmd)
             cmd_dict = cmd_parser(cmd_data)
@@ -1039,7 +1042,7 @@ class MachOEntity(object):
             cmd_offset += size
 
     def parse_header(self, data):
-        (cpu_type, cpu_subtype, filetype, ncmds, sizeofcmds, flagval) = struct.unpack(self.endian + 'IIIIII', data[4:]) # Skipping magic...
+        (cpu_type, cpu_subtype, filetype, ncmds, sizeofcmds, flagval) = struct.unpack_from(self.endian + 'IIIIII', data, 4) # Skipping magic...
         self.cpu_type = cpu_type
         self.cpu_subtype = cpu_subtype
         if filetype not in self.filetypes:
@@ -1049,13 +1052,19 @@ class MachOEntity(object):
         self.sizeofcmds = sizeofcmds
         self.flagval = flagval
 
+    # data is a memoryview of this entity's slice of the file. Parsers work
+    # on offsets into it (or zero-copy sub-views) rather than copied slices.
     def parse(self, data):
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
         self.parse_header(data[:self.MACHO32_SZ])
         self.parse_cmds(data)
 
 class MachOParser(object):
     def __init__(self, data):
         self.data = data
+        # All parsing happens on views of this, the file is never copied.
+        self.view = memoryview(data)
         if len(data) < 8:
             raise MachOParserError("Not enough data.")
 
@@ -1075,23 +1084,23 @@ class MachOParser(object):
         entity = MachOEntity()
         # The magic is 4 bytes, but we pass 8 here because if it is
         # a universal binary get_magic() will also parse the nfat value.
-        entity.get_magic(self.data[:8])
+        entity.get_magic(self.view[:8])
 
         if entity.is_universal():
             self.entities.append(entity)
-            ptr = self.data[self.FAT_SZ:]
+            ptr = self.FAT_SZ
             for i in xrange(entity.nfat):
                 # Grab the offset and size from each fat_arch.
-                (offset, size) = struct.unpack(entity.endian + 'II', ptr[8:16])
+                (offset, size) = struct.unpack_from(entity.endian + 'II', self.view, ptr + 8)
                 if (offset + size) > len(self.data):
                     raise MachOParserError("nfat %i too big.")
                 new_entity = MachOEntity()
-                new_entity.get_magic(self.data[offset:offset + 8])
+                new_entity.get_magic(self.view[offset:offset + 8])
                 if new_entity.is_universal():
                     raise MachOParserError("Universal inception.")
-                new_entity.parse(self.data[offset:offset + size])
+                new_entity.parse(self.view[offset:offset + size])
                 self.entities.append(new_entity)
-                ptr = ptr[self.FAT_ARCH_SZ:]
+                ptr += self.FAT_ARCH_SZ
         elif entity.is_32bit() or entity.is_64bit():
-            entity.parse(self.data)
+            entity.parse(self.view)
             self.entities.append(entity)
@@ -7,7 +7,8 @@ from crits.services.core import Service, ServiceConfigError
 from crits.samples.handlers import handle_file
 from crits.vocabulary.relationships import RelationshipTypes
 
-from office_meta import OfficeParser
+from header_sniff import read_header
+from office_meta import OfficeParser, OOXMLParser
 from . import forms
 
 class OfficeMetaService(Service):
@@ -16,9 +17,9 @@ class OfficeMetaService(Service):
     """
 
     name = "office_meta"
-    version = '1.0.2'
+    version = '1.1.0'
     supported_types = ['Sample']
-    description = "Parses metadata from Office documents."
+    description = "Parses metadata from Office and OOXML documents."
 
     @staticmethod
     def get_config(existing_config):
@@ -30,11 +31,14 @@ class OfficeMetaService(Service):
     def valid_for(obj):
         office_magic = "\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
         if obj.filedata != None:
-            data = obj.filedata.read()
-            # Need to reset the read pointer.
-            obj.filedata.seek(0)
+            data = read_header(obj, len(office_magic))
             if data.startswith(office_magic):
                 return
+            # The OOXML content types part is looked for in the header
+            # that is already cached, run() checks the zip itself.
+            if (data.startswith(OOXMLParser.zip_magic) and
+                OOXMLParser.sniff(read_header(obj))):
+                return
         raise ServiceConfigError("Not a valid office document.")
 
     @classmethod
@@ -51,6 +55,10 @@ class OfficeMetaService(Service):
         return forms.OfficeMetaRunForm(config)
 
     def run(self, obj, config):
+        magic = read_header(obj, len(OOXMLParser.zip_magic))
+        if magic == OOXMLParser.zip_magic:
+            self._run_ooxml(obj)
+            return
         oparser = OfficeParser(obj.filedata.read())
         oparser.parse_office_doc()
         added_files = []
@@ -68,18 +76,35 @@ class OfficeMetaService(Service):
             }
             name = curr_dir['norm_name'].decode('ascii', errors='ignore')
             self._add_result('directory', name, result)
-            if config.get('save_streams', 0) == 1 and 'data' in curr_dir:
-                handle_file(name, curr_dir['data'], obj.source,
+            if config.get('save_streams', 0) == 1 and 'md5' in curr_dir:
+                # streams are only pulled into memory when they are saved
+                stream_data = oparser.get_stream(curr_dir)
+                handle_file(name, stream_data, obj.source,
                             related_id=str(obj.id),
                             campaign=obj.campaign,
                             method=self.name,
                             relationship=RelationshipTypes.CONTAINED_WITHIN,
                             user=self.current_task.username)
-                stream_md5 = hashlib.md5(curr_dir['data']).hexdigest()
+                stream_md5 = hashlib.md5(stream_data).hexdigest()
                 added_files.append((name, stream_md5))
-        for prop_list in oparser.properties:
+        self._add_properties(oparser.properties)
+        for f in added_files:
+            self._add_result("file_added", f[0], {'md5': f[1]})
+
+    def _run_ooxml(self, obj):
+        oparser = OOXMLParser(obj.filedata)
+        if oparser.parse_ooxml_doc() is None:
+            self._error("Could not parse file as an OOXML document")
+            return
+        self._add_result('ooxml_content_type', oparser.main_content_type)
+        self._add_properties(oparser.properties)
+        for (name, e) in oparser.part_errors:
+            self._parse_error(name, e)
+
+    def _add_properties(self, properties):
+        for prop_list in properties:
             for prop in prop_list['property_list']:
-                prop_summary = oparser.summary_mapping.get(binascii.unhexlify(prop['clsid']), None)
+                prop_summary = OfficeParser.summary_mapping.get(binascii.unhexlify(prop['clsid']), None)
                 prop_name = prop_summary.get('name', 'Unknown')
                 for item in prop['properties']['properties']:
                     result = {
@@ -88,8 +113,6 @@ class OfficeMetaService(Service):
                         'result':           item.get('result', ''),
                     }
                     self._add_result('doc_meta', prop_name, result)
-        for f in added_files:
-            self._add_result("file_added", f[0], {'md5': f[1]})
 
     def _parse_error(self, item, e):
         self._error("Error parsing %s (%s): %s" % (item, e.__class__.__name__, e))
@@ -1,12 +1,17 @@
-import sys
 import time
 import array
+import calendar
+import zlib
+import zipfile
 import hashlib
 import binascii
 import struct
 import pprint
 
-sys.setrecursionlimit(10000)
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
 
 class OfficeParser(object):
     summary_mapping = {
@@ -57,57 +62,98 @@ class OfficeParser(object):
         }
     }
     office_magic = "\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" 
-    def __init__(self, data, verbose=False):
+    def __init__(self, data, verbose=False, hash_streams=True):
         self.data = data
+        self.view = memoryview(data)
         self.verbose = verbose
+        self.hash_streams = hash_streams
         self.office_header = {}
         self.directory = []
         self.properties = []
         self.fat_table = []
         self.mini_fat_table = []
-        self.mini_fat_data = ''
+        self.mini_stream_sectors = []
         self.sector_size = 512
 
+    def walk_chain(self, table, sector, end_markers=(0xffffffff, 0xfffffffe)):
+        """
+        Iterate over the sector numbers of a chain in a FAT or mini FAT table.
+
+        Stops at an end of chain marker, an out of range sector, or a sector
+        that has already been visited (looping chains).
+        """
+        visited = set()
+        table_len = len(table)
+        while sector not in end_markers and sector < table_len:
+            if sector in visited:
+                if self.verbose:
+                    print "!!!!! Error, loop detected in chain at sector %d" % sector
+                break
+            visited.add(sector)
+            yield sector
+            sector = table[sector]
+
     def get_mini_fat_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe]:
-            return ''
-        elif sector < len(self.mini_fat_table):
-            if self.mini_fat_table[sector] == 0xfffffffe:
-                return self.get_mini_fat_sector(sector)
-            elif sector != self.mini_fat_table[sector]:
-                data = self.get_mini_fat_sector(sector)
-                return data + self.get_mini_fat_chain(self.mini_fat_table[sector])
-        return ''
+        return ''.join([self.get_mini_fat_sector(s)
+                        for s in self.walk_chain(self.mini_fat_table, sector)])
 
     def get_mini_fat_sector(self, sector):
-        return self.mini_fat_data[(sector) * 64 : (sector + 1) * 64]
+        return self.get_mini_fat_sector_view(sector).tobytes()
+
+    def get_mini_fat_sector_view(self, sector):
+        # mini sectors live inside the mini stream, which is itself a FAT
+        # chain, so map the mini sector onto the backing FAT sector
+        offset = sector * 64
+        index = offset // self.sector_size
+        if index >= len(self.mini_stream_sectors):
+            return self.view[0:0]
+        start = ((self.mini_stream_sectors[index] + 1) * self.sector_size +
+                 offset % self.sector_size)
+        return self.view[start : start + 64]
 
     def get_fat_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe]:
-            return ''
-        elif sector < len(self.fat_table):
-            if self.verbose:
-                print "request sector %d - len %d" % (sector, len(self.fat_table))
-            if self.fat_table[sector] == 0xfffffffe:
-                return self.get_fat_sector(sector)
-            elif sector != self.fat_table[sector]:
-                data = self.get_fat_sector(sector)
-                return data + self.get_fat_chain(self.fat_table[sector])
-        return ''
+        if self.verbose:
+            print "request sector %d - len %d" % (sector, len(self.fat_table))
+        return ''.join([self.get_fat_sector(s)
+                        for s in self.walk_chain(self.fat_table, sector)])
 
     def get_mini_fat_sector_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe, 0xfffffffd]:
-            return []
-        elif sector < len(self.fat_table):
-            if self.fat_table[sector] == 0xfffffffe:
-                return [sector]
-            elif sector != self.fat_table[sector]:
-                return [sector] + self.get_mini_fat_sector_chain(self.fat_table[sector])
-        return []
+        return list(self.walk_chain(self.fat_table, sector,
+                                    (0xffffffff, 0xfffffffe, 0xfffffffd)))
 
     def get_fat_sector(self, sector):
         return self.data[(sector + 1) * self.sector_size : (sector+2) * self.sector_size]
 
+    def get_fat_sector_view(self, sector):
+        return self.view[(sector + 1) * self.sector_size : (sector+2) * self.sector_size]
+
+    def iter_stream(self, entry):
+        """
+        Yield the sectors backing a directory entry as memoryview slices.
+        """
+        if entry['object_type'] == 0x05 or entry['stream_size'] >= self.office_header['mini_stream_cutoff']:
+            for sector in self.walk_chain(self.fat_table, entry['start_sect']):
+                yield self.get_fat_sector_view(sector)
+        elif entry['stream_size'] > 0:
+            for sector in self.walk_chain(self.mini_fat_table, entry['start_sect']):
+                yield self.get_mini_fat_sector_view(sector)
+
+    def get_stream(self, entry):
+        """
+        Return the full contents of a directory entry's stream.
+        """
+        return ''.join([sector.tobytes() for sector in self.iter_stream(entry)])
+
+    def is_property_set(self, entry):
+        # property set streams start with a 0xfffe byte order mark and carry
+        # the FMTID of their first section at offset 28
+        if entry['object_type'] not in [0,2]:
+            return False
+        for sector in self.iter_stream(entry):
+            head = sector[:44].tobytes()
+            return head[:2] == '\xfe\xff' and head[28:44] in self.summary_mapping
+        return False
+
     def make_fat(self, sector_list):
         fat = array.array('I')
         if self.verbose:
@@ -163,6 +209,7 @@ class OfficeParser(object):
             if self.verbose:
                 print "\t[+] found office header at offset %04X" % offset
             self.data = self.data[offset:]
+            self.view = memoryview(self.data)
             return offset
         if self.verbose:
             print "\t[-] could not find office header"
@@ -275,24 +322,25 @@ class OfficeParser(object):
         return {}
 
     def parse_directory(self, data):
-        if len(data) >= 128:
-            #if data[:8] == '\x00\x10\x00\x00\x00\x00\x00\x00': 
-            #    print "trucating first 8 bytes"
-            #    self.parse_directory(data[8:])
+        for offset in xrange(0, len(data) - 127, 128):
+            (name_len, object_type, color, left_sibling, right_sibling, child
+             ) = struct.unpack_from('<HBBIII', data, offset + 64)
+            (state, create_time, modify_time, start_sect, stream_size
+             ) = struct.unpack_from('<IQQIQ', data, offset + 96)
             entry = {
-                'name':             data[:64],
-                'name_len':         struct.unpack('H', data[64:66])[0],
-                'object_type':      struct.unpack('B', data[66])[0],
-                'color':            struct.unpack('B', data[67])[0],
-                'left_sibling':     struct.unpack('I', data[68:72])[0],
-                'right_sibling':    struct.unpack('I', data[72:76])[0],
-                'child':            struct.unpack('I', data[76:80])[0],
-                'clsid':            binascii.hexlify(data[80:96]),
-                'state':            struct.unpack('I', data[96:100])[0],
-                'create_time':      struct.unpack('Q', data[100:108])[0],
-                'modify_time':      struct.unpack('Q', data[108:116])[0],
-                'start_sect':       struct.unpack('I', data[116:120])[0],
-                'stream_size':      struct.unpack('Q', data[120:128])[0],
+                'name':             data[offset:offset+64],
+                'name_len':         name_len,
+                'object_type':      object_type,
+                'color':            color,
+                'left_sibling':     left_sibling,
+                'right_sibling':    right_sibling,
+                'child':            child,
+                'clsid':            binascii.hexlify(data[offset+80:offset+96]),
+                'state':            state,
+                'create_time':      create_time,
+                'modify_time':      modify_time,
+                'start_sect':       start_sect,
+                'stream_size':      stream_size,
             }
             # /version 3 limits this field to 32 bits
             if self.office_header['maj_ver'] == 3:
@@ -306,32 +354,31 @@ class OfficeParser(object):
                     norm_name = norm_name[1:]
             entry['norm_name'] = norm_name
             entry['result'] = norm_name
-            # fetch any directory data if available
+            # the root entry holds the mini stream used by small streams
             if entry['object_type'] == 0x05:
-                dir_data = self.get_fat_chain(entry['start_sect'])
-                self.mini_fat_data = dir_data
-            elif entry['stream_size'] > 0 and entry['stream_size'] < self.office_header['mini_stream_cutoff']:
-                dir_data = self.get_mini_fat_chain(entry['start_sect'])
-            elif entry['stream_size'] >= self.office_header['mini_stream_cutoff']:
-                dir_data = self.get_fat_chain(entry['start_sect'])
-            else:
-                 dir_data = ''
-            if self.verbose:
-                print "[+] got %d data from %s" % (len(dir_data), entry['result'])
-            # check the directory specific content and parse
-            if entry['object_type'] in [0,2] and len(dir_data) > 0:
+                self.mini_stream_sectors = list(self.walk_chain(self.fat_table, entry['start_sect']))
+            # only property set streams are loaded, everything else is
+            # hashed a sector at a time
+            if self.is_property_set(entry):
+                dir_data = self.get_stream(entry)
                 for clsid in self.summary_mapping.keys():
                     if clsid in dir_data:
                         self.properties.append(self.parse_summary_information(dir_data, clsid))
                         if self.verbose:
                             print self.properties
-            if len(dir_data) > 0:
-                entry['md5'] = hashlib.md5(dir_data).hexdigest()
-                entry['data'] = dir_data
+            if self.hash_streams:
+                md5 = hashlib.md5()
+                data_len = 0
+                for sector in self.iter_stream(entry):
+                    md5.update(sector)
+                    data_len += len(sector)
+                if self.verbose:
+                    print "[+] got %d data from %s" % (data_len, entry['result'])
+                if data_len > 0:
+                    entry['md5'] = md5.hexdigest()
             if self.verbose:
                 pprint.pprint(entry)
-            self.directory.append(entry) 
-            self.parse_directory(data[128:])
+            self.directory.append(entry)
         return {}
 
     def pretty_print(self):
@@ -359,3 +406,186 @@ class OfficeParser(object):
         self.office_header = self.parse_office_header()
         if self.office_header['maj_ver'] in [3,4]:
             self.parse_directory(self.get_fat_chain(self.office_header['first_dir_sect']))        
+
+
+class OOXMLParser(object):
+    """
+    Pulls document properties out of an Office Open XML (docx, xlsx, pptx)
+    package. Only the zip central directory and the docProps/[Content_Types]
+    parts are read, embedded media is never decompressed.
+    """
+    summary_clsid = "\xE0\x85\x9F\xF2\xF9\x4F\x68\x10\xAB\x91\x08\x00\x2B\x27\xB3\xD9"
+    doc_summary_clsid = "\x02\xD5\xCD\xD5\x9C\x2E\x1B\x10\x93\x97\x08\x00\x2B\x2C\xF9\xAE"
+    # element name -> (property set, property id) in OfficeParser.summary_mapping
+    core_mapping = {
+        'title':            (summary_clsid, 0x02),
+        'subject':          (summary_clsid, 0x03),
+        'creator':          (summary_clsid, 0x04),
+        'keywords':         (summary_clsid, 0x05),
+        'description':      (summary_clsid, 0x06),
+        'lastModifiedBy':   (summary_clsid, 0x08),
+        'revision':         (summary_clsid, 0x09),
+        'lastPrinted':      (summary_clsid, 0x0b),
+        'created':          (summary_clsid, 0x0c),
+        'modified':         (summary_clsid, 0x0d),
+        'category':         (doc_summary_clsid, 0x02),
+    }
+    app_mapping = {
+        'Template':             (summary_clsid, 0x07),
+        'TotalTime':            (summary_clsid, 0x0a),
+        'Pages':                (summary_clsid, 0x0e),
+        'Words':                (summary_clsid, 0x0f),
+        'Characters':           (summary_clsid, 0x10),
+        'Application':          (summary_clsid, 0x12),
+        'DocSecurity':          (summary_clsid, 0x13),
+        'PresentationFormat':   (doc_summary_clsid, 0x03),
+        'Lines':                (doc_summary_clsid, 0x05),
+        'Paragraphs':           (doc_summary_clsid, 0x06),
+        'Slides':               (doc_summary_clsid, 0x07),
+        'Notes':                (doc_summary_clsid, 0x08),
+        'HiddenSlides':         (doc_summary_clsid, 0x09),
+        'MMClips':              (doc_summary_clsid, 0x0a),
+        'ScaleCrop':            (doc_summary_clsid, 0x0b),
+        'Manager':              (doc_summary_clsid, 0x0e),
+        'Company':              (doc_summary_clsid, 0x0f),
+        'LinksUpToDate':        (doc_summary_clsid, 0x10),
+    }
+    date_fields = ['created', 'modified', 'lastPrinted']
+    zip_magic = "PK\x03\x04"
+    content_types_name = '[Content_Types].xml'
+    core_name = 'docProps/core.xml'
+    app_name = 'docProps/app.xml'
+
+    def __init__(self, fileobj, verbose=False):
+        self.fileobj = fileobj
+        self.verbose = verbose
+        self.content_types = {}
+        self.main_content_type = ''
+        self.properties = []
+        self.property_sets = {}
+        # (part name, exception) for each part that couldn't be read.
+        self.part_errors = []
+
+    @classmethod
+    def sniff(cls, header):
+        """
+        Check whether the start of a zip file has a local file header for the
+        [Content_Types].xml part. Office writes that part first, so it is
+        found without reading the central directory at the end of the file.
+
+        :param header: The first bytes of the file.
+        :type header: str
+        :returns: bool
+        """
+
+        name = cls.content_types_name
+        pos = header.find(name)
+        while pos != -1:
+            # The name follows the 30 byte fixed part of the local header,
+            # which records its length at offset 26.
+            start = pos - 30
+            if (start >= 0 and header[start:start + 4] == cls.zip_magic and
+                struct.unpack("<H", header[start + 26:start + 28])[0] == len(name)):
+                return True
+            pos = header.find(name, pos + 1)
+        return False
+
+    @staticmethod
+    def local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def iter_children(self, fin):
+        """
+        Yield (name, text) for the direct children of the root element of
+        an XML part, clearing elements as they are consumed.
+        """
+        depth = 0
+        for event, elem in iterparse(fin, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield (self.local_name(elem.tag), elem.text or '')
+                elem.clear()
+
+    def w3cdtf_string(self, value):
+        try:
+            timestamp = calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+        except ValueError:
+            return (0, value)
+        return (timestamp, time.strftime("%Y/%m/%d %H:%M:%S", time.gmtime(timestamp)))
+
+    def add_property(self, clsid, prop_id, name, value):
+        if clsid not in self.property_sets:
+            prop_set = {
+                'clsid':            binascii.hexlify(clsid),
+                'properties':       {'properties': []},
+            }
+            self.property_sets[clsid] = prop_set
+            self.properties.append({'property_list': [prop_set]})
+        prop = {
+            'id':               prop_id,
+            'name':             OfficeParser.summary_mapping[clsid].get(prop_id, name),
+            'value':            value,
+        }
+        if name in self.date_fields:
+            (prop['timestamp'], prop['date']) = self.w3cdtf_string(prop['value'])
+        prop['result'] = "%s: %s" % (prop['name'], prop['value'])
+        self.property_sets[clsid]['properties']['properties'].append(prop)
+
+    def parse_content_types(self, fin):
+        for event, elem in iterparse(fin):
+            if self.local_name(elem.tag) == 'Override':
+                part = elem.get('PartName', '')
+                content_type = elem.get('ContentType', '')
+                self.content_types[part] = content_type
+                if content_type.endswith('.main+xml'):
+                    self.main_content_type = content_type
+                elem.clear()
+
+    def parse_properties(self, fin, mapping):
+        for name, value in self.iter_children(fin):
+            # vector valued properties (HeadingPairs, TitlesOfParts) have
+            # no text of their own
+            if not value.strip():
+                continue
+            (clsid, prop_id) = mapping.get(name, (self.doc_summary_clsid, None))
+            self.add_property(clsid, prop_id, name, value)
+
+    def parse_ooxml_doc(self):
+        try:
+            package = zipfile.ZipFile(self.fileobj)
+            names = set(package.namelist())
+        except (zipfile.BadZipfile, IOError):
+            if self.verbose:
+                print "\t[-] could not read zip central directory"
+            return None
+        if self.content_types_name not in names:
+            if self.verbose:
+                print "\t[-] missing %s" % self.content_types_name
+            return None
+        parts = [
+            (self.content_types_name, self.parse_content_types, ()),
+            (self.core_name, self.parse_properties, (self.core_mapping,)),
+            (self.app_name, self.parse_properties, (self.app_mapping,)),
+        ]
+        for (name, parser, args) in parts:
+            if name not in names:
+                continue
+            if self.verbose:
+                print "\t[+] parsing %s" % name
+            try:
+                fin = package.open(name)
+                try:
+                    parser(fin, *args)
+                finally:
+                    fin.close()
+            except (SyntaxError, zlib.error, zipfile.BadZipfile,
+                    RuntimeError, IOError) as e:
+                # A corrupt or encrypted part shouldn't stop the others
+                # from being read.
+                self.part_errors.append((name, e))
+                if self.verbose:
+                    print "\t[-] error parsing %s: %s" % (name, e)
+        return self.main_content_type
@@ -21,6 +21,7 @@ from crits.core.class_mapper import class_from_id
 from django.conf import settings
 from django.template.loader import render_to_string
 from crits.services.core import Service, ServiceConfigError
+from header_sniff import read_header
 
 from . import forms
 
@@ -97,8 +98,7 @@ class pdf2txtService(Service):
     def valid_for(obj):
         if not obj.filedata:
             return False
-        data = obj.filedata.read(8)
-        obj.filedata.seek(0)
+        data = read_header(obj, 8)
         if obj.is_pdf():
             return True
         elif data.startswith("\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
@@ -17,6 +17,7 @@ from crits.screenshots.handlers import add_screenshot
 from django.conf import settings
 from django.template.loader import render_to_string
 from crits.services.core import Service, ServiceConfigError
+from header_sniff import read_header
 
 from . import forms
 
@@ -91,8 +92,7 @@ class previewService(Service):
         # Only run on PIL supported image files or PDF files
         if not obj.filedata:
             return False
-        data = obj.filedata.read(8)
-        obj.filedata.seek(0)
+        data = read_header(obj, 8)
         if obj.is_pdf():
             return True
         elif data.startswith("\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
@@ -100,9 +100,8 @@ class previewService(Service):
             return True
         else:
             try:
-                obj.filedata.seek(0)
-                im = Image.open(io.BytesIO(obj.filedata.read()))
-                obj.filedata.seek(0)
+                # Image.open only looks at the header to identify the format.
+                im = Image.open(io.BytesIO(read_header(obj)))
                 if not im.format:
                     raise ServiceConfigError("Not supported image format")
                     return False
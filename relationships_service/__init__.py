@@ -2,6 +2,10 @@ import logging
 
 from crits.services.core import Service
 
+# Registers the signal handlers that keep the relationship edge collection
+# in sync with saved objects.
+from . import edges
+
 logger = logging.getLogger(__name__)
 
 class RelationshipsService(Service):
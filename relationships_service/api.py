@@ -2,6 +2,7 @@ from tastypie import authorization
 from tastypie.exceptions import BadRequest
 from tastypie.authentication import MultiAuthentication
 from mongoengine import Document, ListField, DynamicField, DictField
+from mongoengine import BooleanField, StringField
 
 from django.conf import settings
 
@@ -24,12 +25,15 @@ class GraphObject(CritsDocument, Document):
 
     nodes = ListField(DynamicField(DictField))
     links = ListField(DynamicField(DictField))
+    truncated = BooleanField(default=False)
+    truncated_reason = StringField()
 
 class RelationshipsServiceResource(CRITsAPIResource):
     """
     Class to handle everything related to the Relationships Service API.
 
-    Currently supports GET.
+    Currently supports GET. Passing expand=1 returns only the given object
+    and its immediate neighbours, for growing a graph one node at a time.
     """
 
     class Meta:
@@ -60,6 +64,7 @@ class RelationshipsServiceResource(CRITsAPIResource):
         cid = request.GET.get('cid', None)
         depth = request.GET.get('depth', 3)
         types = request.GET.get('types', '')
+        expand = request.GET.get('expand') in ('1', 'true', 'True')
 
         # If the user specifies no types, be generous.
         if types:
@@ -73,8 +78,14 @@ class RelationshipsServiceResource(CRITsAPIResource):
             raise BadRequest("Must specify CRITs id (cid).")
 
         username = request.user.username
-        rels = handlers.gather_relationships(ctype, cid, username, depth, types)
+        if expand:
+            rels = handlers.expand_node(ctype, cid, username, types)
+        else:
+            rels = handlers.gather_relationships(ctype, cid, username, depth,
+                                                 types)
         gobj = GraphObject()
         gobj.nodes = rels['nodes']
         gobj.links = rels['links']
+        gobj.truncated = rels['truncated']
+        gobj.truncated_reason = rels.get('truncated_reason')
         return [gobj]
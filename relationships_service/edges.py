@@ -0,0 +1,184 @@
+"""
+A flat collection of relationship edges.
+
+Every top-level object keeps its relationships in an embedded list, so
+finding the neighbours of a set of objects means loading each of them in
+full. This keeps one small document per relationship instead, indexed by
+both ends, so k-hop expansion is a handful of indexed queries.
+
+The collection is kept in sync by mongoengine signals whenever a top-level
+object is created, deleted, or saved with changed relationships. Those only
+fire in processes that have imported this module, and not at all for
+queryset updates or writes made outside mongoengine, so the backfill_edges
+script is also used to reconcile the collection. Graphs only use it once a
+full backfill has completed.
+"""
+
+import datetime
+import logging
+
+from mongoengine import Document, Q, signals
+from mongoengine import ObjectIdField, StringField, DateTimeField, BooleanField
+
+logger = logging.getLogger(__name__)
+
+
+class RelationshipEdge(Document):
+    """
+    One relationship, from the object that holds it to the related object.
+    """
+
+    meta = {
+        'collection': 'relationship_edges',
+        'allow_inheritance': False,
+        'indexes': [
+            ('src_id', 'dst_id'),
+            ('dst_id', 'src_id'),
+            ('src_type', 'rel_type'),
+        ],
+    }
+
+    src_type = StringField(required=True)
+    src_id = ObjectIdField(required=True)
+    dst_type = StringField(required=True)
+    dst_id = ObjectIdField(required=True)
+    rel_type = StringField()
+    date = DateTimeField()
+
+
+class RelationshipEdgeState(Document):
+    """
+    Whether every relationship has been loaded into the edge collection.
+
+    Written by the backfill_edges script once it has been through every
+    type, and cleared when it drops the collection.
+    """
+
+    meta = {
+        'collection': 'relationship_edges_state',
+        'allow_inheritance': False,
+    }
+
+    complete = BooleanField(default=False)
+    completed = DateTimeField()
+
+
+def edges_for(obj):
+    """
+    Build the edges for an object's embedded relationships.
+
+    :param obj: A top-level object.
+    :returns: list of :class:`RelationshipEdge`
+    """
+
+    src_type = obj._meta['crits_type']
+    edges = []
+    for r in obj.relationships:
+        if not r.object_id:
+            continue
+        edges.append(RelationshipEdge(src_type=src_type,
+                                      src_id=obj.id,
+                                      dst_type=r.rel_type,
+                                      dst_id=r.object_id,
+                                      rel_type=r.relationship,
+                                      date=r.relationship_date))
+    return edges
+
+
+def _edge_key(edge):
+    date = edge.date
+    if date is not None:
+        # Mongo only keeps milliseconds.
+        date = date.replace(microsecond=date.microsecond // 1000 * 1000)
+    return (edge.dst_type, edge.dst_id, edge.rel_type, date)
+
+
+def sync_edges(obj):
+    """
+    Bring the stored edges of an object in line with its current
+    relationships. Only edges that were added or removed are written, so
+    saving an object whose relationships haven't changed costs one query.
+    """
+
+    stored = {}
+    stale = []
+    fields = ('id', 'dst_type', 'dst_id', 'rel_type', 'date')
+    for edge in RelationshipEdge.objects(src_id=obj.id).only(*fields):
+        key = _edge_key(edge)
+        if key in stored:
+            stale.append(edge.id)
+        else:
+            stored[key] = edge.id
+    wanted = {}
+    for edge in edges_for(obj):
+        wanted.setdefault(_edge_key(edge), edge)
+    stale.extend(id_ for (key, id_) in stored.iteritems() if key not in wanted)
+    new = [edge for (key, edge) in wanted.iteritems() if key not in stored]
+    if stale:
+        RelationshipEdge.objects(id__in=stale).delete()
+    if new:
+        RelationshipEdge.objects.insert(new, load_bulk=False)
+
+
+def _is_tlo(document):
+    meta = getattr(document, '_meta', {})
+    return (meta.get('crits_type') is not None and
+            hasattr(document, 'relationships'))
+
+
+def _on_pre_save(sender, document, **kwargs):
+    # Changed fields are cleared by the time post_save is sent. A document
+    # loaded with only() some fields, without relationships, has an empty
+    # list there, and syncing that would delete all of its edges.
+    if _is_tlo(document):
+        document._relationships_changed = any(
+            field == 'relationships' or field.startswith('relationships.')
+            for field in document._get_changed_fields())
+
+
+def _on_save(sender, document, **kwargs):
+    if not _is_tlo(document):
+        return
+    if not (kwargs.get('created') or
+            getattr(document, '_relationships_changed', False)):
+        return
+    try:
+        sync_edges(document)
+    except Exception, e:
+        logger.error("Unable to sync relationship edges for %s: %s" %
+                     (document.id, e))
+
+
+def _on_delete(sender, document, **kwargs):
+    if not _is_tlo(document):
+        return
+    try:
+        RelationshipEdge.objects(Q(src_id=document.id) |
+                                 Q(dst_id=document.id)).delete()
+    except Exception, e:
+        logger.error("Unable to remove relationship edges for %s: %s" %
+                     (document.id, e))
+
+
+def set_edges_complete(complete):
+    """
+    Record whether the edge collection holds every relationship.
+    """
+
+    completed = datetime.datetime.now() if complete else None
+    RelationshipEdgeState.objects.update_one(set__complete=complete,
+                                             set__completed=completed,
+                                             upsert=True)
+
+
+def edges_available():
+    """
+    True once a full backfill of the edge collection has completed.
+    """
+
+    return RelationshipEdgeState.objects(complete=True).first() is not None
+
+
+signals.pre_save.connect(_on_pre_save)
+signals.post_save.connect(_on_save)
+signals.post_delete.connect(_on_delete)
@@ -0,0 +1,112 @@
+"""
+An in-process cache of built relationship graphs.
+
+Each entry remembers the modified time of every object in the graph. A hit
+is only served after checking those against the database (one small query
+per type), so a graph is rebuilt as soon as anything in it changes.
+"""
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from bson.objectid import ObjectId
+
+from crits.core.class_mapper import class_from_type
+
+# Most graphs kept.
+GRAPH_CACHE_SIZE = 100
+
+# Most nodes kept across all cached graphs.
+GRAPH_CACHE_MAX_NODES = 50000
+
+# Seconds a graph is served for at most, so things not tracked by modified
+# times (new campaign members, campaign counts) are picked up eventually.
+GRAPH_CACHE_TTL = 300
+
+
+class GraphCache(object):
+    """
+    A least recently used cache of graphs bounded by entries and nodes.
+    """
+
+    def __init__(self, size=GRAPH_CACHE_SIZE, max_nodes=GRAPH_CACHE_MAX_NODES,
+                 ttl=GRAPH_CACHE_TTL):
+        self.size = size
+        self.max_nodes = max_nodes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.nodes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return a copy of the cached graph for key, or None if there is no
+        usable entry.
+        """
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            # Re-inserting moves it to the most recently used end.
+            self.entries[key] = entry
+
+        (graph, versions, created) = entry
+        if time.time() - created > self.ttl or not self.is_current(versions):
+            self.discard(key)
+            return None
+        return copy.deepcopy(graph)
+
+    def put(self, key, graph, versions):
+        """
+        Cache a graph along with the modified time of each object in it.
+
+        :param versions: dict of object ID -> (crits type, modified)
+        """
+
+        count = len(graph['nodes'])
+        if count > self.max_nodes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nodes -= len(old[0]['nodes'])
+            self.entries[key] = (copy.deepcopy(graph), versions, time.time())
+            self.nodes += count
+            while (len(self.entries) > self.size or
+                   self.nodes > self.max_nodes):
+                (k, (g, v, c)) = self.entries.popitem(last=False)
+                self.nodes -= len(g['nodes'])
+
+    def discard(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nodes -= len(old[0]['nodes'])
+
+    def is_current(self, versions):
+        """
+        Check that every object still exists with the same modified time.
+        """
+
+        by_type = {}
+        for (id_, (type_, modified)) in versions.iteritems():
+            by_type.setdefault(type_, []).append(id_)
+        for (type_, ids) in by_type.iteritems():
+            klass = class_from_type(type_)
+            if not klass:
+                return False
+            found = 0
+            oids = [ObjectId(id_) for id_ in ids]
+            for obj in klass.objects(id__in=oids).only('id', 'modified'):
+                found += 1
+                if versions[str(obj.id)][1] != getattr(obj, 'modified', None):
+                    return False
+            if found != len(ids):
+                return False
+        return True
+
+
+graph_cache = GraphCache()
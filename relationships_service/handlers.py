@@ -1,3 +1,6 @@
+import time
+
+from bson.objectid import ObjectId
 from django.core.urlresolvers import reverse
 
 from crits.campaigns.campaign import Campaign
@@ -6,18 +9,66 @@ from crits.core.crits_mongoengine import EmbeddedCampaign
 from crits.core.user_tools import user_sources
 from crits.core.class_mapper import class_from_type, class_from_id
 
-def gather_relationships(obj_type, obj_id, user, depth, types):
+from .edges import RelationshipEdge, edges_available
+from .graph_cache import graph_cache
+
+# Hard limits on how much of a graph is gathered for one request. Anything
+# beyond them can be pulled in a node at a time with expand_node().
+GRAPH_MAX_NODES = 500
+GRAPH_MAX_SECONDS = 10
+
+def gather_relationships(obj_type, obj_id, user, depth, types,
+                         max_nodes=GRAPH_MAX_NODES,
+                         max_seconds=GRAPH_MAX_SECONDS):
+    """
+    Gather the relationship graph around an object, from the cache when
+    nothing in it has changed since it was built.
+    """
+
+    sources = user_sources(user)
+    if not sources:
+        return { 'nodes': [], 'links': [], 'truncated': False }
+
+    try:
+        depth = int(depth)
+    except ValueError:
+        depth = 3
+
+    key = (obj_type, str(obj_id), depth, tuple(sorted(set(types))),
+           tuple(sorted(sources)), max_nodes)
+    graph = graph_cache.get(key)
+    if graph is None:
+        (graph, versions) = build_graph(obj_type, obj_id, user, sources, depth,
+                                        types, max_nodes, max_seconds)
+        # A graph cut off by the time limit depends on how busy the server
+        # was, the next request may get further.
+        if graph.get('truncated_reason') != 'time':
+            graph_cache.put(key, graph, versions)
+    return graph
+
+def build_graph(obj_type, obj_id, user, sources, depth, types, max_nodes,
+                max_seconds):
+    """
+    Build the relationship graph around an object.
+
+    :returns: tuple of the graph and a dict of object ID -> (crits type,
+              modified) for every object in it.
+    """
+
     objects = {}
     nodes = []
     links = []
+    # Why the graph was cut short, if it was.
+    truncated = {'reason': None}
+    # IDs of objects all of whose neighbours are in the graph. The client
+    # can ask to expand any other node.
+    expanded = set()
+    # Object ID -> list of (type, ID) of the objects it is related to.
+    related = {}
     # These would be used if we move to force labels
     #labelAnchors = []
     #labelAnchorLinks = []
 
-    sources = user_sources(user)
-    if not sources:
-        return { 'nodes': nodes, 'links': links }
-
     field_dict = {
         'Actor': 'name',
         'Backdoor': 'name',
@@ -171,56 +222,112 @@ def gather_relationships(obj_type, obj_id, user, depth, types):
         }
     }
 
-    def inner_collect(obj_type, obj_id, sources, depth):
-        # Don't keep going if we've already processed this object
-        if obj_id in objects:
-            return
-
-        klass = class_from_type(obj_type)
-        if not klass:
-            return
-
-        if hasattr(klass, 'source'):
-            obj = klass.objects(id=obj_id, source__name__in=sources).first()
+    def graph_fields(obj_type, klass):
+        # Only load the fields the graph is built from. When the edge
+        # collection is in use the relationships come from there instead.
+        fields = ['id', 'modified', 'status', 'campaign', 'version',
+                  field_dict.get(obj_type), url_dict.get(obj_type)]
+        if not use_edges:
+            fields.append('relationships')
+        return [f for f in set(fields) if f and f in klass._fields]
+
+    def find_related(ids):
+        # Fill in related for the given objects.
+        if use_edges:
+            oids = [ObjectId(id_) for id_ in ids]
+            edges = RelationshipEdge.objects(src_id__in=oids).only('src_id',
+                                                                   'dst_type',
+                                                                   'dst_id')
+            for edge in edges:
+                related[str(edge.src_id)].append((edge.dst_type,
+                                                  str(edge.dst_id)))
         else:
-            obj = klass.objects(id=obj_id).first()
-        if not obj:
-            return
-
-        objects[obj_id] = obj
-
-        if depth == 0:
-            return
-
-        depth -= 1
-        for r in obj.relationships:
-            if r.object_id:
-                inner_collect(r.rel_type, str(r.object_id), sources, depth)
-
-        # If we traverse into a Campaign object, walk everything tagged
-        # with that campaign along with related objects.
-        if obj_type == 'Campaign':
-            for c in field_dict.keys():
-                klass = class_from_type(c)
-                # Not every object in field_dict can be tagged with a campaign.
-                # For example, comments.
-                if not hasattr(klass, 'campaign'):
+            for id_ in ids:
+                related[id_].extend((r.rel_type, str(r.object_id))
+                                    for r in objects[id_].relationships
+                                    if r.object_id)
+
+    def collect(obj_type, obj_id, sources, depth):
+        # Walk the graph one level at a time. Each level is fetched with a
+        # single id__in query per type instead of a query per object, so
+        # the number of queries grows with depth rather than graph size.
+        #
+        # The walk stops early once max_nodes objects are loaded or
+        # max_seconds have passed, leaving the reason in truncated.
+        deadline = time.time() + max_seconds
+        frontier = [(obj_type, obj_id)]
+        # Objects whose neighbours are in the current frontier.
+        parents = []
+        seen = set()
+        level = 0
+        while frontier:
+            by_type = {}
+            for (type_, id_) in frontier:
+                if id_ in seen:
                     continue
-                tagged_objs = klass.objects(campaign__name=obj.name)
-                for tobj in tagged_objs:
-                    inner_collect(tobj._meta['crits_type'],
-                                  str(tobj.id),
-                                  sources,
-                                  depth)
-        # END OF INNER COLLECT
-
-    try:
-        depth = int(depth)
-    except ValueError:
-        depth = 3
-
-
-    inner_collect(obj_type, str(obj_id), sources, depth)
+                seen.add(id_)
+                by_type.setdefault(type_, []).append(id_)
+
+            next_frontier = []
+            next_parents = []
+            campaigns = []
+            for (type_, ids) in by_type.iteritems():
+                klass = class_from_type(type_)
+                if not klass:
+                    continue
+                if time.time() > deadline:
+                    truncated['reason'] = 'time'
+                    return
+                remaining = max_nodes - len(objects)
+                if remaining <= 0:
+                    truncated['reason'] = 'nodes'
+                    return
+                query = {'id__in': ids}
+                if hasattr(klass, 'source'):
+                    query['source__name__in'] = sources
+                fields = graph_fields(type_, klass)
+                loaded = []
+                for obj in klass.objects(**query).only(*fields).limit(remaining):
+                    objects[str(obj.id)] = obj
+                    related[str(obj.id)] = []
+                    loaded.append(str(obj.id))
+                    if type_ == 'Campaign' and level != depth:
+                        campaigns.append(obj.name)
+                find_related(loaded)
+                if level != depth:
+                    for id_ in loaded:
+                        next_parents.append(id_)
+                        next_frontier.extend(related[id_])
+                if len(loaded) == remaining and len(ids) > remaining:
+                    truncated['reason'] = 'nodes'
+                    return
+
+            # Every neighbour of the previous level has now been loaded.
+            expanded.update(parents)
+
+            # If we traverse into a Campaign object, walk everything tagged
+            # with that campaign along with related objects.
+            if campaigns:
+                for c in field_dict.keys():
+                    klass = class_from_type(c)
+                    # Not every object in field_dict can be tagged with a
+                    # campaign. For example, comments.
+                    if not hasattr(klass, 'campaign'):
+                        continue
+                    tagged_objs = klass.objects(campaign__name__in=campaigns).only('id').limit(max_nodes)
+                    for tobj in tagged_objs:
+                        next_frontier.append((c, str(tobj.id)))
+
+            frontier = next_frontier
+            parents = next_parents
+            level += 1
+        expanded.update(parents)
+
+    # Walk the edge collection rather than each object's embedded
+    # relationships once a full backfill of it has completed.
+    use_edges = edges_available()
+
+    collect(obj_type, str(obj_id), sources, depth)
 
     # This dictionary is used to describe the position of each object
     # in the nodes list. The key is an object ID and the value is a
@@ -313,9 +420,10 @@ def gather_relationships(obj_type, obj_id, user, depth, types):
         n['id'] = obj_id
         n['type'] = n['group'] = obj_type
         n['visible'] = True
+        n['expanded'] = obj_id in expanded
 
         nodes.append(n)
-        obj_graph[obj_id] = (node_position, [str(r.object_id) for r in obj.relationships])
+        obj_graph[obj_id] = (node_position, [id_ for (t, id_) in related.get(obj_id, [])])
         node_position += 1
 
     # This dictionary is used to track the links that have been created.
@@ -349,12 +457,26 @@ def gather_relationships(obj_type, obj_id, user, depth, types):
         #         'weight': 1,
         #}
         #labelAnchorLinks.append(alink)
-    return {
+    graph = {
             'nodes': nodes,
             'links': links,
+            'truncated': truncated['reason'] is not None,
+            'truncated_reason': truncated['reason'],
             #'labelAnchors': labelAnchors,
             #'labelAnchorLinks': labelAnchorLinks,
            }
+    versions = dict((obj_id, (obj._meta['crits_type'],
+                              getattr(obj, 'modified', None)))
+                    for (obj_id, obj) in objects.iteritems())
+    return (graph, versions)
+
+def expand_node(obj_type, obj_id, user, types):
+    """
+    Gather a single node and its immediate neighbours so the client can
+    grow a graph on demand.
+    """
+
+    return gather_relationships(obj_type, obj_id, user, 1, types)
 
 def add_campaign_from_nodes(name, confidence, nodes, user):
     result = { "success": False }
@@ -0,0 +1,69 @@
+from optparse import OptionParser
+
+from django.conf import settings
+
+from crits.core.basescript import CRITsBaseScript
+from crits.core.class_mapper import class_from_type
+from relationships_service.edges import RelationshipEdge, sync_edges
+from relationships_service.edges import set_edges_complete
+
+# Number of orphaned edges removed with a single query.
+DELETE_CHUNK_SIZE = 1000
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-t", "--type", action="append", dest="types",
+                type="string", help="CRITs type to backfill (repeatable, default all)")
+        parser.add_option("-d", "--drop", action="store_true", dest="drop",
+                default=False, help="Drop the edge collection first")
+        parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                default=False, help="Be verbose")
+        (opts, args) = parser.parse_args(argv)
+
+        if opts.drop:
+            if opts.verbose:
+                print "[+] dropping relationship edges"
+            # Graphs go back to the embedded relationships until the
+            # collection has been rebuilt.
+            set_edges_complete(False)
+            RelationshipEdge.drop_collection()
+        RelationshipEdge.ensure_indexes()
+
+        types = opts.types or settings.CRITS_TYPES.keys()
+        for type_ in types:
+            klass = class_from_type(type_)
+            if not klass or 'relationships' not in klass._fields:
+                continue
+            count = 0
+            seen = set()
+            for obj in klass.objects.only('id', 'relationships').no_cache():
+                sync_edges(obj)
+                seen.add(obj.id)
+                count += 1
+            # Edges of objects deleted without the signal firing.
+            unseen = set()
+            edges = RelationshipEdge.objects(src_type=type_).only('src_id')
+            for edge in edges.no_cache():
+                if edge.src_id not in seen:
+                    unseen.add(edge.src_id)
+            unseen = list(unseen)
+            orphans = 0
+            for i in xrange(0, len(unseen), DELETE_CHUNK_SIZE):
+                chunk = unseen[i:i + DELETE_CHUNK_SIZE]
+                # Objects created since they were read above are kept.
+                created = klass.objects(id__in=chunk).distinct('id')
+                chunk = list(set(chunk) - set(created))
+                if chunk:
+                    RelationshipEdge.objects(src_id__in=chunk).delete()
+                    orphans += len(chunk)
+            if opts.verbose:
+                print "[+] %s: %d objects, %d orphans removed" % (type_, count,
+                                                                 orphans)
+
+        # A partial run leaves the collection as complete as it was.
+        if not opts.types:
+            set_edges_complete(True)
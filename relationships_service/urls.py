@@ -2,6 +2,7 @@ from django.conf.urls import patterns
 
 urlpatterns = patterns('relationships_service.views',
     (r'add_campaign/$', 'add_campaign'),
+    (r'^expand/(?P<ctype>.+?)/(?P<cid>.+?)/$', 'expand_relationships'),
     (r'^(?P<ctype>.+?)/(?P<cid>.+?)/$', 'get_relationships'),
 )
 
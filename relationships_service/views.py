@@ -21,6 +21,19 @@ def get_relationships(request, ctype, cid):
 
     return HttpResponse(json.dumps(result), mimetype="application/json")
 
+@user_passes_test(user_can_view_data)
+def expand_relationships(request, ctype, cid):
+    result = { "success": False, "message": "No data available." }
+    types = request.POST.get('types', '').split(',')
+
+    result['message'] = handlers.expand_node(ctype,
+                                             cid,
+                                             "%s" % request.user,
+                                             types)
+    result['success'] = True
+
+    return HttpResponse(json.dumps(result), mimetype="application/json")
+
 @user_passes_test(user_can_view_data)
 def add_campaign(request):
     result = { "success": False }
@@ -40,7 +40,7 @@ class TAXIIClient(Service):
     """ Send TAXII message to TAXII server. """
 
     name = "taxii_service"
-    version = "2.0.2"
+    version = "2.0.3"
     supported_types = []
     required_fields = ['_id']
     description = "Send TAXII messages to a TAXII server."
@@ -80,6 +80,12 @@ class TAXIIClient(Service):
             errors.append("Polling time must be an integer.")
         if not config.get('inbox_time', "").strip().isdigit():
             errors.append("Inbox time must be an integer.")
+        if not config.get('polling_workers', "4").strip().isdigit():
+            errors.append("Polling workers must be an integer.")
+        elif int(config.get('polling_workers', "4")) < 1:
+            errors.append("Polling workers must be at least 1.")
+        if not config.get('polling_timeout', "300").strip().isdigit():
+            errors.append("Polling timeout must be an integer.")
         for crtfile in config['certfiles']:
             try:
                 (source, feed, polling, inbox) = crtfile.split(',')
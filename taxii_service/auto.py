@@ -1,20 +1,113 @@
+import logging
 import threading
+from multiprocessing.pool import ThreadPool
 from crits.services.handlers import get_config, update_config
 import time
 from . import handlers
 from . import taxii
 from dateutil.tz import tzutc
-from crits.core.mongo_tools import mongo_find
+from crits.core.mongo_tools import mongo_connector
 import pytz
 from datetime import datetime
 from dateutil.parser import parse
 from datetime import timedelta
 from crits.core.class_mapper import class_from_id
 
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for feeds that are due, finished or timed out.
+POLLING_TICK = 5
+
+# Longest a feed is backed off for after repeated failures, in seconds.
+POLLING_MAX_BACKOFF = 3600
+
+
+class FeedState(object):
+    """
+    Scheduling state and metrics for one polled feed.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        # The poll in progress, if any, and when a worker started running
+        # it. It is None while the poll is still queued for a worker.
+        self.pending = None
+        self.started = None
+        # Set once a pending poll has run past its timeout. It keeps its
+        # pool worker until it returns, but its result is ignored.
+        self.timed_out = False
+        self.failures = 0
+        self.next_poll = 0
+        # Metrics for the last poll.
+        self.latency = None
+        self.blocks = 0
+        self.imported = 0
+        self.error = None
+        self.polls = 0
+
+    def metrics(self):
+        return {'feed': self.feed,
+                'latency': self.latency,
+                'blocks': self.blocks,
+                'imported': self.imported,
+                'error': self.error,
+                'failures': self.failures,
+                'polls': self.polls,
+                'polling': self.pending is not None}
+
+
+def config_int(sc, name, default):
+    # Configs saved before a setting was added don't have it.
+    if name in sc and str(sc[name]).strip().isdigit():
+        return int(sc[name])
+    return default
+
+
+def poll_feed(state, timeout):
+    """
+    Poll a feed, timing how long it takes.
+
+    The start time is recorded on the state here, on the worker, so time
+    spent queued for a free worker doesn't count towards the timeout.
+
+    :param state: The feed's scheduling state.
+    :type state: FeedState
+    :param timeout: Seconds each connect, send or receive may take.
+    :type timeout: int
+    :returns: tuple of (seconds taken, execute_taxii_agent result)
+    """
+
+    state.started = started = time.time()
+    result = handlers.execute_taxii_agent(analyst="taxii",
+                                          method="TAXII Agent Web",
+                                          feed=state.feed, timeout=timeout)
+    return (time.time() - started, result)
+
 
 class TaxiiAgentPolling(threading.Thread):
+    """
+    Poll every feed with polling turned on, several at a time.
+
+    Feeds are polled by a bounded pool of threads so a slow or hanging feed
+    doesn't hold up the others. A feed is never polled again while its last
+    poll is still running, so its start time still comes from the last
+    Taxii document saved for it. A feed whose poll fails or runs past
+    polling_timeout is backed off exponentially, up to POLLING_MAX_BACKOFF.
+
+    A poll is timed from when a worker starts running it, not from when it
+    was queued. Its connections to the TAXII server also time out after
+    polling_timeout without any progress, so a server that stops
+    responding makes the poll fail and frees its worker. A server that
+    keeps sending a little at a time holds its worker until it finishes,
+    but the poll is still counted as timed out and its result ignored.
+    """
+
     def __init__(self):
         threading.Thread.__init__(self)
+        self.pool = None
+        self.workers = 0
+        self.feeds = {}
+        self.lock = threading.Lock()
 
     def run(self):
         print "Polling thread started :)"
@@ -24,6 +117,7 @@ class TaxiiAgentPolling(threading.Thread):
             sc = get_config('taxii_service')
             certfiles = sc['certfiles']
 
+            feeds = []
             if 'active' in sc:
 
                 if sc['active']:    # Only run if the service is active
@@ -34,9 +128,117 @@ class TaxiiAgentPolling(threading.Thread):
                            (source, feed, polling, inbox) = crtfile.split(',')
                            src = source.strip()
                            if polling in 'true':
-                               handlers.execute_taxii_agent(analyst="taxii", method="TAXII Agent Web", feed=src)
+                               feeds.append(src)
+
+            self.poll_feeds(feeds,
+                            int(sc['polling_time']),
+                            config_int(sc, 'polling_timeout', 300),
+                            config_int(sc, 'polling_workers', 4))
+            time.sleep(POLLING_TICK)
+
+    def poll_feeds(self, feeds, interval, timeout, workers):
+        """
+        Collect finished polls and start polls for feeds that are due.
+
+        :param feeds: The feeds to poll.
+        :type feeds: list
+        :param interval: Seconds between polls of a feed.
+        :type interval: int
+        :param timeout: Seconds a poll may take before it is given up on.
+        :type timeout: int
+        :param workers: Most feeds polled at once.
+        :type workers: int
+        """
+
+        now = time.time()
+        with self.lock:
+            for (feed, state) in self.feeds.items():
+                if state.pending is not None:
+                    self.check_poll(state, now, interval, timeout)
+                # Forget feeds that are no longer polled once nothing is
+                # running for them.
+                if state.pending is None and feed not in feeds:
+                    del self.feeds[feed]
+
+        if not feeds:
+            return
+        if self.pool is None or self.workers != workers:
+            # Polls still running on an old pool are left to finish.
+            if self.pool is not None:
+                self.pool.close()
+            self.pool = ThreadPool(max(1, workers))
+            self.workers = workers
+
+        with self.lock:
+            for feed in feeds:
+                state = self.feeds.setdefault(feed, FeedState(feed))
+                if state.pending is None and now >= state.next_poll:
+                    state.started = None
+                    state.timed_out = False
+                    state.pending = self.pool.apply_async(poll_feed,
+                                                          (state, timeout))
+
+    def check_poll(self, state, now, interval, timeout):
+        if not state.pending.ready():
+            # Polls still queued for a worker haven't started yet.
+            if (state.started is not None and not state.timed_out and
+                now - state.started > timeout):
+                state.timed_out = True
+                self.record(state, now, now - state.started, None,
+                            "Timed out after %ds" % timeout, interval)
+            return
+
+        pending = state.pending
+        state.pending = None
+        if state.timed_out:
+            # Already counted as a failure when it timed out.
+            logger.info("TAXII feed %s finished after timing out (%.1fs)" %
+                        (state.feed, now - state.started))
+            return
+        try:
+            (latency, result) = pending.get()
+        except Exception, e:
+            self.record(state, now, now - state.started, None, str(e),
+                        interval)
+            return
+        if result.get('status'):
+            self.record(state, now, latency, result, None, interval)
+        else:
+            self.record(state, now, latency, result,
+                        result.get('reason') or "Poll failed", interval)
+
+    def record(self, state, now, latency, result, error, interval):
+        state.latency = latency
+        state.polls += 1
+        state.error = error
+        if result:
+            state.blocks = result.get('blocks', 0)
+            state.imported = result.get('successes', 0)
+        else:
+            state.blocks = state.imported = 0
+        if error:
+            state.failures += 1
+            backoff = min(interval * 2 ** state.failures, POLLING_MAX_BACKOFF)
+            state.next_poll = now + max(backoff, interval)
+            logger.warning("TAXII feed %s failed after %.1fs (%s), next poll "
+                           "in %ds" % (state.feed, state.latency, error,
+                                       state.next_poll - now))
+        else:
+            state.failures = 0
+            state.next_poll = now + interval
+            logger.info("TAXII feed %s polled in %.1fs, %d blocks, %d "
+                        "imported" % (state.feed, state.latency,
+                                      state.blocks, state.imported))
+
+    def metrics(self):
+        """
+        Get the metrics of the last poll of each feed.
+
+        :returns: list of dicts
+        """
 
-            time.sleep(int(sc['polling_time']))
+        with self.lock:
+            return [state.metrics() for state in self.feeds.values()]
 
 polling_thread = TaxiiAgentPolling()
 
@@ -65,12 +267,89 @@ def start_polling():
 
 
 
+# Collections scanned for items to send, and their CRITs types.
+#Other TLOs that TAXII will send without error: pcaps/PCAP, raw_data/RawData, certificates/Certificate
+INBOX_COLLECTIONS = [
+    ('domains', 'Domain'),
+    ('email', 'Email'),
+    ('ips', 'IP'),
+    ('campaigns', 'Campaign'),
+    ('sample', 'Sample'),
+]
+
+# Documents fetched per round trip while scanning.
+INBOX_BATCH_SIZE = 500
+
+# Only the fields needed to decide what to send are fetched.
+INBOX_FIELDS = {
+    '_id': 1,
+    'releasability.name': 1,
+    'releasability.release': 1,
+    'releasability.reference_id': 1,
+}
+
+
+def ensure_inbox_indexes():
+    """
+    Index the scanned collections so finding items flagged for release to
+    a feed doesn't need a collection scan. The indexes are built in the
+    background so a large collection isn't locked while they are.
+    """
+
+    for (collection, crits_type) in INBOX_COLLECTIONS:
+        try:
+            mongo_connector(collection).create_index([
+                ('releasability.name', 1),
+                ('releasability.release', 1),
+                ('modified', -1)], background=True)
+        except Exception, e:
+            logger.error("Unable to index %s for TAXII inbox: %s" %
+                         (collection, e))
+
+
+def releasable_items(start, feeds):
+    """
+    Find the items modified since start that are flagged for release to
+    any of the feeds.
+
+    Only the releasability of each item is fetched, a batch at a time,
+    newest first.
+
+    :param start: Only items modified after this.
+    :type start: datetime.datetime
+    :param feeds: The sources sent to the TAXII server.
+    :type feeds: list
+    :returns: generator of (crits type, ObjectId, list of source names,
+              STIX id or None)
+    """
+
+    query = {
+        'modified': {'$gt': start},
+        'releasability': {'$elemMatch': {'name': {'$in': feeds},
+                                         'release': True}},
+    }
+    for (collection, crits_type) in INBOX_COLLECTIONS:
+        cursor = mongo_connector(collection).find(query, INBOX_FIELDS)
+        cursor = cursor.sort([('modified', -1)]).batch_size(INBOX_BATCH_SIZE)
+        for doc in cursor:
+            release_list = []
+            release_id = None
+            for release in doc.get('releasability', []):
+                if release.get('name') in feeds and release.get('release'):
+                    release_list.append(release['name'])
+                    if 'reference_id' in release:   #Checking to see if STIX id already exists
+                        release_id = release['reference_id']
+            if release_list:
+                yield (crits_type, doc['_id'], release_list, release_id)
+
+
 class TaxiiAgentInbox(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
 
     def run(self, start=None, feed='inbox', end=None):
         print "Inbox thread started :)"
+        ensure_inbox_indexes()
 
         while True:
 
@@ -116,34 +395,18 @@ class TaxiiAgentInbox(threading.Thread):
                         crits_taxii.end = end
                         crits_taxii.feed = feed
 
-                        # Create a list of items that were recently modified
-                        TLO = []
-                        TLO.append([{'items': mongo_find('domains', {'modified': {'$gt': start}}, sort=[('modified',-1)])}, {'collection' : 'Domain'}])
-                        TLO.append([{'items': mongo_find('email', {'modified': {'$gt': start}}, sort=[('modified',-1)])}, {'collection' : 'Email'}])
-                        TLO.append([{'items': mongo_find('ips', {'modified': {'$gt': start}}, sort=[('modified',-1)])}, {'collection' : 'IP'}])
-                        TLO.append([{'items': mongo_find('campaigns', {'modified': {'$gt': start}}, sort=[('modified',-1)])}, {'collection' : 'Campaign'}])
-                        TLO.append([{'items': mongo_find('sample', {'modified': {'$gt': start}}, sort=[('modified',-1)])},{'collection' : 'Sample'}])
-                        #Other TLOs that TAXII will send without error: pcaps/PCAP, raw_data/RawData, certificates/Certificate
-
-                        for samples in TLO:
-                            for doc in samples[0]['items']:
-                                release_list = []
-                                release_id = None
-
-                                obj_item = class_from_id(samples[1]['collection'], doc['_id'])
-
-                                if 'releasability' in doc:
-                                    for release in doc['releasability']:
-                                        if release['name'] in feeds:
-                                            if 'release' in release:
-                                                if release['release']:  # Checking release flag
-                                                    release_list.append(release['name'])
-                                                    if 'reference_id' in release:   #Checking to see if STIX id already exists
-                                                        release_id = release['reference_id']
-
-                                if release_list != []:
-                                    data = handlers.run_taxii_service("taxii", obj_item, release_list, preview=False,confirmed=True, ref_id=release_id)
-                                    print doc['_id'], " : ", data
+                        # Only items flagged for release to one of our
+                        # feeds are loaded in full. The small projected
+                        # results are read up front so no cursor is held
+                        # open while items are sent.
+                        if feeds:
+                            items = list(releasable_items(start, feeds))
+                            for (crits_type, oid, release_list, release_id) in items:
+                                obj_item = class_from_id(crits_type, oid)
+                                if not obj_item:
+                                    continue
+                                data = handlers.run_taxii_service("taxii", obj_item, release_list, preview=False,confirmed=True, ref_id=release_id)
+                                print oid, " : ", data
 
                         crits_taxii.save()
 
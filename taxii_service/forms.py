@@ -184,6 +184,18 @@ class TAXIIServiceConfigForm(forms.Form):
                                          'data-intro': 'How often (seconds) do you want to check for new items?'}),
                               help_text="How often do you want to poll the TAXII Server")
 
+    polling_workers = forms.CharField(required=True,
+                              label="Polling Workers",
+                              initial='4',
+                              widget=forms.TextInput(),
+                              help_text="How many feeds to poll at the same time")
+
+    polling_timeout = forms.CharField(required=True,
+                              label="Polling Timeout (Seconds)",
+                              initial='300',
+                              widget=forms.TextInput(),
+                              help_text="How long a feed can take to poll before it is backed off")
+
     inbox_time = forms.CharField(required=True,
                               label="Inbox Frequency (Seconds)",
                               initial='30',
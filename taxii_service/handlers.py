@@ -2,6 +2,7 @@ import logging
 import os
 import pytz
 import socket
+import urllib2
 import uuid
 
 from datetime import datetime
@@ -48,9 +49,111 @@ from crits.vocabulary.relationships import RelationshipTypes
 
 logger = logging.getLogger(__name__)
 
+# X-TAXII-Services header sent with each message binding.
+TAXII_SERVICES = {
+    t.VID_TAXII_XML_10: t.VID_TAXII_SERVICES_10,
+    t.VID_TAXII_XML_11: t.VID_TAXII_SERVICES_11,
+}
+
+
+class TimeoutHTTPSHandler(tc.LibtaxiiHTTPSHandler):
+    """
+    libtaxii's HTTPS handler, passing the request timeout on to the
+    connection instead of dropping it.
+    """
+
+    def getConnection(self, host, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        return tc.VerifiableHTTPSConnection(host,
+                                            key_file=self.key_file,
+                                            cert_file=self.cert_file,
+                                            timeout=timeout,
+                                            verify_server=self.verify_server,
+                                            ca_certs=self.ca_certs)
+
+
+class TimeoutHttpClient(tc.HttpClient):
+    """
+    A libtaxii HttpClient whose connections time out.
+
+    libtaxii's callTaxiiService2 installs a process-wide urllib2 opener on
+    every call and opens its connections without a timeout. This builds an
+    opener for each call and opens the request through it with the timeout,
+    so no global state is touched. The timeout applies to each socket
+    operation: connecting, and each send or receive.
+
+    Only the authentication types execute_taxii_agent uses are supported,
+    none over HTTP and none or a certificate over HTTPS.
+    """
+
+    def __init__(self, timeout=None):
+        tc.HttpClient.__init__(self)
+        if timeout is None:
+            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+        self.timeout = timeout
+
+    def callTaxiiService2(self, host, path, message_binding, post_data,
+                          port=None):
+        """
+        Call a TAXII service.
+
+        :param host: The TAXII server.
+        :type host: str
+        :param path: The path of the service on the server.
+        :type path: str
+        :param message_binding: The TAXII message binding of post_data.
+        :type message_binding: str
+        :param post_data: The TAXII message.
+        :type post_data: str
+        :param port: The port, by default 443 for HTTPS or 80 for HTTP.
+        :type port: int
+        :returns: :class:`urllib2.addinfourl` or :class:`urllib2.HTTPError`
+        """
+
+        # The same headers libtaxii sends when none are given.
+        headers = {
+            'User-Agent': 'libtaxii.httpclient',
+            'Content-Type': 'application/xml',
+            'Accept': 'application/xml',
+            'X-TAXII-Content-Type': message_binding,
+            'X-TAXII-Accept': message_binding,
+            'X-TAXII-Services': TAXII_SERVICES[message_binding],
+        }
+        if self.use_https:
+            headers['X-TAXII-Protocol'] = t.VID_TAXII_HTTPS_10
+            key_file = cert_file = None
+            if self.auth_type == tc.HttpClient.AUTH_CERT:
+                key_file = self.auth_credentials['key_file']
+                cert_file = self.auth_credentials['cert_file']
+            handler = TimeoutHTTPSHandler(key_file=key_file,
+                                          cert_file=cert_file,
+                                          verify_server=self.verify_server,
+                                          ca_certs=self.ca_file)
+            scheme = 'https'
+            port = port or 443
+        else:
+            headers['X-TAXII-Protocol'] = t.VID_TAXII_HTTP_10
+            handler = urllib2.HTTPHandler()
+            scheme = 'http'
+            port = port or 80
+        handler_list = [handler]
+        if self.proxy_string == 'noproxy':
+            handler_list.append(urllib2.ProxyHandler({}))
+        elif self.proxy_string is not None:
+            handler_list.append(urllib2.ProxyHandler({self.proxy_type:
+                                                      self.proxy_string}))
+        opener = urllib2.build_opener(*handler_list)
+
+        url = '%s://%s:%d%s' % (scheme, host, port, path)
+        req = urllib2.Request(url, post_data, headers)
+        try:
+            return opener.open(req, timeout=self.timeout)
+        except urllib2.HTTPError, error:
+            return error
+
+
 def execute_taxii_agent(hostname=None, https=None, feed=None, keyfile=None,
                         certfile=None, start=None, end=None, analyst=None,
-                        method=None):
+                        method=None, timeout=None):
     ret = {
             'Certificate': [],
             'Domain': [],
@@ -63,6 +166,7 @@ def execute_taxii_agent(hostname=None, https=None, feed=None, keyfile=None,
             'Sample': [],
             'successes': 0,
             'failures': [],
+            'blocks': 0,
             'status': False,
             'reason': ''
           }
@@ -112,7 +216,7 @@ def execute_taxii_agent(hostname=None, https=None, feed=None, keyfile=None,
         ret['reason'] = "Bad timestamp(s)"
         return ret
 
-    client = tc.HttpClient()
+    client = TimeoutHttpClient(timeout)
     if https:
         client.setUseHttps(True)
         client.setAuthType(tc.HttpClient.AUTH_CERT)
@@ -177,6 +281,7 @@ def execute_taxii_agent(hostname=None, https=None, feed=None, keyfile=None,
         return ret
 
     mid = taxii_msg.message_id
+    ret['blocks'] = len(taxii_msg.content_blocks)
     for content_block in taxii_msg.content_blocks:
         print "got a message from %s feed" % feed
         data = parse_content_block(content_block, keyfile, certfile)
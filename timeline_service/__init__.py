@@ -6,7 +6,7 @@ logger = logging.getLogger(__name__)
 
 class TimelineService(Service):
     name = "timeline_service"
-    version = '0.0.1'
+    version = '0.0.3'
     supported_types = []
     description = "Generate a timeline for an object."
 
@@ -1,5 +1,7 @@
 import cgi
+import heapq
 import urllib
+import datetime
 
 from django.core.urlresolvers import reverse
 from django.template.loader import render_to_string
@@ -7,15 +9,42 @@ from django.template.loader import render_to_string
 from crits.core.user_tools import user_sources
 from crits.core.class_mapper import class_from_type
 
-def generate_timeline(obj_type, obj_id, user):
+# Entries returned per page by the timeline API.
+TIMELINE_PAGE_SIZE = 100
 
-    users_sources = user_sources(user)
+# Most entries a single page request may ask for.
+TIMELINE_MAX_PAGE_SIZE = 1000
+
+# Types searched for objects tagged with a campaign.
+CAMPAIGN_MEMBER_TYPES = ['Actor', 'Backdoor', 'Certificate', 'Domain',
+                         'Email', 'Event', 'Exploit', 'Indicator', 'IP',
+                         'PCAP', 'RawData', 'Sample', 'Signature', 'Target']
+
+# Most objects merged into a campaign timeline.
+CAMPAIGN_TIMELINE_MAX_MEMBERS = 5000
+
+# AnalysisResult.start_date is a string, str(datetime.datetime.now()), so it
+# has microseconds unless they happened to be zero.
+ANALYSIS_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+# AnalysisResult fields a timeline entry is built from.
+ANALYSIS_FIELDS = ('analyst', 'service_name', 'version', 'start_date',
+                   'results')
+
+def get_main_obj(obj_type, obj_id, users_sources):
     obj_class = class_from_type(obj_type)
+    if not obj_class:
+        return None
     if hasattr(obj_class, 'source'):
-        main_obj = obj_class.objects(id=obj_id,
-                                    source__name__in=users_sources).first()
+        return obj_class.objects(id=obj_id,
+                                 source__name__in=users_sources).first()
     else:
-        main_obj = obj_class.objects(id=obj_id).first()
+        return obj_class.objects(id=obj_id).first()
+
+def generate_timeline(obj_type, obj_id, user):
+
+    users_sources = user_sources(user)
+    main_obj = get_main_obj(obj_type, obj_id, users_sources)
     if not main_obj:
         return {'success': False,
                 'message': 'No starting object found.'}
@@ -26,10 +55,407 @@ def generate_timeline(obj_type, obj_id, user):
     # the first item in the tuple should be a datetime string for the event.
     # the second element should be a description of the event that happened.
     timeline = {}
+    for (date, i) in iter_timeline(main_obj, obj_type, obj_id, users_sources):
+        append_to_timeline(timeline, date, i)
+
+    # sort timeline
+    sorted_timeline = []
+    keys = timeline.keys()
+    keys.sort()
+    for key in keys:
+        k = timeline[key]
+        k.sort(key=lambda tup:tup[0])
+        sorted_timeline.append((key, k))
+
+    html = render_to_string('timeline_contents.html',
+                            {'timeline': sorted_timeline})
+
+    return {'success': True,
+            'message': html}
+
+def get_timeline_page(obj_type, obj_id, user, start=None, end=None,
+                      cursor=None, limit=TIMELINE_PAGE_SIZE):
+    """
+    Get one page of an object's timeline, newest entries first.
+
+    Only entries dated within [start, end) are fetched from each part of the
+    timeline, and the parts are merged lazily so a page never costs more
+    than the entries on it.
+
+    :param obj_type: The CRITs type of the object.
+    :type obj_type: str
+    :param obj_id: The ObjectId of the object.
+    :type obj_id: str
+    :param user: The user requesting the timeline.
+    :type user: str
+    :param start: Only entries on or after this date.
+    :type start: datetime.datetime
+    :param end: Only entries before this date.
+    :type end: datetime.datetime
+    :param cursor: The cursor returned with the previous page.
+    :type cursor: str
+    :param limit: The number of entries to return.
+    :type limit: int
+    :returns: dict with keys "success", "entries" and "cursor" (None once
+              there is nothing older).
+    """
+
+    users_sources = user_sources(user)
+    main_obj = get_main_obj(obj_type, obj_id, users_sources)
+    if not main_obj:
+        return {'success': False,
+                'message': 'No starting object found.'}
+
+    end = cursor_end(cursor, end)
+    events = iter_timeline(main_obj, obj_type, obj_id, users_sources,
+                           start=start, end=end, newest_first=True,
+                           count=page_count(cursor, limit))
+    (entries, next_cursor) = paginate(events, cursor, limit)
+    return {'success': True,
+            'entries': entries,
+            'cursor': next_cursor}
+
+def get_campaign_timeline_page(campaign_id, user, start=None, end=None,
+                               cursor=None, limit=TIMELINE_PAGE_SIZE):
+    """
+    Get one page of the merged timeline of a Campaign and the objects
+    tagged with it, newest entries first.
+
+    The Campaign's own timeline is merged with when each tagged object was
+    created, commented on and run through services. Those come from one
+    query per type sorted on an indexed date and limited to what one page
+    can use, so the tagged objects themselves are never loaded.
+
+    :param campaign_id: The ObjectId of the Campaign.
+    :type campaign_id: str
+    :param user: The user requesting the timeline.
+    :type user: str
+    :param start: Only entries on or after this date.
+    :type start: datetime.datetime
+    :param end: Only entries before this date.
+    :type end: datetime.datetime
+    :param cursor: The cursor returned with the previous page.
+    :type cursor: str
+    :param limit: The number of entries to return.
+    :type limit: int
+    :returns: dict with keys "success", "entries", "cursor" and "truncated"
+              (True if the campaign has more than
+              CAMPAIGN_TIMELINE_MAX_MEMBERS objects and only some of them
+              were included).
+    """
+
+    users_sources = user_sources(user)
+    campaign = get_main_obj('Campaign', campaign_id, users_sources)
+    if not campaign:
+        return {'success': False,
+                'message': 'No starting object found.'}
+
+    end = cursor_end(cursor, end)
+    count = page_count(cursor, limit)
+
+    (members, truncated) = campaign_members(campaign.name, users_sources)
+    link = object_link('Campaign', campaign.id)
+    parts = [((date, link + i) for (date, i) in
+              iter_timeline(campaign, 'Campaign', campaign.id, users_sources,
+                            start=start, end=end, newest_first=True,
+                            count=count))]
+    parts.extend(campaign_member_parts(members, start, end, count))
+    events = merge_newest_first(parts)
+    (entries, next_cursor) = paginate(events, cursor, limit)
+    return {'success': True,
+            'entries': entries,
+            'cursor': next_cursor,
+            'truncated': truncated}
+
+def campaign_members(name, users_sources):
+    """
+    Find the objects tagged with a campaign which the user can see.
+
+    :returns: tuple of (list of (type, ObjectId), truncated)
+    """
+
+    members = []
+    for type_ in CAMPAIGN_MEMBER_TYPES:
+        klass = class_from_type(type_)
+        if not klass or not hasattr(klass, 'campaign'):
+            continue
+        query = {'campaign__name': name}
+        if hasattr(klass, 'source'):
+            query['source__name__in'] = users_sources
+        remaining = CAMPAIGN_TIMELINE_MAX_MEMBERS - len(members)
+        for obj in klass.objects(**query).only('id').limit(remaining + 1):
+            if len(members) == CAMPAIGN_TIMELINE_MAX_MEMBERS:
+                return (members, True)
+            members.append((type_, obj.id))
+    return (members, False)
+
+def campaign_member_parts(members, start, end, count):
+    """
+    The newest `count` creation, comment and service entries in range for
+    the members of a campaign, as lists ordered newest first.
+    """
+
+    by_type = {}
+    for (type_, id_) in members:
+        by_type.setdefault(type_, []).append(id_)
+    parts = []
+
+    for (type_, ids) in by_type.iteritems():
+        klass = class_from_type(type_)
+        objs = klass.objects(id__in=ids, **date_query('created', start, end))
+        objs = objs.order_by('-created').only('id', 'created').limit(count)
+        parts.append([(obj.created, object_link(type_, obj.id) +
+                       created_entry(type_)) for obj in objs])
+
+    ids = [id_ for (type_, id_) in members]
+    if not ids:
+        return parts
+
+    cobj = class_from_type("Comment")
+    comments = cobj.objects(obj_id__in=ids,
+                            **date_query('created', start, end))
+    entries = []
+    for comment in comments.order_by('-created').limit(count):
+        entries.append((comment.created,
+                        object_link(comment.obj_type, comment.obj_id) +
+                        comment_entry(comment)))
+    parts.append(entries)
+
+    aobj = class_from_type("AnalysisResult")
+    results = aobj.objects(object_id__in=[str(id_) for id_ in ids],
+                           **analysis_date_query(start, end))
+    results = results.only('object_type', 'object_id', *ANALYSIS_FIELDS)
+    entries = []
+    for analysis in results.order_by('-start_date').limit(count):
+        entries.append((analysis_date(analysis.start_date),
+                        object_link(analysis.object_type, analysis.object_id) +
+                        analysis_entry(analysis)))
+    parts.append(entries)
+    return parts
+
+def object_link(obj_type, obj_id):
+    """
+    A link to an object, to prefix its entries in a merged timeline.
+    """
+
+    rev = reverse('crits.core.views.details', args=[obj_type, str(obj_id),])
+    return '<a href="%s">%s</a>: ' % (cgi.escape(rev), obj_type)
+
+def created_entry(obj_type):
+    return "<b>%s</b> was created" % obj_type
+
+def comment_entry(comment):
+    comment.comment_to_html()
+    return "<b>%s</b> made a comment: %s" % (comment.analyst,
+                                             cgi.escape(comment.comment))
+
+def analysis_entry(analysis):
+    return "<b>%s</b> ran <b>%s (%s)</b> and got <b>%d</b> results." % (analysis.analyst,
+                                                                       analysis.service_name,
+                                                                       analysis.version,
+                                                                       len(analysis.results))
+
+def page_count(cursor, limit):
+    """
+    How many entries each part of a timeline needs to supply to skip past
+    the cursor and fill the page, plus one to tell if there is another page.
+    """
+
+    (cursor_date, skip) = parse_cursor(cursor)
+    return max(1, min(limit, TIMELINE_MAX_PAGE_SIZE)) + skip + 1
+
+def cursor_end(cursor, end):
+    """
+    Narrow the end of the range to where the previous page stopped. The
+    cursor is inclusive since several entries can share its date.
+    """
+
+    (cursor_date, skip) = parse_cursor(cursor)
+    if cursor_date:
+        bound = cursor_date + datetime.timedelta(microseconds=1)
+        if end is None or bound < end:
+            return bound
+    return end
+
+def paginate(events, cursor, limit):
+    """
+    Take one page of entries from a stream of entries ordered newest first,
+    skipping those already returned before the cursor.
+
+    :param events: The entries, newest first.
+    :type events: iterable of (datetime.datetime, str)
+    :returns: tuple of (list of entry dicts, next cursor or None)
+    """
+
+    limit = max(1, min(limit, TIMELINE_MAX_PAGE_SIZE))
+    (cursor_date, skipped) = parse_cursor(cursor)
+    skip = skipped
+    entries = []
+    more = False
+    for (date, i) in events:
+        if date is None:
+            # Undated entries have no place on a paged timeline.
+            continue
+        if skip and date == cursor_date:
+            skip -= 1
+            continue
+        if len(entries) == limit:
+            more = True
+            break
+        entries.append((date, i))
+
+    next_cursor = None
+    if more:
+        last = entries[-1][0]
+        count = len([d for (d, i) in entries if d == last])
+        if last == cursor_date:
+            # Entries sharing this date were skipped to get here too.
+            count += skipped
+        next_cursor = "%s|%d" % (last.isoformat(), count)
+
+    return ([{'date': str(d),
+              'day': str(d).split(" ")[0],
+              'html': i} for (d, i) in entries],
+            next_cursor)
+
+def parse_cursor(cursor):
+    """
+    Split a cursor into the date of the last entry returned and how many
+    entries with that date have been returned so far.
+    """
+
+    if not cursor:
+        return (None, 0)
+    try:
+        (date, count) = cursor.rsplit('|', 1)
+        return (parse_date(date), int(count))
+    except ValueError:
+        return (None, 0)
+
+def parse_date(value):
+    """
+    Parse an ISO 8601 date or datetime string, raising ValueError if it
+    isn't one.
+    """
+
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %s" % value)
+
+def in_range(date, start, end):
+    if start is None and end is None:
+        return True
+    if date is None:
+        return False
+    return (start is None or date >= start) and (end is None or date < end)
+
+def sort_key(date):
+    # Newer dates give smaller keys, undated entries sort as the oldest.
+    return datetime.datetime.min - (date or datetime.datetime.min)
+
+def from_list(entries, start, end):
+    """
+    Filter (date, item) tuples built from an object's embedded lists to the
+    range and order them newest first.
+    """
+
+    entries = [e for e in entries if in_range(e[0], start, end)]
+    entries.sort(key=lambda e: sort_key(e[0]))
+    return iter(entries)
+
+def date_query(field, start, end):
+    query = {}
+    if start is not None:
+        query['%s__gte' % field] = start
+    if end is not None:
+        query['%s__lt' % field] = end
+    return query
+
+def analysis_date(value):
+    """
+    Turn an AnalysisResult start_date string into a datetime, or None if it
+    can't be parsed.
+    """
+
+    if isinstance(value, datetime.datetime) or not value:
+        return value or None
+    for fmt in ANALYSIS_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+def analysis_date_query(start, end):
+    # Bounds in the same str(datetime) form as start_date, which sorts
+    # correctly as text.
+    return date_query('start_date',
+                      str(start) if start is not None else None,
+                      str(end) if end is not None else None)
+
+def iter_timeline(main_obj, obj_type, obj_id, users_sources, start=None,
+                  end=None, newest_first=False, count=None):
+    """
+    Generate the (date, description) entries of an object's timeline.
+
+    Each part of the timeline yields its entries newest first, and they are
+    merged with a heap so entries are produced only as they are consumed.
+    Parts kept in other collections are queried by date range, and if
+    count is given only that many of their newest entries are fetched.
+
+    :returns: generator of (datetime.datetime, str) tuples, newest first if
+              newest_first is set, otherwise in no particular order.
+    """
+
+    parts = [
+        timeline_main(main_obj, obj_type, users_sources, start, end),
+        timeline_relationships(main_obj, users_sources, start, end),
+        timeline_comments(obj_type, obj_id, start, end, count),
+        timeline_analysis(obj_id, start, end, count),
+    ]
+    if obj_type == "RawData":
+        parts.append(timeline_raw_data(main_obj, obj_type, start, end))
+    if obj_type == "Indicator":
+        parts.append(timeline_indicator(main_obj, start, end))
+
+    if not newest_first:
+        for part in parts:
+            for entry in part:
+                yield entry
+        return
+
+    for entry in merge_newest_first(parts):
+        yield entry
+
+def merge_newest_first(parts):
+    """
+    Merge streams of (date, item) entries that are each newest first into
+    one stream, newest first. Streams are only advanced as entries are
+    consumed. Undated entries are dropped, they can turn up anywhere in a
+    stream (a start_date that can't be parsed) and would hold it back.
+    """
+
+    def keyed(part, n):
+        for (date, i) in part:
+            if date is not None:
+                yield (sort_key(date), n, date, i)
+
+    merged = heapq.merge(*[keyed(part, n) for (n, part) in enumerate(parts)])
+    for (key, n, date, i) in merged:
+        yield (date, i)
+
+def timeline_main(main_obj, obj_type, users_sources, start, end):
+    """
+    Entries built from the object itself.
+    """
+
+    entries = []
 
     # creation time
-    i = "<b>%s</b> was created" % obj_type
-    append_to_timeline(timeline, main_obj.created, i)
+    entries.append((main_obj.created, created_entry(obj_type)))
 
     # sources
     if hasattr(main_obj, 'source'):
@@ -42,7 +468,7 @@ def generate_timeline(obj_type, obj_id, user):
                                                             obj_type,
                                                             cgi.escape(str(instance.method)),
                                                             cgi.escape(str(instance.reference)))
-                    append_to_timeline(timeline, instance.date, i)
+                    entries.append((instance.date, i))
 
     # releasability
     for release in main_obj.releasability:
@@ -50,7 +476,7 @@ def generate_timeline(obj_type, obj_id, user):
             name = release.name
             for instance in release.instances:
                 i = "Release to <b>%s</b> added." % cgi.escape(name)
-                append_to_timeline(timeline, instance.date, i)
+                entries.append((instance.date, i))
 
     # campaigns
     for campaign in main_obj.campaign:
@@ -63,7 +489,7 @@ def generate_timeline(obj_type, obj_id, user):
                 description of '%s'" % (link,
                                         confidence,
                                         cgi.escape(description))
-        append_to_timeline(timeline, campaign.date, i)
+        entries.append((campaign.date, i))
 
     # objects
     for obj in main_obj.obj:
@@ -76,117 +502,145 @@ def generate_timeline(obj_type, obj_id, user):
         link = '<a href="%s">%s</a>' % (cgi.escape(rev), cgi.escape(value))
         i = "<b>%s</b> object added with a value of :<br />%s" % (type_,
                                                                   link)
-        append_to_timeline(timeline, obj.date, i)
+        entries.append((obj.date, i))
 
-    # relationships
-    for rel in main_obj.relationships:
-        tobj = class_from_type(rel.rel_type)
-        if tobj.objects(id=rel.object_id,
-                        source__name__in=users_sources).only('id').first():
+    # tickets
+    for ticket in main_obj.tickets:
+        i = "<b>%s</b> added Ticket <b>%s</b>" % (ticket.analyst,
+                                                  cgi.escape(ticket.ticket_number))
+        entries.append((ticket.date, i))
+
+    return from_list(entries, start, end)
+
+def timeline_relationships(main_obj, users_sources, start, end):
+    # Only relationships in range need their visibility checked.
+    rels = [rel for rel in main_obj.relationships
+            if in_range(rel.date, start, end)]
+    visible_ids = visible_relationships(rels, users_sources)
+    entries = []
+    for rel in rels:
+        if rel.object_id in visible_ids:
             rev = reverse('crits.core.views.details', args=[rel.rel_type,
                                                             str(rel.object_id),])
             link = '<a href="%s">%s</a>' % (rev, rel.rel_type)
             i = "<b>%s</b> was added with a relationship of <b>%s</b>." % (link,
                                                              rel.relationship)
-            append_to_timeline(timeline, rel.date, i)
+            entries.append((rel.date, i))
+    return from_list(entries, start, end)
 
-    # comments
+def timeline_comments(obj_type, obj_id, start, end, count=None):
     cobj = class_from_type("Comment")
     comments = cobj.objects(obj_type=obj_type,
-                            obj_id=obj_id)
+                            obj_id=obj_id,
+                            **date_query('created', start, end))
+    comments = comments.order_by('-created')
+    if count is not None:
+        comments = comments.limit(count)
     for comment in comments:
-        comment.comment_to_html()
-        i = "<b>%s</b> made a comment: %s" % (comment.analyst,
-                                              cgi.escape(comment.comment))
-        append_to_timeline(timeline, comment.created, i)
-
-    analysis_results = main_obj.get_analysis_results()
-
-    # analysis
-    for analysis in analysis_results:
-        analyst = analysis.analyst
-        service_name = analysis.service_name
-        version = analysis.version
-        results = len(analysis.results)
-        i = "<b>%s</b> ran <b>%s (%s)</b> and got <b>%d</b> results." % (analyst,
-                                                                         service_name,
-                                                                         version,
-                                                                         results)
-        append_to_timeline(timeline, analysis.start_date, i)
+        yield (comment.created, comment_entry(comment))
 
-    # tickets
-    for ticket in main_obj.tickets:
-        i = "<b>%s</b> added Ticket <b>%s</b>" % (ticket.analyst,
-                                                  cgi.escape(ticket.ticket_number))
-        append_to_timeline(timeline, ticket.date, i)
+def timeline_analysis(obj_id, start, end, count=None):
+    aobj = class_from_type("AnalysisResult")
+    results = aobj.objects(object_id=str(obj_id),
+                           **analysis_date_query(start, end))
+    results = results.only(*ANALYSIS_FIELDS).order_by('-start_date')
+    if count is not None:
+        results = results.limit(count)
+    for analysis in results:
+        yield (analysis_date(analysis.start_date), analysis_entry(analysis))
 
-    # raw data specific timeline entries
-    if obj_type == "RawData":
+def timeline_raw_data(main_obj, obj_type, start, end):
+    """
+    Raw data specific timeline entries.
+    """
 
-        # inline comments
-        for inline in main_obj.inlines:
-            i = "<b>%s</b> made an inline comment on line <b>%d</b>: %s" % (inline.analyst,
-                                                                            inline.line,
-                                                                            cgi.escape(inline.comment))
-            append_to_timeline(timeline, inline.date, i)
-
-        # highlights
-        for highlight in main_obj.highlights:
-            i = "<b>%s</b> highlighted line <b>%d</b>: %s" % (highlight.analyst,
-                                                              highlight.line,
-                                                              highlight.comment)
-            append_to_timeline(timeline, highlight.date, i)
-
-        # versions
-        robj = class_from_type(obj_type)
-        versions = robj.objects(link_id=main_obj.link_id).only('id',
-                                                               'version',
-                                                               'created')
-        for version in versions:
-            rev = reverse('crits.raw_data.views.raw_data_details',
-                          args=[str(version.id),])
-            link = '<a href="%s">%d</a>' % (rev, version.version)
-            i = "Version %s was added." % link
-            append_to_timeline(timeline, version.created, i)
-
-    # indicator specific timeline entries
-    if obj_type == "Indicator":
+    entries = []
 
-        # actions
-        for action in main_obj.actions:
-            i = "<b>%s</b> added action <b>%s</b> to start on <b>%s</b>" \
-                % (action.analyst,
-                   action.action_type,
-                   action.begin_date)
-            i += ", set to <b>%s</b>, with a reason of: <b>%s</b>" \
-                    % (action.active,
-                       cgi.escape(action.reason))
-            append_to_timeline(timeline, action.date, i)
-
-        # activity
-        for activity in main_obj.activity:
-            i = "<b>%s</b> noted Indicator activity from <b>%s</b> to <b>%s</b> \
-                    and said: %s" % (activity.analyst,
-                                     activity.start_date,
-                                     activity.end_date,
-                                     cgi.escape(activity.description))
-            append_to_timeline(timeline, activity.date, i)
+    # inline comments
+    for inline in main_obj.inlines:
+        i = "<b>%s</b> made an inline comment on line <b>%d</b>: %s" % (inline.analyst,
+                                                                        inline.line,
+                                                                        cgi.escape(inline.comment))
+        entries.append((inline.date, i))
 
-    # sort timeline
-    sorted_timeline = []
-    keys = timeline.keys()
-    keys.sort()
-    for key in keys:
-        k = timeline[key]
-        k.sort(key=lambda tup:tup[0])
-        sorted_timeline.append((key, k))
+    # highlights
+    for highlight in main_obj.highlights:
+        i = "<b>%s</b> highlighted line <b>%d</b>: %s" % (highlight.analyst,
+                                                          highlight.line,
+                                                          highlight.comment)
+        entries.append((highlight.date, i))
 
-    html = render_to_string('timeline_contents.html',
-                            {'timeline': sorted_timeline})
+    # versions
+    robj = class_from_type(obj_type)
+    versions = robj.objects(link_id=main_obj.link_id,
+                            **date_query('created', start, end)).only('id',
+                                                                      'version',
+                                                                      'created')
+    for version in versions:
+        rev = reverse('crits.raw_data.views.raw_data_details',
+                      args=[str(version.id),])
+        link = '<a href="%s">%d</a>' % (rev, version.version)
+        i = "Version %s was added." % link
+        entries.append((version.created, i))
 
-    return {'success': True,
-            'message': html}
+    return from_list(entries, start, end)
+
+def timeline_indicator(main_obj, start, end):
+    """
+    Indicator specific timeline entries.
+    """
+
+    entries = []
+
+    # actions
+    for action in main_obj.actions:
+        i = "<b>%s</b> added action <b>%s</b> to start on <b>%s</b>" \
+            % (action.analyst,
+               action.action_type,
+               action.begin_date)
+        i += ", set to <b>%s</b>, with a reason of: <b>%s</b>" \
+                % (action.active,
+                   cgi.escape(action.reason))
+        entries.append((action.date, i))
+
+    # activity
+    for activity in main_obj.activity:
+        i = "<b>%s</b> noted Indicator activity from <b>%s</b> to <b>%s</b> \
+                and said: %s" % (activity.analyst,
+                                 activity.start_date,
+                                 activity.end_date,
+                                 cgi.escape(activity.description))
+        entries.append((activity.date, i))
+
+    return from_list(entries, start, end)
+
+def visible_relationships(relationships, users_sources):
+    """
+    Find which related objects the user can see, with one query per type
+    rather than one per relationship.
+
+    :param relationships: The relationships to check.
+    :type relationships: list
+    :param users_sources: The sources the user has access to.
+    :type users_sources: list
+    :returns: set of visible object IDs
+    """
+
+    by_type = {}
+    for rel in relationships:
+        if rel.object_id:
+            by_type.setdefault(rel.rel_type, set()).add(rel.object_id)
 
+    visible = set()
+    for (rel_type, ids) in by_type.iteritems():
+        tobj = class_from_type(rel_type)
+        if not tobj:
+            continue
+        query = {'id__in': list(ids)}
+        if hasattr(tobj, 'source'):
+            query['source__name__in'] = users_sources
+        visible.update(o.id for o in tobj.objects(**query).only('id'))
+    return visible
 
 def append_to_timeline(timeline, date, item):
     dt = str(date)
@@ -0,0 +1,133 @@
+import datetime
+import unittest
+
+from . import handlers
+
+
+class FakeQuerySet(object):
+    """
+    Just enough of a mongoengine QuerySet for the timeline queries.
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def only(self, *fields):
+        return self
+
+    def order_by(self, field):
+        name = field.lstrip('-')
+        docs = sorted(self.docs, key=lambda d: getattr(d, name),
+                      reverse=field.startswith('-'))
+        return FakeQuerySet(docs)
+
+    def limit(self, count):
+        return FakeQuerySet(self.docs[:count])
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeDocument(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def fake_class(docs):
+    class FakeClass(object):
+        @staticmethod
+        def objects(**query):
+            found = []
+            for doc in docs:
+                for (key, value) in query.iteritems():
+                    (name, op) = (key.split('__') + ['eq'])[:2]
+                    field = getattr(doc, name)
+                    if ((op == 'eq' and field != value) or
+                        (op == 'in' and field not in value) or
+                        (op == 'gte' and field < value) or
+                        (op == 'lt' and field >= value)):
+                        break
+                else:
+                    found.append(doc)
+            return FakeQuerySet(found)
+    return FakeClass
+
+
+class AnalysisStartDateTest(unittest.TestCase):
+    """
+    AnalysisResult.start_date is stored as str(datetime.datetime.now()).
+    """
+
+    def setUp(self):
+        self.base = datetime.datetime(2015, 6, 1, 12, 0, 0)
+        self.analyses = []
+        for n in range(5):
+            date = self.base + datetime.timedelta(hours=n, microseconds=n)
+            self.analyses.append(self.analysis(str(date), 'service%d' % n))
+        self.analyses.append(self.analysis('not a date', 'broken'))
+        self.main_obj = FakeDocument(created=self.base - datetime.timedelta(1),
+                                     source=[], releasability=[], campaign=[],
+                                     obj=[], tickets=[], relationships=[])
+        classes = {'AnalysisResult': fake_class(self.analyses),
+                   'Comment': fake_class([])}
+        self.saved = (handlers.class_from_type, handlers.user_sources,
+                      handlers.get_main_obj, handlers.render_to_string)
+        handlers.class_from_type = classes.get
+        handlers.user_sources = lambda user: []
+        handlers.get_main_obj = lambda obj_type, obj_id, sources: self.main_obj
+        handlers.render_to_string = lambda template, context: context
+
+    def tearDown(self):
+        (handlers.class_from_type, handlers.user_sources,
+         handlers.get_main_obj, handlers.render_to_string) = self.saved
+
+    def analysis(self, start_date, service_name):
+        return FakeDocument(object_id='1', object_type='Sample',
+                            start_date=start_date, analyst='analyst',
+                            service_name=service_name, version='1.0',
+                            results=[])
+
+    def pages(self, limit, **kwargs):
+        entries = []
+        cursor = None
+        while True:
+            page = handlers.get_timeline_page('Sample', '1', 'analyst',
+                                              cursor=cursor, limit=limit,
+                                              **kwargs)
+            self.assertTrue(page['success'])
+            entries.extend(page['entries'])
+            cursor = page['cursor']
+            if not cursor:
+                return entries
+
+    def test_analysis_date(self):
+        self.assertEqual(handlers.analysis_date('2015-06-01 12:00:00.000250'),
+                         datetime.datetime(2015, 6, 1, 12, 0, 0, 250))
+        self.assertEqual(handlers.analysis_date('2015-06-01 12:00:00'),
+                         datetime.datetime(2015, 6, 1, 12, 0, 0))
+        self.assertEqual(handlers.analysis_date('not a date'), None)
+        self.assertEqual(handlers.analysis_date(None), None)
+
+    def test_paged_timeline(self):
+        entries = self.pages(2)
+        services = [e['html'] for e in entries if 'ran' in e['html']]
+        self.assertEqual(len(services), 5)
+        for (n, html) in enumerate(reversed(services)):
+            self.assertTrue('service%d' % n in html)
+        dates = [e['date'] for e in entries]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_date_range(self):
+        start = self.base + datetime.timedelta(hours=1)
+        end = self.base + datetime.timedelta(hours=3)
+        entries = self.pages(10, start=start, end=end)
+        self.assertEqual(len(entries), 2)
+        self.assertTrue('service2' in entries[0]['html'])
+        self.assertTrue('service1' in entries[1]['html'])
+
+    def test_full_timeline(self):
+        result = handlers.generate_timeline('Sample', '1', 'analyst')
+        self.assertTrue(result['success'])
+        days = dict(result['message']['timeline'])
+        self.assertEqual(len(days['2015-06-01']), 5)
@@ -1,5 +1,7 @@
 from django.conf.urls import patterns
 
 urlpatterns = patterns('timeline_service.views',
+    (r'^api/campaign/(?P<cid>.+?)/$', 'get_campaign_timeline_page'),
+    (r'^api/(?P<ctype>.+?)/(?P<cid>.+?)/$', 'get_timeline_page'),
     (r'^(?P<ctype>.+?)/(?P<cid>.+?)/$', 'get_timeline'),
 )
@@ -1,4 +1,5 @@
 import json
+import datetime
 
 from django.contrib.auth.decorators import user_passes_test
 from django.shortcuts import HttpResponse
@@ -10,3 +11,62 @@ from . import handlers
 def get_timeline(request, ctype, cid):
     result = handlers.generate_timeline(ctype, cid, "%s" % request.user)
     return HttpResponse(json.dumps(result), mimetype="application/json")
+
+@user_passes_test(user_can_view_data)
+def get_timeline_page(request, ctype, cid):
+    """
+    Get a page of an object's timeline as JSON, newest entries first.
+
+    Takes optional GET parameters "start" and "end" (YYYY-MM-DD, both
+    inclusive), "cursor" (from the previous page) and "limit".
+    """
+
+    try:
+        params = page_params(request)
+    except ValueError, e:
+        result = {'success': False,
+                  'message': str(e)}
+        return HttpResponse(json.dumps(result), mimetype="application/json")
+
+    result = handlers.get_timeline_page(ctype, cid, "%s" % request.user,
+                                        **params)
+    return HttpResponse(json.dumps(result), mimetype="application/json")
+
+@user_passes_test(user_can_view_data)
+def get_campaign_timeline_page(request, cid):
+    """
+    Get a page of the merged timeline of a Campaign and every object tagged
+    with it, as JSON. Takes the same GET parameters as get_timeline_page.
+    """
+
+    try:
+        params = page_params(request)
+    except ValueError, e:
+        result = {'success': False,
+                  'message': str(e)}
+        return HttpResponse(json.dumps(result), mimetype="application/json")
+
+    result = handlers.get_campaign_timeline_page(cid, "%s" % request.user,
+                                                 **params)
+    return HttpResponse(json.dumps(result), mimetype="application/json")
+
+def page_params(request):
+    """
+    Parse the paging GET parameters of a request, raising ValueError if any
+    are invalid.
+    """
+
+    start = request.GET.get('start')
+    if start:
+        start = handlers.parse_date(start)
+    end = request.GET.get('end')
+    if end:
+        end = handlers.parse_date(end)
+        if 'T' not in request.GET['end']:
+            # A bare date includes the whole day.
+            end += datetime.timedelta(days=1)
+    limit = int(request.GET.get('limit', handlers.TIMELINE_PAGE_SIZE))
+    return {'start': start or None,
+            'end': end or None,
+            'cursor': request.GET.get('cursor'),
+            'limit': limit}
@@ -12,6 +12,7 @@ from hashlib import md5
 from crits.samples.handlers import handle_file
 
 from crits.services.core import Service, ServiceConfigError
+from header_sniff import read_header
 
 from crits.vocabulary.relationships import RelationshipTypes
 #from . import forms
@@ -32,11 +33,9 @@ class unswfService(Service):
     def valid_for(obj):
         if obj.filedata.grid_id == None:
             raise ServiceConfigError("Missing filedata.")
-        data = obj.filedata.read(4)
+        data = read_header(obj, 4)
         if len(data) < 4:
             raise ServiceConfigError("Need at least 4 bytes.")
-        # Reset the read pointer.
-        obj.filedata.seek(0)
         'We only care about the compressed flash files'
         if not data[:3] in ['CWS','ZWS']:
             raise ServiceConfigError("Not a valid compressed Flash file.")
@@ -1,4 +1,5 @@
 from crits.services.core import Service, ServiceConfigError
+from header_sniff import read_header
 from zip_meta import ZipParser
 
 class ZipMetaService(Service):
@@ -17,10 +18,7 @@ class ZipMetaService(Service):
         if obj.filedata.grid_id == None:
             raise ServiceConfigError("Missing filedata.")
 
-        data = obj.filedata.read()
-        # Reset the read pointer.
-        obj.filedata.seek(0)
-
+        data = read_header(obj, 4)
         if len(data) < 4:
             raise ServiceConfigError("Not enough filedata.")
 
@@ -28,7 +26,9 @@ class ZipMetaService(Service):
             raise ServiceConfigError("Not a zip file.")
 
     def run(self, obj, config):
-        zparser = ZipParser(obj.filedata.read())
+        # Hand the parser the file object so only the end of central
+        # directory tail, the central directory and local headers are read.
+        zparser = ZipParser(obj.filedata)
         parsedZip =  zparser.parseZipFile()
         if not parsedZip:
             self._error("Could not parse document as a zip file")
@@ -281,16 +281,16 @@ class Zip64Extended():
         #Order is Fixed
         start = 4
         if zip64Flags["ucZip64"]:
-            parsedBlock["OriginalSize"] = struct.unpack("<Q", extraField[start:start + 8])[0],
+            parsedBlock["OriginalSize"] = struct.unpack("<Q", extraField[start:start + 8])[0]
             start += 8
         if zip64Flags["cZip64"]:
-            parsedBlock["CompressedSize"] = struct.unpack("<Q", extlraField[start:start + 8])[0],
+            parsedBlock["CompressedSize"] = struct.unpack("<Q", extraField[start:start + 8])[0]
             start += 8
         if zip64Flags["offsetZip64"]:
-            parsedBlock["RelativeOffset"] = struct.unpack("<Q", extraField[start:start + 8])[0],
+            parsedBlock["RelativeOffset"] = struct.unpack("<Q", extraField[start:start + 8])[0]
             start += 8
         if zip64Flags["diskZip64"]:
-            parsedBlock["StartDisk"] = struct.unpack("<I", extraField[start:start + 4])[0],
+            parsedBlock["StartDisk"] = struct.unpack("<I", extraField[start:start + 4])[0]
             start += 4
 
         return parsedBlock
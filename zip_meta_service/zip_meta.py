@@ -9,25 +9,133 @@ class ZipParser():
 
     zipLDMagic = "\x50\x4b\x03\x04" #Local Directory
     zipCDMagic = "\x50\x4b\x01\x02" #Central Directory
+    zipEndMagic = "\x50\x4b\x05\x06" #End Of Central Directory
+    zip64EndMagic = "\x50\x4b\x06\x06" #Zip64 End Of Central Directory
+    zip64LocatorMagic = "\x50\x4b\x06\x07" #Zip64 End Of Central Directory Locator
+
+    internalNames = {
+        0:    "ASCII/text file",
+        1:    "reserved",                                       #pkware reserved
+        2:    "control field records precede logical records",  #pkware reserved
+        3:    "unused"
+    }
+
+    compMethods = {
+        0:      "No Compression/Stored",
+        1:      "Shrunk",
+        2:      "Reduced With Compression Factor 1",
+        3:      "Reduced With Compression Factor 2",
+        4:      "Reduced With Compression Factor 3",
+        5:      "Reduced With Compression Factor 4",
+        6:      "Imploded",
+        7:      "Reserved",
+        8:      "Deflated",
+        9:      "Enhanced Deflated",
+        10:     "PKware Dcl Imploded",
+        11:     "Reserved",
+        12:     "Compressed Using Bzip2",
+        13:     "Reserved",
+        14:     "LZMA",
+        15:     "Reserved",
+        16:     "Reserved",
+        17:     "Reserved",
+        18:     "Compressed Using IBM Terse",
+        19:     "IBM LZ77 Z",
+        98:     "PPMD Version I, Revision 1"
+    }
+
+    flagNames = {
+        0:  "Encrypted File",
+        1:  "Compression Option",
+        2:  "Compression Option",
+        3:  "Data Descriptor",
+        4:  "Enhanced Deflation",
+        5:  "Compressed Patched Data",
+        6:  "Strong Encryption",
+        7:  "Unused",
+        8:  "Unused",
+        9:  "Unused",
+        10: "Unused",
+        11: "Language Encoding",
+        12: "Reserved",
+        13: "Mask Header Values",
+        14: "Reserved",
+        15: "Reserved"
+    }
+
+    versionNameDict = {
+        0   :"MS:DOS and OS/2 (FAT / VFAT / FAT32 file systems)",
+        1   :"Amiga",
+        2   :"OpenVMS",
+        3   :"UNIX",
+        4   :"VM/CMS",
+        5   :"Atari ST",
+        6   :"OS/2 H.P.F.S.",
+        7   :"Macintosh",
+        8   :"Z:System",
+        9   :"CP/M",
+        10  :"Windows NTFS",
+        11  :"MVS (OS/390 : Z/OS)",
+        12  :"VSE",
+        13  :"Acorn Risc",
+        14  :"VFAT",
+        15  :"alternate MVS",
+        16  :"BeOS",
+        17  :"Tandem",
+        18  :"OS/400",
+        19  :"OS/X (Darwin)",
+        20  :"unused",
+    }
+
+    #Fixed 46 byte central directory entry header:
+    #  0 signature,  1 version made by (version),  2 version made by (os),
+    #  3 required version,  4 flags,  5 compression,  6 modify date/time,
+    #  7 crc,  8 compressed size,  9 uncompressed size,  10 file name length,
+    #  11 extra field length,  12 comment length,  13 file start disk,
+    #  14 internal attributes,  15 external attributes,  16 relative offset
+    cdEntryHeader = struct.Struct("<4sBBHHHI4sIIHHHHHII")
+
+    efMappings = extra_field_parse.HeaderIdMapping().HeaderIds()
+
+    #Bytes read at a time while walking local headers, so headers of small
+    #neighbouring entries are served from one read
+    localHeaderWindow = 64 * 1024
+
+    def readCDEntry(self):
+        #Unpack the header of the entry at cdOffset in place, or return
+        #None if there is no complete entry there.
+        if self.cdOffset + self.cdEntryHeader.size > len(self.centralDirectory):
+            return None
+        self.cdEntry = self.cdEntryHeader.unpack_from(self.centralDirectory, self.cdOffset)
+        if self.cdEntry[0] != self.zipCDMagic:
+            return None
+        return self.cdEntry
+
+    def cdBytes(self, start, end):
+        #Copy out only the requested bytes of the current entry
+        return self.centralDirectory[self.cdOffset + start:self.cdOffset + end].tobytes()
+
+    def getCDEntryLength(self):
+        return (46 + self.getFileNameLength() + self.getExtraFieldCDLength() +
+                self.getCommentLength())
 
     def getFileComment(self):
         if self.getCommentLength() == 0:
             return None
         startPosition = (46 + self.getFileNameLength() + self.getExtraFieldCDLength())
-        return self.centralDirectory[startPosition:(startPosition + self.getCommentLength())]
+        return self.cdBytes(startPosition, startPosition + self.getCommentLength())
 
     def getCommentLength(self):
-        return struct.unpack("<H",self.centralDirectory[32:34])[0]
+        return self.cdEntry[12]
 
     def parseExtraField(self,extraField):
         parsedExtraField = []
-        efParser = extra_field_parse.HeaderIdMapping()
-        efMappings = efParser.HeaderIds()
+        efMappings = self.efMappings
         while extraField:
             blockMagic = extraField[0:2]
             blockSize = struct.unpack("<H", extraField[2:4])[0]
             efBlock = extraField[:4+blockSize]
-            if blockMagic in efMappings.keys():
+            if blockMagic in efMappings:
                 #Mapping Header Is known (may or may not have been parsed)
                 parser = efMappings[blockMagic]["parseField"]()
                 parsedExtraField.append(parser.parse(efBlock,self.zip64Flag))
@@ -38,88 +146,111 @@ class ZipParser():
             extraField = extraField[4+blockSize:]
         return parsedExtraField
 
+    def getZip64ExtraField(self):
+        #Zip64 extended information lives in the central directory copy of
+        #the extra field
+        startPosition = (46 + self.getFileNameLength())
+        extraField = self.cdBytes(startPosition, startPosition + self.getExtraFieldCDLength())
+        while len(extraField) >= 4:
+            blockMagic = extraField[0:2]
+            blockSize = struct.unpack("<H", extraField[2:4])[0]
+            if blockMagic == "\x01\x00":
+                parser = self.efMappings[blockMagic]["parseField"]()
+                return parser.parse(extraField[:4 + blockSize], self.zip64Flag)
+            extraField = extraField[4 + blockSize:]
+        return {}
+
+    def getLocalHeaderOffset(self):
+        #Handler for case where offset cannot be found in central Directory
+        if self.cdEntry[16] == 0xFFFFFFFF:
+            return self.getZip64ExtraField().get("RelativeOffset")
+        return self.cdEntry[16]
+
     def getExtraField(self):
-        if self.getExtraFieldLDLength() == 0:
+        extraField = self.localExtraFields.get(self.getLocalHeaderOffset())
+        if not extraField:
             return None
-        #Handler for case where offset cannot be found in central Directory
-        if self.zip64Flag["offsetZip64"]:
-            #If Offset flag present use central directory to find offset in extrafield
-            startPosition = (46 + self.getFileNameLength())
-            extraField = self.centralDirectory[startPosition:(startPosition + self.getExtraFieldCDLength())]
-
-            efParser = extra_field_parse.HeaderIdMapping()
-            efMappings = efParser.HeaderIds()
-
-            start = extraField.find("\x01\x00")
-            blockMagic = extraField[start:start + 2]
-            blockSize = struct.unpack("<H", extraField[start + 2:start + 4])[0]
-            parser = efMappings[blockMagic]["parseField"]()
-            zip64 = parser.parse(efBlock,self.zip64Flag)
-            offset = zip64["RelativeOffset"]
-
-            startPosition = (offset + 30 + self.getFileNameLength())
-            extraField = self.localDirectory[startPosition:(startPosition + self.getExtraFieldLDLength())]
-        else:
-            startPosition = (self.getRelativeOffset() + 30 + self.getFileNameLength())
-            extraField = self.localDirectory[startPosition:(startPosition + self.getExtraFieldLDLength())]
         return self.parseExtraField(extraField)
 
     def getExtraFieldCDLength(self): #Central Directory
-        length = struct.unpack("<H", self.centralDirectory[30:32])[0]
+        length = self.cdEntry[11]
         return length
 
     def getExtraFieldLDLength(self): #Local Directory
-        length = struct.unpack("<H", self.localDirectory[self.getRelativeOffset()
-                                +28:self.getRelativeOffset()+30])[0]
-        return length
+        return len(self.localExtraFields.get(self.getLocalHeaderOffset(), ""))
+
+    def readLocalExtraFields(self, localHeaders):
+        #Read the extra field of every local header in one forward pass,
+        #reading a window at a time rather than seeking to each header.
+        #localHeaders maps header offsets to central directory name lengths.
+        windowStart = 0
+        window = ""
+        for offset in sorted(localHeaders):
+            if offset + 30 > windowStart + len(window):
+                windowStart = offset
+                window = self.readAt(offset, self.localHeaderWindow)
+            header = window[offset - windowStart:offset - windowStart + 30]
+            if len(header) < 30:
+                continue
+            extraLength = struct.unpack("<H", header[28:30])[0]
+            if extraLength == 0:
+                continue
+            start = offset + 30 + localHeaders[offset]
+            if start + extraLength <= windowStart + len(window):
+                extraField = window[start - windowStart:start - windowStart + extraLength]
+            else:
+                extraField = self.readAt(start, extraLength)
+            self.localExtraFields[offset] = extraField
+        return self.localExtraFields
 
     def getModifyDate(self):
         #MS-DOS Epoch
-        if struct.unpack("<I",self.centralDirectory[12:16])[0] == 0:
+        if self.cdEntry[6] == 0:
             return None
         else:
-            dateTime = struct.unpack("<I",self.centralDirectory[12:16])[0]
+            dateTime = self.cdEntry[6]
+        #Archives tend to share a handful of timestamps across entries
+        if dateTime in self.modifyDates:
+            return self.modifyDates[dateTime]
         secs  = (dateTime & 0x1F) * 2
         mins  = (dateTime & 0x7E0) >> 5
         hours = (dateTime & 0xF800) >> 11
         day   = (dateTime & 0x1F0000) >> 16
         month = (dateTime & 0x1E00000) >> 21
         year  = ((dateTime & 0xFE000000) >> 25) + 1980
-        return datetime(year, month, day, hours, mins, secs).strftime("%B %d, %Y %H:%M:%S.%f")
+        modifyDate = datetime(year, month, day, hours, mins, secs).strftime("%B %d, %Y %H:%M:%S.%f")
+        self.modifyDates[dateTime] = modifyDate
+        return modifyDate
 
     def getFileName(self):
         if self.getFileNameLength() == 0:
             return None
-        return self.centralDirectory[46:(46 + self.getFileNameLength())]
+        return self.cdBytes(46, 46 + self.getFileNameLength())
 
     def getFileNameLength(self):
-        return struct.unpack("<H",self.centralDirectory[28:30])[0]
+        return self.cdEntry[10]
 
     def getRelativeOffset(self):
-        if struct.unpack("<I",self.centralDirectory[42:46])[0] == 0xFFFFFFFF:
+        if self.cdEntry[16] == 0xFFFFFFFF:
             self.zip64Flag["offsetZip64"] = True
             return "Zip 64. See Extra Field For Relative Offset"
-        return struct.unpack("<I",self.centralDirectory[42:46])[0]
+        return self.cdEntry[16]
 
     def getFileExternalAttributes(self):
-        return struct.unpack("<I",self.centralDirectory[38:42])[0]
+        return self.cdEntry[15]
 
     def getInternalAttributeNames(self,bit):
-        internalNames = {
-        0:    "ASCII/text file",
-        1:    "reserved",                                       #pkware reserved
-        2:    "control field records precede logical records",  #pkware reserved
-        3:    "unused"
-        }
-        if bit in xrange(3,16):
-            return internalNames[3]
-        elif bit in internalNames:
-            return internalNames[bit]
+        if 3 <= bit < 16:
+            return self.internalNames[3]
+        elif bit in self.internalNames:
+            return self.internalNames[bit]
         else:
             return "{} Is An Unknown Internal Attribute".format(bit)
 
     def getInternalAttributes(self):
-        internalAttributes = struct.unpack("<H",self.centralDirectory[36:38])[0]
+        internalAttributes = self.cdEntry[14]
+        if not internalAttributes:
+            return None
         setAttributes = []
         for bit in xrange(0,16):
             if internalAttributes & (2**bit) > 0:
@@ -129,82 +260,43 @@ class ZipParser():
         return setAttributes
 
     def getFileStartDisk(self):
-        if struct.unpack("<H",self.centralDirectory[34:36])[0] == 0xFFFF:
+        if self.cdEntry[13] == 0xFFFF:
             self.zip64Flag["diskZip64"] = True
             return "Zip 64. See Extra Field For File Start Disk"
-        return struct.unpack("<H",self.centralDirectory[34:36])[0]
+        return self.cdEntry[13]
 
     def getCompressedSize(self):
-        if struct.unpack("<I",self.centralDirectory[20:24])[0] == 0xFFFFFFFF:
+        if self.cdEntry[8] == 0xFFFFFFFF:
              self.zip64Flag["cZip64"] = True
              return "Zip 64. See Extra Field For Compressed Size"
-        return struct.unpack("<I",self.centralDirectory[20:24])[0]
+        return self.cdEntry[8]
 
     def getUncompressedSize(self):
-        if struct.unpack("<I",self.centralDirectory[24:28])[0] == 0xFFFFFFFF:
+        if self.cdEntry[9] == 0xFFFFFFFF:
             self.zip64Flag["ucZip64"] = True
             return "Zip 64. See Extra Field For Uncompressed Size"
-        return struct.unpack("<I",self.centralDirectory[24:28])[0]
+        return self.cdEntry[9]
 
     def compressionMethodName(self):
-        method = struct.unpack("<H",self.centralDirectory[10:12])[0]
-        compMethods = {
-        0:      "No Compression/Stored",
-        1:      "Shrunk",
-        2:      "Reduced With Compression Factor 1",
-        3:      "Reduced With Compression Factor 2",
-        4:      "Reduced With Compression Factor 3",
-        5:      "Reduced With Compression Factor 4",
-        6:      "Imploded",
-        7:      "Reserved",
-        8:      "Deflated",
-        9:      "Enhanced Deflated",
-        10:     "PKware Dcl Imploded",
-        11:     "Reserved",
-        12:     "Compressed Using Bzip2",
-        13:     "Reserved",
-        14:     "LZMA",
-        15:     "Reserved",
-        16:     "Reserved",
-        17:     "Reserved",
-        18:     "Compressed Using IBM Terse",
-        19:     "IBM LZ77 Z",
-        98:     "PPMD Version I, Revision 1"
-        }
-        if method in compMethods:
-            return compMethods[method]
+        method = self.cdEntry[5]
+        if method in self.compMethods:
+            return self.compMethods[method]
         else:
             return "{} Is An Unknown Compression Method".format(method)
 
     def getCRC(self):
-        return binascii.hexlify(self.centralDirectory[16:20])
+        return binascii.hexlify(self.cdEntry[7])
 
     def getFlagNames(self,flag):
-        flagNames = {
-        0:  "Encrypted File",
-        1:  "Compression Option",
-        2:  "Compression Option",
-        3:  "Data Descriptor",
-        4:  "Enhanced Deflation",
-        5:  "Compressed Patched Data",
-        6:  "Strong Encryption",
-        7:  "Unused",
-        8:  "Unused",
-        9:  "Unused",
-        10: "Unused",
-        11: "Language Encoding",
-        12: "Reserved",
-        13: "Mask Header Values",
-        14: "Reserved",
-        15: "Reserved"
-        }
-        if flag in flagNames:
-            return flagNames[flag]
+        if flag in self.flagNames:
+            return self.flagNames[flag]
         else:
             return "{} Is An Unknown Flag Name".format(flag)
 
     def getFlags(self):
-        flags = struct.unpack("<H",self.centralDirectory[8:10])[0]
+        flags = self.cdEntry[4]
+        if not flags:
+            return None
         setFlags = []
         for i in xrange(0,16):
         	if (flags & (2**i)):
@@ -214,41 +306,18 @@ class ZipParser():
         return setFlags
 
     def getRequiredVersion(self):
-        return (struct.unpack("<H",self.centralDirectory[6:8])[0] * .1)
+        return (self.cdEntry[3] * .1)
 
     def getVersionMadeByName(self,highByte):
-        versionNameDict = {
-        0   :"MS:DOS and OS/2 (FAT / VFAT / FAT32 file systems)",
-        1   :"Amiga",
-        2   :"OpenVMS",
-        3   :"UNIX",
-        4   :"VM/CMS",
-        5   :"Atari ST",
-        6   :"OS/2 H.P.F.S.",
-        7   :"Macintosh",
-        8   :"Z:System",
-        9   :"CP/M",
-        10  :"Windows NTFS",
-        11  :"MVS (OS/390 : Z/OS)",
-        12  :"VSE",
-        13  :"Acorn Risc",
-        14  :"VFAT",
-        15  :"alternate MVS",
-        16  :"BeOS",
-        17  :"Tandem",
-        18  :"OS/400",
-        19  :"OS/X (Darwin)",
-        20  :"unused",
-        }
-        if highByte in xrange(20,256):
-            return versionNameDict[20]
-        elif highByte in versionNameDict:
-            return versionNameDict[highByte]
+        if 20 <= highByte < 256:
+            return self.versionNameDict[20]
+        elif highByte in self.versionNameDict:
+            return self.versionNameDict[highByte]
         else:
             return "{} Is An Unknown Version Name".format(highByte)
 
     def getVersionMadeBy(self):#MOD THIS FOR MINOR
-        versionBytes = (struct.unpack("<BB",self.centralDirectory[4:6]))
+        versionBytes = self.cdEntry[1:3]
         return self.getVersionMadeByName(versionBytes[1]), (float(versionBytes[0]) * .1)
 
     def parseCentralDirectory(self):
@@ -272,24 +341,118 @@ class ZipParser():
 
         return centralDirectory
 
+    def resetZip64Flags(self):
+        #Which fields of the current entry are stored in its Zip64 extra field
+        self.zip64Flag = {"ucZip64"     : self.cdEntry[9] == 0xFFFFFFFF,
+                          "cZip64"      : self.cdEntry[8] == 0xFFFFFFFF,
+                          "offsetZip64" : self.cdEntry[16] == 0xFFFFFFFF,
+                          "diskZip64"   : self.cdEntry[13] == 0xFFFF
+                          }
+
     def parseZipFile(self):
         #Because a central directory is an extended version of a local
         #directory and thus, contains more data, we parse it rather than
         #the local directory.
-        if not self.centralDirectory.startswith(self.zipCDMagic):
+        #Entries are walked by their declared lengths so a magic value
+        #inside a file name or extra field cannot desync the parser.
+        self.cdOffset = 0
+        if not self.readCDEntry():
             return None
-        start = 1
+        centralDirectory = self.centralDirectory
+        unpackEntry = self.cdEntryHeader.unpack_from
+        lastEntry = len(centralDirectory) - self.cdEntryHeader.size
+        #Local headers are only needed for their extra fields, so gather
+        #those first in offset order, keeping each unpacked entry header
+        #for the second pass.
+        self.localExtraFields = {}
+        localHeaders = {}
+        entries = []
+        offset = 0
+        while offset <= lastEntry:
+            entry = unpackEntry(centralDirectory, offset)
+            if entry[0] != self.zipCDMagic:
+                break
+            entries.append((offset, entry))
+            if entry[16] != 0xFFFFFFFF:
+                localHeaders[entry[16]] = entry[10]
+            else:
+                self.cdOffset = offset
+                self.cdEntry = entry
+                self.resetZip64Flags()
+                localOffset = self.getLocalHeaderOffset()
+                if localOffset is not None:
+                    localHeaders[localOffset] = entry[10]
+            offset += 46 + entry[10] + entry[11] + entry[12]
+        self.readLocalExtraFields(localHeaders)
+        localExtraFields = self.localExtraFields
+        #Entries without Zip64 fields are built here directly from their
+        #header, with the values most entries share (version, flags,
+        #compression) worked out once per archive. Anything unusual
+        #goes through parseCentralDirectory.
+        sharedFields = {}
+        modifyDates = self.modifyDates
+        hexlify = binascii.hexlify
         parsedFiles = []
-        while start > 0:
-            parsedFiles.append(self.parseCentralDirectory())
-            start = self.centralDirectory[1:].find(self.zipCDMagic) +1
-            self.centralDirectory = self.centralDirectory[start:]
+        for (offset, entry) in entries:
+            self.cdOffset = offset
+            self.cdEntry = entry
+            if (entry[8] == 0xFFFFFFFF or entry[9] == 0xFFFFFFFF or
+                entry[16] == 0xFFFFFFFF or entry[13] == 0xFFFF or entry[14]):
+                self.resetZip64Flags()
+                parsedFiles.append(self.parseCentralDirectory())
+                continue
+            key = entry[1:6]
+            shared = sharedFields.get(key)
+            if shared is None:
+                shared = sharedFields[key] = (self.getVersionMadeBy(),
+                                              self.getRequiredVersion(),
+                                              self.getFlags(),
+                                              self.compressionMethodName())
+            start = offset + 46
+            nameLength = entry[10]
+            fileName = None
+            if nameLength:
+                fileName = centralDirectory[start:start + nameLength].tobytes()
+            comment = None
+            if entry[12]:
+                start += nameLength + entry[11]
+                comment = centralDirectory[start:start + entry[12]].tobytes()
+            extraField = localExtraFields.get(entry[16])
+            if extraField:
+                self.resetZip64Flags()
+                extraField = self.parseExtraField(extraField)
+            else:
+                extraField = None
+            parsedFiles.append({
+            "VersionMadeBy"             :shared[0],
+            "ZipRequiredVersion"        :shared[1],
+            "ZipBitFlag"                :shared[2],
+            "ZipCRC"                    :hexlify(entry[7]),
+            "ZipCompression"            :shared[3],
+            "ZipUncompressedSize"       :entry[9],
+            "ZipCompressedSize"         :entry[8],
+            "FileStartDisk"             :entry[13],
+            "InternalAttributes"        :None,
+            "ExternalAttributes"        :entry[15],
+            "RelativeOffset"            :entry[16],
+            "ZipFileName"               :fileName,
+            "ZipModifyDate"             :modifyDates[entry[6]] if entry[6] in modifyDates else self.getModifyDate(),
+            "ZipExtraField"             :extraField,
+            "ZipComments"               :comment
+            })
         return parsedFiles
 
 #***************************END**DIRECTORY**PARSING*****************************
 
+    def readAt(self, offset, length):
+        #Only the requested range is read when parsing from a file object
+        if self.fileobj is None:
+            return self.data[offset:offset + length]
+        self.fileobj.seek(offset)
+        return self.fileobj.read(length)
+
     def getHeaderSignature(self):
-        return self.data[0:4]
+        return self.readAt(0, 4)
 
     def getCDComment(self):
         if self.endDirectory[22:(22 + self.getCDCommentLength())] == 0:
@@ -301,15 +464,23 @@ class ZipParser():
         return struct.unpack("<H",self.endDirectory[20:22])[0]
 
     def getCDStartOffset(self):
+        if self.zip64EndDirectory:
+            return struct.unpack("<Q",self.zip64EndDirectory[48:56])[0]
         return struct.unpack("<I",self.endDirectory[16:20])[0]
 
     def getSizeOfCD(self):
+        if self.zip64EndDirectory:
+            return struct.unpack("<Q",self.zip64EndDirectory[40:48])[0]
         return struct.unpack("<I",self.endDirectory[12:16])[0]
 
     def getTotalNumberOfCDs(self):
+        if self.zip64EndDirectory:
+            return struct.unpack("<Q",self.zip64EndDirectory[32:40])[0]
         return struct.unpack("<H",self.endDirectory[10:12])[0]
 
     def getNumberOfCDs(self): #On Disk
+        if self.zip64EndDirectory:
+            return struct.unpack("<Q",self.zip64EndDirectory[24:32])[0]
         return struct.unpack("<H",self.endDirectory[8:10])[0]
 
     def getStartOfCDDisk(self):
@@ -318,9 +489,42 @@ class ZipParser():
     def getNumberOfDisk(self):
         return struct.unpack("<H",self.endDirectory[4:6])[0]
 
+    def findEndDirectory(self):
+        #The end of central directory record is the last 22 bytes of the
+        #file followed by a comment of at most 64k, so only that tail is
+        #read and searched backwards.
+        tailSize = min(self.size, 22 + 0xFFFF)
+        tailStart = self.size - tailSize
+        tail = self.readAt(tailStart, tailSize)
+        start = tail.rfind(self.zipEndMagic)
+        while start >= 0:
+            if len(tail) - start >= 22:
+                commentLength = struct.unpack("<H", tail[start + 20:start + 22])[0]
+                if start + 22 + commentLength <= len(tail):
+                    break
+            start = tail.rfind(self.zipEndMagic, 0, start)
+        if start < 0:
+            return None
+        self.endDirectory = tail[start:]
+        #Zip64 archives put a locator right before the end record that
+        #points at the Zip64 end of central directory record.
+        locatorStart = start - 20
+        if locatorStart >= 0:
+            locator = tail[locatorStart:start]
+        elif tailStart + locatorStart >= 0:
+            locator = self.readAt(tailStart + locatorStart, 20)
+        else:
+            locator = ""
+        if locator[:4] == self.zip64LocatorMagic:
+            zip64Offset = struct.unpack("<Q", locator[8:16])[0]
+            zip64End = self.readAt(zip64Offset, 56)
+            if zip64End[:4] == self.zip64EndMagic and len(zip64End) == 56:
+                self.zip64EndDirectory = zip64End
+        return tailStart + start
+
     def parseEndDirectory(self):
-        start = self.data.find("\x50\x4b\x05\x06")
-        self.endDirectory = self.data[start:]
+        if self.endDirectory is None:
+            return None
         endDirectoryDict = {
         "NumberOfDisk"              :self.getNumberOfDisk(),
         "StartOfCDDisk"             :self.getStartOfCDDisk(),
@@ -335,11 +539,33 @@ class ZipParser():
 #***********************END**DIRECTORY**PARSING**ENDS***************************
 
     def __init__(self,data):
-        self.data = data
-        cdStart = self.parseEndDirectory()["CDStartOffset"]
-        cdEnd = cdStart + self.parseEndDirectory()["CDSize"]
-        self.localDirectory = data[:cdStart]
-        self.centralDirectory = data[cdStart:cdEnd]
+        #data may be the whole file as a string, or a seekable file object
+        #(such as a GridFS file) in which case only the end of central
+        #directory tail, the central directory and local headers are read.
+        if hasattr(data, "read"):
+            self.fileobj = data
+            self.data = None
+            self.fileobj.seek(0, 2)
+            self.size = self.fileobj.tell()
+        else:
+            self.fileobj = None
+            self.data = data
+            self.size = len(data)
+        self.endDirectory = None
+        self.zip64EndDirectory = None
+        self.findEndDirectory()
+        endDirectory = self.parseEndDirectory()
+        if endDirectory:
+            cdStart = endDirectory["CDStartOffset"]
+            self.centralDirectory = memoryview(self.readAt(cdStart, endDirectory["CDSize"]))
+        else:
+            self.centralDirectory = memoryview("")
+        # Offset and header of the central directory entry being parsed
+        self.cdOffset = 0
+        self.cdEntry = None
+        self.modifyDates = {}
+        # Local header offset -> raw extra field, for entries that have one
+        self.localExtraFields = {}
         # Flags needed to denote a zip64 file type
         self.zip64Flag = {"ucZip64"     : False,
                           "cZip64"      : False,